@@ -0,0 +1,485 @@
+'''
+This program checks the vectorized and incremental code paths of the monitor against plain python references on
+synthetic data, so a change to one of the numerical kernels that changes a result is caught before it reaches a report.
+It needs neither the research database nor a config.py: every run writes a config for a temporary workspace (the
+example config with the settings below) and runs the checks in a fresh process started in that workspace, once for
+each outlier mode.
+
+The checks:
+- states 1-4 of classify_matrix against a per-sensor loop over the samples (the logic of the original per sensor
+  health functions), and the flatline and spike features against loops over the valid samples
+- sensor_features over many small chunks against a single chunk, so the carry between chunks is covered
+- rolling_outliers against the mean and SD of every window computed directly
+- drift_tracker.update_stats over several batches (also overlapping ones with late rows) against one batch and
+  against numpy
+- LiveWindow polled at irregular steps with late rows against classify_samples on the same window
+- state_history.append_states given the runs out of order against the same runs in order
+- the "samples" and "features" fetch modes on a synthetic bench bay (see bench/synthetic.py) with -9999 nulls and NULL
+  datavalues, which have to give the same sample counts and states
+
+Usage: python -m bench.regression
+'''
+
+import argparse
+import datetime
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#config values of the checks, on top of config_example.py
+REGRESSION_CONFIG = '''
+#regression settings, see bench/regression.py
+sensor_types = ["5TM", "MPS-2"]
+sample_interval_minutes = 15
+outlier_mode = {outlier_mode!r}
+flatline_hours = 3
+spike_detection = True
+drift_tracking = False
+telemetry = False
+state_history_db = "state_history.sqlite"
+fetch_cache = False
+daily_rollups = False
+'''
+
+OUTLIER_MODES = ["range", "rolling"]
+
+#minutes between the synthetic samples, as in the config above
+INTERVAL_MINUTES = 15
+
+
+def synthetic_values(rng, sensor_type, n_sensors, n_times):
+    '''
+    Generates a sensors x time matrix of one sensor type with every case the states are found from: missing samples,
+    dead sensors, null samples, out of range samples, flat stretches and spikes, reported to 0.1 like the real sensors
+
+    Inputs:
+    rng: numpy random Generator
+
+    sensor_type: SensorType
+
+    n_sensors, n_times: shape of the matrix
+
+    Outputs:
+    the numpy float64 matrix, NaN where a sensor has no sample
+    '''
+    low, high = sensor_type.valid_range
+    span = high - low
+
+    base = rng.uniform(low + 0.05 * span, high - 0.05 * span, size=(n_sensors, 1))
+    values = np.round(base + rng.normal(0, 0.002 * span, size=(n_sensors, n_times)), 1)
+
+    for i in range(n_sensors):
+        kind = rng.random()
+        if kind < 0.2:
+            #a flat stretch of a random length
+            length = int(rng.integers(4, 30))
+            start = int(rng.integers(0, max(1, n_times - length)))
+            values[i, start:start + length] = values[i, start]
+        elif kind < 0.3 and sensor_type.spike_limit is not None:
+            values[i, rng.integers(0, n_times)] += rng.choice([-2, 2]) * sensor_type.spike_limit
+        elif kind < 0.35:
+            values[i, rng.integers(0, n_times)] = rng.choice([low - 1, high])
+        elif kind < 0.4:
+            values[i, rng.random(n_times) < 0.05] = sensor_type.null_value
+        elif kind < 0.45:
+            values[i] = sensor_type.null_value
+        elif kind < 0.5:
+            values[i] = np.nan
+
+    #samples that are not in the database at all
+    values[rng.random((n_sensors, n_times)) < 0.03] = np.nan
+    return values
+
+
+def reference_state(row, sensor_type):
+    #states 1-4 of one sensor from a loop over its samples, the NaN (no sample) entries are left out
+    low, high = sensor_type.valid_range
+    all_null = True
+    has_null = False
+    has_outlier = False
+
+    for point in row[~np.isnan(row)]:
+        if point != sensor_type.null_value:
+            all_null = False
+        else:
+            has_null = True
+
+        if (point < low or point >= high) and point != sensor_type.null_value:
+            has_outlier = True
+
+    if all_null:
+        return 1
+    if has_null:
+        return 2
+    if has_outlier:
+        return 3
+    return 4
+
+
+def reference_features(row, sensor_type):
+    #longest flat run and number of spikes of one sensor from a loop over its valid samples
+    points = [point for point in row if point == point and point != sensor_type.null_value]
+    exempt = sensor_type.flat_exempt
+
+    longest = 0
+    run = 0
+    n_spike = 0
+    previous = None
+    for point in points:
+        same = previous is not None and round(abs(point - previous), 6) <= sensor_type.flat_tolerance
+        if exempt is not None and exempt[0] <= point < exempt[1]:
+            same = False
+        run = run + 1 if same else 1
+        longest = max(longest, run)
+
+        if previous is not None and sensor_type.spike_limit is not None and abs(point - previous) > sensor_type.spike_limit:
+            n_spike += 1
+        previous = point
+
+    return longest, n_spike
+
+
+def check_states(rng):
+    '''
+    Checks classify_matrix and sensor_features against the loops above, and many small chunks against one chunk
+
+    Inputs:
+    rng: numpy random Generator
+
+    Outputs:
+    a list of failure messages
+    '''
+    from db import sensor_types as types
+    from detection import sensor_state_detector as detector
+
+    failures = []
+    for sensor_type in types.enabled_types():
+        values = synthetic_values(rng, sensor_type, 300, 200)
+        features = detector.sensor_features(values, sensor_type.name)
+
+        states = detector.states_from_counts(features["n_valid"], features["n_null"], features["n_outlier"])
+        expected = np.array([reference_state(row, sensor_type) for row in values])
+        if not np.array_equal(states, expected):
+            failures.append(sensor_type.name + ": states 1-4 differ for " + str(int((states != expected).sum()))
+                            + " sensors")
+
+        reference = np.array([reference_features(row, sensor_type) for row in values])
+        for column, key in enumerate(["longest_flat", "n_spike"]):
+            if not np.array_equal(features[key], reference[:, column]):
+                failures.append(sensor_type.name + ": " + key + " differs for "
+                                + str(int((features[key] != reference[:, column]).sum())) + " sensors")
+
+        chunk_size = detector.CLASSIFY_CHUNK
+        detector.CLASSIFY_CHUNK = 7
+        try:
+            chunked = detector.sensor_features(values, sensor_type.name)
+        finally:
+            detector.CLASSIFY_CHUNK = chunk_size
+        for key in features:
+            if not np.array_equal(features[key], chunked[key]):
+                failures.append(sensor_type.name + ": " + key + " differs between chunk sizes")
+
+        if not np.array_equal(detector.classify_matrix(values, sensor_type.name),
+                              detector.states_from_counts(features["n_valid"], features["n_null"],
+                                                          features["n_outlier"], *detector.flags(features))):
+            failures.append(sensor_type.name + ": classify_matrix differs from its features")
+
+    return failures
+
+
+def check_rolling_outliers(rng):
+    #rolling_outliers against the mean and SD of the other valid samples of every window, computed directly
+    from db import sensor_types as types
+    from detection import rolling_outliers
+
+    failures = []
+    half_window_hours, n_sd, min_samples = 3.5, 3.0, 8
+    for sensor_type in types.enabled_types():
+        values = synthetic_values(rng, sensor_type, 40, 120)
+        timestamps = np.datetime64("2025-01-01T00:00") + np.arange(120) * np.timedelta64(INTERVAL_MINUTES, "m")
+        #a gap in the timestamps, so the windows are not all the same width
+        timestamps[60:] += np.timedelta64(6, "h")
+
+        flags = rolling_outliers.rolling_outliers(values, timestamps, sensor_type.null_value, half_window_hours, n_sd,
+                                                  min_samples)
+
+        half_window = np.timedelta64(int(half_window_hours * 60), "m")
+        valid = (values == values) & (values != sensor_type.null_value)
+        expected = np.zeros_like(flags)
+        for i in range(values.shape[0]):
+            for j in range(values.shape[1]):
+                if not valid[i, j]:
+                    continue
+                others = valid[i] & (np.abs(timestamps - timestamps[j]) <= half_window)
+                others[j] = False
+                if others.sum() < min_samples:
+                    continue
+                window = values[i, others]
+                deviation = abs(values[i, j] - window.mean())
+                expected[i, j] = deviation > n_sd * window.std() + rolling_outliers.ROUNDING * (abs(values[i, j]) + 1)
+
+        if not np.array_equal(flags, expected):
+            failures.append(sensor_type.name + ": rolling outliers differ at " + str(int((flags != expected).sum()))
+                            + " samples")
+
+    return failures
+
+
+def check_drift(rng):
+    #the running statistics of several batches against one batch, and the long-term ones against numpy
+    from db import sensor_types as types
+    from detection import drift_tracker
+
+    failures = []
+    sensor_type = types.enabled_types()[0]
+    values = synthetic_values(rng, sensor_type, 50, 300)
+    names = ["s" + str(i) for i in range(values.shape[0])]
+    timestamps = np.datetime64("2025-01-01T00:00") + np.arange(300) * np.timedelta64(INTERVAL_MINUTES, "m")
+
+    whole = drift_tracker.empty_stats(names)
+    drift_tracker.update_stats(whole, timestamps, values, sensor_type.valid_range, sensor_type.null_value, 24)
+
+    batches = drift_tracker.empty_stats(names)
+    for start, end in [(0, 17), (17, 150), (150, 151), (151, 300)]:
+        drift_tracker.update_stats(batches, timestamps[start:end], values[:, start:end], sensor_type.valid_range,
+                                   sensor_type.null_value, 24)
+
+    #the rows of some sensors reach the first batch late, and come again with the overlapping second batch
+    late = drift_tracker.empty_stats(names)
+    first = values[:, :150].copy()
+    first[::3, 130:] = np.nan
+    drift_tracker.update_stats(late, timestamps[:150], first, sensor_type.valid_range, sensor_type.null_value, 24)
+    drift_tracker.update_stats(late, timestamps[130:], values[:, 130:], sensor_type.valid_range,
+                               sensor_type.null_value, 24)
+
+    for key in ["count", "mean", "m2", "ewma"]:
+        if not np.allclose(whole[key], batches[key], equal_nan=True):
+            failures.append("drift " + key + " differs between one batch and several")
+        if not np.allclose(whole[key], late[key], equal_nan=True):
+            failures.append("drift " + key + " differs when rows arrive late")
+
+    low, high = sensor_type.valid_range
+    valid = (values == values) & (values != sensor_type.null_value) & (values >= low) & (values < high)
+    for i in range(values.shape[0]):
+        samples = values[i, valid[i]]
+        if len(samples) and not (np.isclose(whole["mean"][i], samples.mean())
+                                 and np.isclose(whole["m2"][i], ((samples - samples.mean()) ** 2).sum())):
+            failures.append("drift mean or m2 of sensor " + names[i] + " differs from numpy")
+            break
+
+    return failures
+
+
+def check_live_window(rng):
+    '''
+    Polls a LiveWindow at irregular steps, with rows that reach the "database" up to 45 minutes late and the last hour
+    queried again every poll like the daemon does, and compares its states with classify_samples on the same window
+
+    Inputs:
+    rng: numpy random Generator
+
+    Outputs:
+    a list of failure messages
+    '''
+    from db import sample_store
+    from db import sensor_types as types
+    from detection import live_window
+    from detection import sensor_state_detector as detector
+
+    failures = []
+    window_minutes, late_minutes = 12 * 60, 60
+    interval = np.timedelta64(INTERVAL_MINUTES, "m")
+
+    for sensor_type in types.enabled_types():
+        n_times = 400
+        values = synthetic_values(rng, sensor_type, 60, n_times)
+        names = ["s" + str(i) for i in range(values.shape[0])]
+        timestamps = np.datetime64("2025-01-01T00:00") + np.arange(n_times) * interval
+        arrival = timestamps + rng.choice([0, 0, 0, 15, 45], size=values.shape) * np.timedelta64(1, "m")
+
+        window = live_window.LiveWindow(names, sensor_type.name, window_minutes, window_minutes // INTERVAL_MINUTES + 1)
+        now = timestamps[0]
+        fetched_until = None
+        for step in rng.choice([15, 15, 30, 45, 120, 600], size=60):
+            now = now + np.timedelta64(int(step), "m")
+            if now > timestamps[-1]:
+                break
+
+            window_start = now - np.timedelta64(window_minutes, "m")
+            query_start = window_start
+            if fetched_until is not None:
+                query_start = max(fetched_until - np.timedelta64(late_minutes, "m"), window_start)
+
+            #the rows of the query window that are in the database at this poll
+            visible = np.where(arrival <= now, values, np.nan)
+            columns = (timestamps >= query_start) & (timestamps <= now)
+            rows = window.rewind(query_start)
+            rows |= window.add(timestamps[columns], visible[:, columns])
+            rows |= window.evict(now)
+            window.classify(rows)
+            fetched_until = now
+
+            columns = (timestamps >= window_start) & (timestamps <= now)
+            expected, _ = detector.classify_samples(
+                sample_store.SampleSet(names, timestamps[columns], visible[:, columns]), sensor_type.name)
+            if expected != window.sensor_health():
+                n_differ = sum(expected[name] != state for name, state in window.sensor_health().items())
+                failures.append(sensor_type.name + ": live window differs for " + str(n_differ) + " sensors at "
+                                + str(now))
+                break
+
+    return failures
+
+
+def check_state_history(rng):
+    #the same runs recorded in time order and shuffled (like record does) have to give the same history
+    from detection import state_history
+
+    def history(order):
+        conn = sqlite3.connect(":memory:")
+        conn.executescript(state_history.SCHEMA)
+        keys = list(range(1, 21))
+        for run in order:
+            with conn:
+                state_history.append_states(conn, keys, runs[run].tolist(), run_times[run])
+                conn.execute("INSERT INTO runs (time) VALUES (?)", (run_times[run],))
+        tables = [conn.execute("SELECT * FROM transitions ORDER BY entity, time").fetchall(),
+                  conn.execute("SELECT * FROM current ORDER BY entity").fetchall()]
+        conn.close()
+        return tables
+
+    run_times = [1000 + 100 * run for run in range(40)]
+    runs = rng.choice([1, 2, 4, 4, 4], size=(40, 20))
+
+    failures = []
+    expected = history(range(40))
+    for _ in range(5):
+        if history(rng.permutation(40)) != expected:
+            failures.append("state history differs when the runs are recorded out of order")
+            break
+
+    return failures
+
+
+def check_fetch_modes(rng):
+    '''
+    Fetches a synthetic bay from the SQLite stand-in of the research database in "samples" and in "features" mode and
+    compares the counts and states 1-4 of every sensor
+
+    Inputs:
+    rng: numpy random Generator
+
+    Outputs:
+    a list of failure messages
+    '''
+    from bench import sqlite_db
+    from bench import synthetic
+    from db import connection
+    from db import data_fetch
+    from db import sensor_types as types
+    from detection import sensor_state_detector as detector
+    from masterlists import masterlist_json_creator
+    from masterlists import sensor_registry
+    import config
+
+    workspace = os.getcwd()
+    end_date = datetime.date(2025, 6, 2)
+    synthetic.generate(workspace, bays=["E"], sensors_per_bay=60, days=1, null_rate=0.01, missing_rate=0.02,
+                       outlier_rate=0.005, down_rate=0.1, removed_rate=0.0, end_date=end_date.isoformat(),
+                       seed=int(rng.integers(1 << 16)))
+
+    config.path_east_masterlist = os.path.join("masterlists", synthetic.masterlist_name("E"))
+    masterlist_json_creator.main("E")
+    sensor_registry.QUERY_STRINGS["E"] = synthetic.load_query_strings(workspace, "E")
+    connection.acquire = sqlite_db.acquire_from(workspace, ["E"])
+
+    window = {"write_files": False, "start_date": end_date - datetime.timedelta(1), "end_date": end_date,
+              "use_cache": False}
+    samples = data_fetch.main_data("E", mode="samples", **window)
+    features = data_fetch.main_data("E", mode="features", **window)
+
+    failures = []
+    for sensor_type in types.enabled_types():
+        sample_set = samples[sensor_type.name]
+        counts = detector.sensor_features(sample_set.values, sensor_type.name)
+        rows = [features[sensor_type.name][name] for name in sample_set.sensor_names]
+
+        expected = {
+            "n_valid": [row["samples"] - row["nulls"] for row in rows],
+            "n_null": [row["nulls"] for row in rows],
+            "n_outlier": [row["outliers"] for row in rows],
+        }
+        for key, values in expected.items():
+            if not np.array_equal(counts[key], values):
+                failures.append(sensor_type.name + ": " + key + " differs between the fetch modes")
+
+        states = detector.states_from_counts(counts["n_valid"], counts["n_null"], counts["n_outlier"])
+        if states.tolist() != [detector.determine_health_features(row) for row in rows]:
+            failures.append(sensor_type.name + ": states differ between the fetch modes")
+
+    return failures
+
+
+CHECKS = [check_states, check_rolling_outliers, check_drift, check_live_window, check_state_history, check_fetch_modes]
+
+
+def run_checks(seed):
+    '''
+    Runs every check in this process, which has to be started in a workspace with its config on the path (see main)
+
+    Inputs:
+    seed: seed of the random data
+
+    Outputs:
+    the number of checks that failed
+    '''
+    import config
+
+    n_failed = 0
+    for check in CHECKS:
+        failures = check(np.random.default_rng(seed))
+        print("{:<28}{:<10}{}".format(check.__name__, config.outlier_mode, "ok" if not failures else "FAILED"))
+        for failure in failures:
+            print("    " + failure)
+        n_failed += bool(failures)
+
+    return n_failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the vectorized and incremental code paths on synthetic data")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workspace", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    #the checks of one outlier mode, started below in a workspace
+    if args.workspace:
+        sys.exit(1 if run_checks(args.seed) else 0)
+
+    with open(os.path.join(REPO_DIR, "config_example.py"), "r") as f:
+        example = f.read()
+
+    failed = False
+    for outlier_mode in OUTLIER_MODES:
+        with tempfile.TemporaryDirectory() as workspace:
+            with open(os.path.join(workspace, "config.py"), "w") as f:
+                f.write(example + REGRESSION_CONFIG.format(outlier_mode=outlier_mode))
+
+            env = dict(os.environ, PYTHONPATH=os.pathsep.join([workspace, REPO_DIR]))
+            result = subprocess.run([sys.executable, "-m", "bench.regression", "--workspace", workspace,
+                                     "--seed", str(args.seed)], cwd=workspace, env=env)
+            failed = failed or result.returncode != 0
+
+    print("FAILED" if failed else "All checks passed")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
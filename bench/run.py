@@ -0,0 +1,246 @@
+'''
+This program runs the benchmarks. For every scale (a multiple of today's number of sensors per bay and a window of
+days) it generates a synthetic workspace (see bench/synthetic.py) and runs the whole pipeline on it in a fresh
+process: the masterlists are parsed from the workbooks, every bay is fetched from the SQLite stand-in of the research
+database (see bench/sqlite_db.py), the states are detected and the report is sent to a local SMTP sink (see
+bench/smtp_sink.py). The stage timings come from the run telemetry (see telemetry.py); the totals of each stage are
+printed as a table and appended to data/bench/results.jsonl, so the numbers of different commits can be compared.
+
+The benchmarks do not need a config.py in the repository: each run imports the config written into its workspace,
+and without one the generator falls back to config_example.py for the sensor type table.
+
+Usage: python -m bench.run --sensors 1 10 --days 1 30
+'''
+
+import argparse
+import datetime
+import importlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+#the generator only needs the sensor type table and the masterlist layout, which the example config is enough for
+try:
+    import config
+except ModuleNotFoundError as e:
+    if e.name != "config":
+        raise
+    sys.modules["config"] = importlib.import_module("config_example")
+
+from bench import synthetic
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORK_DIR = "data/bench"
+
+#stages in the order they run, see telemetry.stage
+STAGES = ["masterlist", "fetch", "store", "detect", "state_history", "report", "smtp"]
+
+#config values of the benchmark runs, on top of config_example.py
+BENCH_CONFIG = '''
+#benchmark settings, see bench/run.py
+window_days = {days}
+sample_interval_minutes = {interval_minutes}
+sensor_types = {sensor_types!r}
+fetch_mode = "samples"
+incremental_fetch = False
+report_mode = "full"
+telemetry = True
+telemetry_file = "bench_telemetry.jsonl"
+telemetry_db_bytes = False
+email_smtp_host = "127.0.0.1"
+email_smtp_un = ""
+email_use_ssl = False
+email_use_starttls = False
+path_east_masterlist = "masterlists/{east}"
+path_center_masterlist = "masterlists/{center}"
+path_west_masterlist = "masterlists/{west}"
+'''
+
+
+def write_config(workspace, params):
+    '''
+    Writes the config.py of a workspace: the example config with the benchmark settings appended
+
+    Inputs:
+    workspace: folder of the workspace
+
+    params: generator parameters of the workspace (see bench/synthetic.py)
+
+    Outputs:
+    None
+    '''
+    with open(os.path.join(REPO_DIR, "config_example.py"), "r") as f:
+        text = f.read()
+
+    text += BENCH_CONFIG.format(east=synthetic.masterlist_name("E"), center=synthetic.masterlist_name("C"),
+                                west=synthetic.masterlist_name("W"), **params)
+
+    with open(os.path.join(workspace, "config.py"), "w") as f:
+        f.write(text)
+
+
+def reset_workspace(workspace):
+    #removes everything earlier runs left behind, so every run starts with cold caches like a first run
+    for folder in ["data", "outputs"]:
+        shutil.rmtree(os.path.join(workspace, folder), ignore_errors=True)
+    os.makedirs(os.path.join(workspace, "outputs"))
+
+    masterlists = os.path.join(workspace, "masterlists")
+    for name in os.listdir(masterlists):
+        if name.endswith(".json") or name.endswith(".sha256"):
+            os.remove(os.path.join(masterlists, name))
+
+
+def run_workspace(workspace):
+    '''
+    Runs the pipeline once on a workspace, in this process. The process has to be started in the workspace folder
+    with it ahead of the repository on the path, so the workspace config is the one imported (see run_scenario)
+
+    Inputs:
+    workspace: folder of the workspace
+
+    Outputs:
+    None
+    '''
+    from bench import smtp_sink
+    from bench import sqlite_db
+    import config
+
+    with open(os.path.join(workspace, "bench.json"), "r") as f:
+        bays = json.load(f)["bays"]
+
+    with smtp_sink.SmtpSink() as sink:
+        #the email reporter reads the port when it is imported
+        config.email_smtp_port = sink.port
+
+        from db import connection
+        from masterlists import sensor_registry
+        import pipeline
+
+        #sensor ids of the synthetic sensors and the stand-in database
+        for bay in bays:
+            sensor_registry.QUERY_STRINGS[bay] = synthetic.load_query_strings(workspace, bay)
+        connection.acquire = sqlite_db.acquire_from(workspace, bays)
+
+        reset_workspace(workspace)
+
+        #the report covers all three bays
+        pipeline.run(bays, send_email=sorted(bays) == sorted(pipeline.BAYS))
+
+    print("SMTP sink received " + str(len(sink.messages)) + " message(s), " + str(sum(sink.messages)) + " bytes")
+
+
+def run_scenario(workspace):
+    '''
+    Runs the pipeline on a workspace in a fresh python process and returns its telemetry record
+
+    Inputs:
+    workspace: folder of a generated workspace
+
+    Outputs:
+    the run record dictionary (see telemetry.finish_run)
+    '''
+    workspace = os.path.abspath(workspace)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([workspace, REPO_DIR]))
+
+    subprocess.run([sys.executable, "-m", "bench.run", "--workspace", workspace], cwd=workspace, env=env, check=True)
+
+    with open(os.path.join(workspace, "bench_telemetry.jsonl"), "r") as f:
+        return json.loads(f.readlines()[-1])
+
+
+def stage_totals(run):
+    '''
+    Sums the records of each stage of a run over the bays and sensor types
+
+    Inputs:
+    run: run record dictionary
+
+    Outputs:
+    a dictionary of stage name to {"wall_s", "cpu_s", "rows", "bytes"} and "total" to the wall time, CPU time and peak
+    RSS of the whole run
+    '''
+    totals = {}
+    for record in run["stages"]:
+        stage = totals.setdefault(record["stage"], {"wall_s": 0.0, "cpu_s": 0.0, "rows": 0, "bytes": 0})
+        for key in stage:
+            stage[key] += record.get(key) or 0
+
+    totals["total"] = {"wall_s": run["wall_s"], "cpu_s": run["cpu_s"], "peak_rss_mb": run["peak_rss_mb"]}
+    return totals
+
+
+def print_table(summaries):
+    #wall time of each stage of every scale, one row per scale
+    header = "{:<18}".format("sensors x days") + "".join("{:>14}".format(stage) for stage in STAGES + ["total"])
+    print(header + "{:>12}".format("peak MB"))
+
+    for summary in summaries:
+        row = "{:<18}".format(str(summary["sensors_per_bay"]) + " x " + str(summary["days"]))
+        for stage in STAGES + ["total"]:
+            row += "{:>14.2f}".format(summary["stages"].get(stage, {}).get("wall_s", 0.0))
+        print(row + "{:>12}".format(str(summary["stages"]["total"]["peak_rss_mb"])))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time every stage of the monitor on synthetic data")
+    parser.add_argument("--sensors", nargs="+", type=float, default=[1, 10],
+                        help="sensors per bay, as multiples of today's " + str(synthetic.BASE_SENSORS))
+    parser.add_argument("--days", nargs="+", type=int, default=[1, 30], help="window lengths in days")
+    parser.add_argument("--interval", type=int, default=15, help="minutes between samples")
+    parser.add_argument("--null-rate", type=float, default=0.002)
+    parser.add_argument("--missing-rate", type=float, default=0.0, help="rate of rows with a NULL datavalue")
+    parser.add_argument("--outlier-rate", type=float, default=0.001)
+    parser.add_argument("--down-rate", type=float, default=0.02)
+    parser.add_argument("--removed-rate", type=float, default=0.05)
+    parser.add_argument("--bays", nargs="+", default=["E", "C", "W"])
+    parser.add_argument("--types", nargs="+", default=["5TM", "MPS-2"], help="sensor types")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per scale, the fastest one is kept")
+    parser.add_argument("--workdir", default=WORK_DIR, help="folder of the workspaces and results")
+    parser.add_argument("--workspace", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    #a single run inside a workspace, started by run_scenario
+    if args.workspace:
+        run_workspace(args.workspace)
+        return
+
+    summaries = []
+    for multiple in args.sensors:
+        for days in args.days:
+            n_sensors = int(round(multiple * synthetic.BASE_SENSORS))
+            workspace = os.path.join(args.workdir, "s" + str(n_sensors) + "_d" + str(days))
+
+            params = synthetic.generate(workspace, bays=args.bays, sensors_per_bay=n_sensors, days=days,
+                                        interval_minutes=args.interval, null_rate=args.null_rate,
+                                        missing_rate=args.missing_rate,
+                                        outlier_rate=args.outlier_rate, down_rate=args.down_rate,
+                                        removed_rate=args.removed_rate, sensor_types=args.types)
+            write_config(workspace, params)
+
+            runs = [run_scenario(workspace) for _ in range(args.repeat)]
+            run = min(runs, key=lambda run: run["wall_s"])
+
+            summary = {
+                "date": datetime.datetime.now().isoformat(timespec="seconds"),
+                "sensors_per_bay": n_sensors,
+                "days": days,
+                "params": params,
+                "stages": stage_totals(run),
+            }
+            summaries.append(summary)
+
+            with open(os.path.join(args.workdir, "results.jsonl"), "a") as f:
+                f.write(json.dumps(summary) + "\n")
+
+    print()
+    #the fetches of the bays run in parallel, so their sum is longer than the fetch part of the total
+    print("Wall time of each stage, summed over the bays and sensor types (s)")
+    print_table(summaries)
+
+
+if __name__ == "__main__":
+    main()
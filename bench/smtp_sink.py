@@ -0,0 +1,81 @@
+'''
+This program is a local SMTP sink for the benchmarks. It speaks enough SMTP (EHLO/HELO, MAIL, RCPT, DATA, RSET, NOOP
+and QUIT, without TLS or login) for smtplib to send a message to it, and keeps the size of every message it receives
+instead of delivering it, so the email stage can be timed without a mail server.
+'''
+
+import socketserver
+import threading
+
+
+class SinkHandler(socketserver.StreamRequestHandler):
+    '''
+    Handles one SMTP session
+    '''
+
+    def reply(self, line):
+        self.wfile.write((line + "\r\n").encode("ascii"))
+
+    def handle(self):
+        self.reply("220 localhost benchmark SMTP sink")
+
+        for line in self.rfile:
+            command = line.decode("ascii", "replace").strip().upper()
+
+            if command.startswith("EHLO") or command.startswith("HELO"):
+                self.reply("250 localhost")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                n_bytes = 0
+                for data_line in self.rfile:
+                    if data_line in (b".\r\n", b".\n"):
+                        break
+                    n_bytes += len(data_line)
+                self.server.received(n_bytes)
+                self.reply("250 OK")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                break
+            elif command.split(" ")[0] in ("MAIL", "RCPT", "RSET", "NOOP"):
+                self.reply("250 OK")
+            else:
+                self.reply("502 Command not implemented")
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    '''
+    SMTP sink on localhost, started on a background thread. Use it in a with statement:
+
+        with SmtpSink() as sink:
+            ... send to ("127.0.0.1", sink.port) ...
+        sink.messages
+    '''
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0):
+        '''
+        Inputs:
+        port: port to listen on, 0 picks a free one
+        '''
+        super().__init__(("127.0.0.1", port), SinkHandler)
+        self.port = self.server_address[1]
+        #size in bytes of every message received
+        self.messages = []
+        self._messages_lock = threading.Lock()
+        self._thread = None
+
+    def received(self, n_bytes):
+        with self._messages_lock:
+            self.messages.append(n_bytes)
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="smtp-sink", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+        return False
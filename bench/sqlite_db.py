@@ -0,0 +1,163 @@
+'''
+This program is a local stand-in for the research database, used by the benchmarks. The datavalues database of each
+bay a synthetic workspace holds (see bench/synthetic.py) is attached to a SQLite connection under the name of its
+schema (leo_east, leo_center, leo_west), and the Oracle functions the queries use (to_char and to_date with
+'YYYY/MM/DD HH24:MI' style formats, and the stddev aggregate of the "features" mode) are provided, so the SQL of
+db/data_fetch.py and db/features.py runs as it is. to_char is run on every row, so it is rewritten into the built in
+strftime of SQLite; to_date only sees the bind variables and is a python function. The connections have the small part of the oracledb connection and cursor interface the fetch stage uses.
+
+SQLite runs in the benchmark process, so fetch timings measured against it show the client side of the fetch (row
+transfer, buffering and conversion) at a given scale, not the time the research database needs to run the query.
+'''
+
+import datetime
+import functools
+import os
+import re
+import sqlite3
+
+from bench import synthetic
+from db import sensor_types as types
+
+
+#Oracle datetime format elements and the strftime codes they map to, longest first
+ORACLE_FORMATS = [("YYYY", "%Y"), ("HH24", "%H"), ("MM", "%m"), ("DD", "%d"), ("MI", "%M"), ("SS", "%S")]
+
+#format the localdatetime column is stored in
+STORED_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+#to_char(column, 'format') calls in a query
+TO_CHAR = re.compile(r"to_char\(\s*(\w+)\s*,\s*'([^']*)'\s*\)", re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=None)
+def strftime_format(oracle_format):
+    #translates an Oracle datetime format like 'YYYY/MM/DD HH24:MI' into a strftime format
+    for element, code in ORACLE_FORMATS:
+        oracle_format = oracle_format.replace(element, code)
+    return oracle_format
+
+
+def translate(sql):
+    #rewrites the to_char calls of a query into SQLite strftime calls
+    return TO_CHAR.sub(lambda match: "strftime('" + strftime_format(match.group(2)) + "', " + match.group(1) + ")", sql)
+
+
+def to_date(text, oracle_format):
+    #to_date of a bind variable, in the format the localdatetime column is stored in so the two compare as text
+    if text is None:
+        return None
+    return datetime.datetime.strptime(text, strftime_format(oracle_format)).strftime(STORED_FORMAT)
+
+
+class StdDev:
+    '''
+    The Oracle stddev aggregate: the sample standard deviation of the non NULL values, 0 for a single value
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def step(self, value):
+        #Welford's algorithm
+        if value is None:
+            return
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def finalize(self):
+        if self.count == 0:
+            return None
+        if self.count == 1:
+            return 0.0
+        return (self.m2 / (self.count - 1)) ** 0.5
+
+
+class Cursor:
+    '''
+    The part of an oracledb cursor the fetch stage uses, on top of a sqlite3 cursor
+    '''
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.arraysize = 100
+        self.prefetchrows = 2
+
+    def execute(self, sql, **binds):
+        self.cursor.execute(translate(sql), binds)
+        return self
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchmany(self, size=None):
+        return self.cursor.fetchmany(size or self.arraysize)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def close(self):
+        self.cursor.close()
+
+
+class Connection:
+    '''
+    The part of an oracledb connection the fetch stage uses. call_timeout is kept but not enforced
+    '''
+
+    def __init__(self, db):
+        self.db = db
+        self.call_timeout = 0
+
+    def cursor(self):
+        return Cursor(self.db.cursor())
+
+    def close(self):
+        self.db.close()
+
+
+def connect(workspace, bays=None):
+    '''
+    Opens a stand-in connection to the datavalues databases of a synthetic workspace
+
+    Inputs:
+    workspace: folder of the workspace (see bench/synthetic.py)
+
+    bays: list of bay strings, defaults to every bay the workspace has a database for
+
+    Outputs:
+    a Connection
+    '''
+    db = sqlite3.connect(":memory:", check_same_thread=False)
+    db.create_function("to_date", 2, to_date, deterministic=True)
+    db.create_aggregate("stddev", 1, StdDev)
+
+    for bay, slope in types.SLOPES.items():
+        path = synthetic.datavalues_path(workspace, bay)
+        if (bays is None or bay in bays) and os.path.exists(path):
+            db.execute("attach database ? as " + slope, (path,))
+
+    return Connection(db)
+
+
+def acquire_from(workspace, bays=None):
+    '''
+    Returns a function that can replace db.connection.acquire, every call opens a new stand-in connection like the
+    session pool hands out a pooled session
+
+    Inputs:
+    workspace: folder of the workspace
+
+    bays: list of bay strings, defaults to every bay of the workspace
+
+    Outputs:
+    a function without arguments that returns a Connection
+    '''
+    return functools.partial(connect, os.path.abspath(workspace), bays)
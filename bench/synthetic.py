@@ -0,0 +1,318 @@
+'''
+This program generates a synthetic LEO-scale workspace for the benchmarks: for every bay a masterlist workbook in the
+layout of the real ones (16 zone sheets of sensor code, address, MPS2 failed and 5TM failed columns), a query strings
+module with the sensor ids, and a SQLite database with a datavalues table holding every sample of every sensor type
+over the requested days. The number of sensors per bay, the sample interval, the number of days and the rates of
+-9999 nulls, NULL datavalues, outliers, dead sensors and removed sensors can all be set, so the same stages can be timed from today's
+scale up to many times the sensors and much longer windows.
+'''
+
+import datetime
+import importlib.util
+import json
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from db import sensor_types as types
+from masterlists import masterlist_json_creator
+
+
+#number of sensor locations per bay today (5TM count of the east bay)
+BASE_SENSORS = 496
+
+BAY_NAMES = {
+    "E": "EAST",
+    "C": "CENTER",
+    "W": "WEST",
+}
+
+#locations the masterlist creator deletes from the west masterlist, they have to be in its zone O sheet
+WEST_DELETED = ["26_-3_2", "26_-2_2"]
+
+#rows inserted per executemany call
+INSERT_BATCH = 200000
+
+
+def default_params(**params):
+    '''
+    Returns the generator parameters, with defaults for the ones that are not given
+
+    Inputs:
+    params: any of bays, sensors_per_bay, interval_minutes, days, null_rate, missing_rate (rows with a NULL
+    datavalue), outlier_rate, down_rate, removed_rate, sensor_types, end_date ("YYYY-MM-DD", defaults to today) and seed
+
+    Outputs:
+    a dictionary of every parameter
+    '''
+    defaults = {
+        "bays": ["E", "C", "W"],
+        "sensors_per_bay": BASE_SENSORS,
+        "interval_minutes": 15,
+        "days": 1,
+        "null_rate": 0.002,
+        "missing_rate": 0.0,
+        "outlier_rate": 0.001,
+        "down_rate": 0.02,
+        "removed_rate": 0.05,
+        "sensor_types": ["5TM", "MPS-2"],
+        "end_date": datetime.date.today().isoformat(),
+        "seed": 0,
+    }
+    unknown = set(params) - set(defaults)
+    if unknown:
+        raise ValueError("Unknown generator parameters: " + ", ".join(sorted(unknown)))
+
+    defaults.update(params)
+    return defaults
+
+
+def sensor_codes(bay, n_sensors):
+    '''
+    Makes up the location codes ("x_y_height") of the sensors of a bay and the zone sheet each one is listed on
+
+    Inputs:
+    bay: string of either "E", "C" or "W"
+
+    n_sensors: number of sensor locations
+
+    Outputs:
+    a list of (zone, code) tuples
+    '''
+    sheets = masterlist_json_creator.SHEETS
+    codes = []
+    for i in range(n_sensors):
+        column = i // 4
+        code = str(2 + 2 * (column // 16)) + "_" + str(-(column % 16) - 1) + "_" + str(i % 4 + 1)
+        codes.append((sheets[column % len(sheets)], code))
+
+    if bay == "W":
+        codes = [item for item in codes if item[1] not in WEST_DELETED] + [("O", code) for code in WEST_DELETED]
+
+    return codes
+
+
+def write_masterlist(path, codes, removed_rate, rng):
+    '''
+    Writes a masterlist workbook with one sheet per zone. A removed_rate share of the sensors of each type get a
+    failure date, the masterlist creator reads those as removed
+
+    Inputs:
+    path: filename/path of the .xlsx workbook
+
+    codes: list of (zone, code) tuples, see sensor_codes
+
+    removed_rate: share of the sensors of each type that are marked as removed
+
+    rng: numpy random Generator
+
+    Outputs:
+    None
+    '''
+    rows = {sheet: [] for sheet in masterlist_json_creator.SHEETS}
+    for zone, code in codes:
+        removed = rng.random(2) < removed_rate
+        rows[zone].append([code, format(len(rows[zone]) % 16, "x"),
+                           "2025-06-10 00:00:00" if removed[0] else None,
+                           "2025-06-10 00:00:00" if removed[1] else None])
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with pd.ExcelWriter(path) as writer:
+        pd.DataFrame([["synthetic benchmark masterlist"]], columns=["Update"]).to_excel(writer, sheet_name="Update",
+                                                                                       index=False)
+        for sheet, sheet_rows in rows.items():
+            frame = pd.DataFrame(sheet_rows, columns=["Sensor code", "Address", "MPS2 Failed", "5TM Failed"])
+            frame.to_excel(writer, sheet_name=sheet, index=False)
+
+
+def write_query_strings(path, bay, codes):
+    '''
+    Writes a query strings module like db/query_strings_E.py for the synthetic sensors. With the devices of
+    db/sensor_types.py, the 5TM of location i gets sensor id 2i+1 and the MPS-2 id 2i+2, codes deleted from the west
+    masterlist are left out
+
+    Inputs:
+    path: filename/path of the .py module
+
+    bay: string of either "E", "C" or "W"
+
+    codes: list of (zone, code) tuples, see sensor_codes
+
+    Outputs:
+    a dictionary of device ("5TM" or "MPS-2") to its list of sensor ids
+    '''
+    sensor_ids = {}
+    lines = ['"synthetic ' + BAY_NAMES[bay].lower() + ' bay query strings"', ""]
+
+    kept = [(i, code) for i, (zone, code) in enumerate(codes) if bay != "W" or code not in WEST_DELETED]
+
+    n_devices = len(types.DEVICES)
+    for offset, device in enumerate(types.DEVICES.values(), 1):
+        ids = [n_devices * i + offset for i, code in kept]
+        sensor_ids[device.name] = ids
+
+        attr = device.query_name
+        lines.append("query_" + attr + "=" + repr(",".join(str(sensor_id) + " as A" + str(sensor_id)
+                                                          for sensor_id in ids)))
+        lines.append("query_" + attr + "_ids=" + repr(", ".join(str(sensor_id) for sensor_id in ids)))
+        lines.append("query_" + attr + "_order=" + repr(",".join("LEO-" + bay + "_" + code + "_" + device.name
+                                                                for i, code in kept)))
+
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+    return sensor_ids
+
+
+def sensor_values(sensor_type, n_sensors, n_times, params, rng):
+    '''
+    Makes up the samples of one sensor type: each sensor stays close to its own level inside the valid range, with
+    -9999 nulls, NaN (written as NULL datavalues) and out of range outliers mixed in at the given rates
+
+    Inputs:
+    sensor_type: a SensorType
+
+    n_sensors, n_times: shape of the samples
+
+    params: generator parameters, see default_params
+
+    rng: numpy random Generator
+
+    Outputs:
+    a sensors x time float64 numpy array
+    '''
+    low, high = sensor_type.valid_range
+    span = high - low
+
+    levels = low + span * rng.uniform(0.3, 0.7, size=(n_sensors, 1))
+    values = levels + span * 0.01 * rng.standard_normal((n_sensors, n_times))
+
+    draws = rng.random((n_sensors, n_times))
+    values[draws < params["outlier_rate"]] = high + span
+    values[(draws >= params["outlier_rate"]) & (draws < params["outlier_rate"] + params["null_rate"])] = (
+        sensor_type.null_value)
+    missing = params["outlier_rate"] + params["null_rate"]
+    values[(draws >= missing) & (draws < missing + params["missing_rate"])] = np.nan
+
+    return np.round(values, 3)
+
+
+def write_datavalues(path, sensor_ids, params, rng):
+    '''
+    Writes the SQLite database of a bay with the datavalues table the fetch queries. Dead sensors (down_rate) have no
+    rows at all
+
+    Inputs:
+    path: filename/path of the SQLite database
+
+    sensor_ids: dictionary of device to its list of sensor ids, see write_query_strings
+
+    params: generator parameters, see default_params
+
+    rng: numpy random Generator
+
+    Outputs:
+    the number of rows written
+    '''
+    if os.path.exists(path):
+        os.remove(path)
+
+    end = datetime.datetime.fromisoformat(params["end_date"])
+    start = end - datetime.timedelta(params["days"])
+    times = np.arange(np.datetime64(start, "m"), np.datetime64(end, "m"),
+                      np.timedelta64(params["interval_minutes"], "m"))
+    #stored like the localdatetime column of the research database, as date and time
+    time_strings = np.char.replace(np.datetime_as_string(times, unit="s"), "T", " ")
+
+    db = sqlite3.connect(path)
+    db.execute("pragma journal_mode = off")
+    db.execute("pragma synchronous = off")
+    db.execute("create table datavalues (localdatetime text, variableid integer, sensorid integer, datavalue real)")
+
+    n_rows = 0
+    for name in params["sensor_types"]:
+        sensor_type = types.get(name)
+        ids = np.asarray(sensor_ids[sensor_type.device])
+        alive = ids[rng.random(len(ids)) >= params["down_rate"]]
+        values = sensor_values(sensor_type, len(alive), len(times), params, rng)
+
+        #rows go in time order, a batch of whole timestamps at a time
+        step = max(1, INSERT_BATCH // max(1, len(alive)))
+        for first in range(0, len(times), step):
+            batch_times = time_strings[first:first + step]
+            rows = zip(np.repeat(batch_times, len(alive)).tolist(),
+                       [sensor_type.variable_id] * (len(batch_times) * len(alive)),
+                       np.tile(alive, len(batch_times)).tolist(),
+                       values[:, first:first + step].T.ravel().tolist())
+            db.executemany("insert into datavalues values (?, ?, ?, ?)", rows)
+            n_rows += len(batch_times) * len(alive)
+
+    db.execute("create index datavalues_time on datavalues (localdatetime, variableid, sensorid)")
+    db.commit()
+    db.close()
+
+    return n_rows
+
+
+def generate(workspace, **params):
+    '''
+    Generates (or reuses) a synthetic workspace. It holds masterlists/ (the workbooks), database/ (the query strings
+    modules and the datavalues databases) and bench.json with the parameters it was generated with. A workspace that was
+    already generated with the same parameters is kept as it is
+
+    Inputs:
+    workspace: folder of the workspace
+
+    params: generator parameters, see default_params
+
+    Outputs:
+    the dictionary of parameters, with the number of rows of each bay under "rows"
+    '''
+    params = default_params(**params)
+    params_path = os.path.join(workspace, "bench.json")
+
+    if os.path.exists(params_path):
+        with open(params_path, "r") as f:
+            saved = json.load(f)
+        if {key: saved.get(key) for key in params} == params:
+            return saved
+
+    rng = np.random.default_rng(params["seed"])
+    os.makedirs(os.path.join(workspace, "database"), exist_ok=True)
+    os.makedirs(os.path.join(workspace, "masterlists"), exist_ok=True)
+
+    params["rows"] = {}
+    for bay in params["bays"]:
+        codes = sensor_codes(bay, params["sensors_per_bay"])
+        write_masterlist(os.path.join(workspace, "masterlists", masterlist_name(bay)), codes,
+                         params["removed_rate"], rng)
+        sensor_ids = write_query_strings(query_strings_path(workspace, bay), bay, codes)
+        params["rows"][bay] = write_datavalues(datavalues_path(workspace, bay), sensor_ids, params, rng)
+        print("Generated bay " + bay + ": " + str(len(codes)) + " sensors, " + str(params["rows"][bay]) + " rows")
+
+    with open(params_path, "w") as f:
+        json.dump(params, f, indent=1)
+
+    return params
+
+
+def masterlist_name(bay):
+    return "subsoil SDI12 Sensor Status " + BAY_NAMES[bay] + ".xlsx"
+
+
+def query_strings_path(workspace, bay):
+    return os.path.join(workspace, "database", "query_strings_" + bay + ".py")
+
+
+def datavalues_path(workspace, bay):
+    return os.path.join(workspace, "database", types.SLOPES[bay] + ".sqlite")
+
+
+def load_query_strings(workspace, bay):
+    #imports the query strings module of a bay of a workspace, it replaces db/query_strings_<bay>.py in the registry
+    spec = importlib.util.spec_from_file_location("query_strings_" + bay, query_strings_path(workspace, bay))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -3,11 +3,109 @@ db_un = "database_username"
 db_host = "database.host.com"
 db_sn = "oracle_database_SID"
 
+#optional session pool settings (see db/connection.py)
+db_pool_min = 1
+db_pool_max = 6
+db_stmt_cache_size = 40
+
+#seconds a single query may run before it is cancelled (see db/fetch_engine.py)
+db_query_timeout = 300
+
+#rows per fetch round trip, and the usual minutes between samples (sizes the sample buffers, see db/sample_store.py)
+db_fetch_arraysize = 5000
+sample_interval_minutes = 15
+
+#sensor types that are fetched, classified and reported (see db/sensor_types.py), "5TM-temp" and "5TM-perm" are the
+#soil temperature and bulk permittivity of the 5TMs. All types of a bay are fetched with one query
+sensor_types = ["5TM", "MPS-2"]
+
+#number of days queried each run, and "samples" (full time series) or "features" (one aggregated row per sensor)
+window_days = 1
+fetch_mode = "samples"
+
+#only fetch rows newer than the previous run and keep a rolling window of samples in the data folder. The last
+#incremental_late_minutes before the previous run are fetched again for rows that reach the database late
+incremental_fetch = False
+incremental_late_minutes = 60
+
+#keep the samples of each bay, sensor type and query window in data/fetch_cache, so fetching the same window again
+#(e.g. re-running the same day) does not query the database. Entries are used for fetch_cache_ttl_hours and the least
+#recently used ones are removed once the cache is larger than fetch_cache_max_mb
+fetch_cache = True
+fetch_cache_dir = "data/fetch_cache"
+fetch_cache_ttl_hours = 24
+fetch_cache_max_mb = 1024
+
+#"range" checks samples against fixed valid ranges, "rolling" flags samples outside AVG +/- 3*SD of a +/- 3.5 hour window
+outlier_mode = "range"
+outlier_half_window_hours = 3.5
+outlier_n_sd = 3.0
+
+#a sensor is flatlined when its valid samples stay within the flat tolerance of its type for flatline_hours, outside
+#the range where a steady reading is expected (0 turns it off), and reports spikes when a sample jumps from the previous
+#one by more than the spike limit of its type (see db/sensor_types.py). Flatline detection is off unless flatline_hours
+#is set above 0 here: with the default of 0 no sensor is ever put in state 6, since healthy sensors in wet soil read
+#the same value for days
+flatline_hours = 0
+spike_detection = True
+
+#keep per sensor daily rollups (count, nulls, min, max, sum, sum of squares) of every fetch for long-horizon metrics.
+#The full report lists the sensors whose availability over the last long_term_days days of rollups is below
+#long_term_min_availability (%), with their trend (0 days leaves the section out)
+daily_rollups = True
+long_term_days = 30
+long_term_min_availability = 90
+
+#days per query and queries in flight of a historical backfill (python -m db.backfill START END --bays E C W)
+backfill_chunk_days = 1
+backfill_workers = 4
+
+#running per sensor statistics kept between runs, used to flag sensors that drift from their long-term baseline
+drift_tracking = True
+drift_ewma_halflife_hours = 24
+drift_n_sd = 3.0
+drift_min_count = 672
+
+#write the sample stores and state csvs between stages (the stages also hand their results over in memory)
+write_stage_files = True
+
+#skip the stages whose inputs did not change since their last successful run (e.g. a re-run after an email failure only
+#sends the email), and the maximum number of stages run in parallel (see dag.py)
+skip_unchanged = True
+dag_workers = 4
+
+#keep an append-only history of sensor and zone state changes (for "down since", uptime and flapping queries)
+state_history = True
+state_history_db = "data/state_history.sqlite"
+
+#continuous monitor (python daemon.py): minutes between polls, hours of samples the states are found from, minutes
+#before the previous poll that are queried again for rows that reach the database late, and whether a delta email is
+#sent when a state changes. The daemon keeps its drift statistics and delta email states in daemon_data_dir, apart
+#from the ones of the daily runs
+daemon_poll_minutes = 15
+daemon_window_hours = 24
+daemon_late_minutes = 60
+daemon_alerts = True
+daemon_data_dir = "data/daemon"
+
+#append a record of the wall time, CPU time, rows, bytes and peak memory of every stage of a run to telemetry_file.
+#The bytes of each query are read from v$mystat, set telemetry_db_bytes = False if the database user cannot see it
+telemetry = True
+telemetry_file = "data/telemetry.jsonl"
+telemetry_db_bytes = True
+
+#"full" lists every unhealthy sensor in the email, "delta" only lists the state changes since the previous run
+report_mode = "full"
+
 email_from_adr = "example@email.com"
 email_to_adrs = ["user1@email.com", "user2@email.com"]
 email_smtp_host = "host.stmp.example.com"
 email_smtp_un = "username@email.com"
 email_smtp_pw = "smtpPassword"
+#optional, 587 with STARTTLS by default (use_ssl = True for implicit SSL on 465)
+email_smtp_port = 587
+email_use_ssl = False
+email_use_starttls = True
 
 path_east_masterlist = "masterlists/subsoil SDI12 Sensor Status WEST.xlsx"
 path_center_masterlist = "masterlists/subsoil SDI12 Sensor Status CENTER.xlsx"
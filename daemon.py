@@ -0,0 +1,302 @@
+"""
+Continuous monitor. Instead of looking at the previous day once a day (see main.py), the daemon polls the research
+database every few minutes and reports a sensor as soon as its state changes, so a sensor that dies at 01:00 is
+reported within one poll instead of the next day.
+
+Everything a poll needs is kept warm in memory between polls: the session pool, the sensor registries and catalogs,
+and the rolling window of samples of every bay and sensor type (see detection/live_window.py). The first poll fetches
+the whole window; every poll after that only queries the rows newer than the previous poll plus the last
+daemon_late_minutes again (for rows the loggers upload late), drops the samples that fell out of the window and
+re-classifies only the sensors that got or lost samples. A poll therefore costs about poll + late minutes of data (75
+minutes, 5 sample intervals with the defaults) no matter how long the window is; a smaller daemon_late_minutes makes
+polls cheaper but misses rows that arrive later than that. When a state changes the change is added to the state
+history and a delta email is sent (see outputs/delta_report.py).
+
+The daemon can run next to the daily job. It keeps its running drift statistics and the states its delta emails
+compare against in daemon_data_dir, while the daily job owns the _drift.npz files next to the sample stores and
+data/last_states, so neither one folds samples into the other's statistics or moves the other's email baseline. Both
+record their states in the same state history (see detection/state_history.py).
+
+The bays are polled independently. When a bay fails (e.g. its query times out) its windows are left where the last
+successful poll of the bay put them, and the next poll queries the bay again from there, so no samples are skipped;
+the other bays move on, and their state changes are reported at the next successful poll.
+
+Usage: python daemon.py
+"""
+
+import concurrent.futures
+import datetime
+import os
+import time
+
+import numpy as np
+
+import config
+import pipeline
+import telemetry
+from db import connection
+from db import data_fetch
+from db import fetch_engine
+from db import sensor_types as types
+from detection import live_window
+from detection import sensor_state_detector
+from detection import state_history
+from masterlists import masterlist_json_creator
+from masterlists import sensor_catalog
+from outputs import email_reporter
+
+
+#minutes between polls, length of the rolling window the states are found from, and how far back each poll queries
+#again for rows that reached the database late
+POLL_MINUTES = getattr(config, "daemon_poll_minutes", 15)
+WINDOW_HOURS = getattr(config, "daemon_window_hours", 24 * data_fetch.WINDOW_DAYS)
+LATE_MINUTES = getattr(config, "daemon_late_minutes", 60)
+
+#send a delta email when a state changes
+ALERTS = getattr(config, "daemon_alerts", True)
+
+#drift statistics and delta email states of the daemon, apart from the ones of the daily job
+DATA_DIR = getattr(config, "daemon_data_dir", "data/daemon")
+STATES_DIR = os.path.join(DATA_DIR, "last_states")
+
+#format of the query window strings
+TIME_FORMAT = "%Y/%m/%d %H:%M"
+
+
+def drift_path(bay, sensor_type):
+    #running drift statistics of a bay and sensor type kept by the daemon
+    return os.path.join(DATA_DIR, os.path.basename(types.sample_store_path(bay, sensor_type)) + "_drift.npz")
+
+
+class Monitor:
+    '''
+    The in memory state of the continuous monitor: the rolling window of every bay and sensor type and the last
+    reported states
+    '''
+
+    def __init__(self, bays=pipeline.BAYS, send_alerts=ALERTS, window_hours=WINDOW_HOURS, late_minutes=LATE_MINUTES):
+        '''
+        Inputs:
+        bays: list of bay strings ("E", "C", "W"), the delta email needs all three
+
+        send_alerts: send a delta email when a state changes
+
+        window_hours: length of the rolling window in hours
+
+        late_minutes: minutes before the end of the previous poll that are queried again
+        '''
+        self.bays = list(bays)
+        self.sensor_types = types.enabled_types(sensor_state_detector.SENSOR_TYPES)
+        self.send_alerts = send_alerts
+        self.window_minutes = int(window_hours * 60)
+        self.late = datetime.timedelta(minutes=late_minutes)
+
+        #(bay, sensor_type) to LiveWindow, and the end of the last query of every bay
+        self.windows = {}
+        self.device_sensors = {}
+        self.fetched_until = {}
+
+        #modification time of the masterlist workbook of every bay when its window was built
+        self.masterlist_mtimes = {}
+
+        #(bay, sensor_type) to the BayResult last reported, and the ones whose states changed since
+        self.results = {}
+        self.pending = set()
+        self.n_polls = 0
+
+    def refresh_masterlist(self, bay):
+        '''
+        Converts the masterlist workbook of a bay again if it changed since the window of the bay was built
+
+        Inputs:
+        bay: string of either "E", "C" or "W"
+
+        Outputs:
+        True if the workbook changed (or the bay has no window yet)
+        '''
+        f_excel, _ = masterlist_json_creator.paths(bay)
+        mtime = os.path.getmtime(f_excel)
+        if self.masterlist_mtimes.get(bay) == mtime:
+            return False
+
+        with telemetry.stage("masterlist", bay):
+            masterlist_json_creator.main(bay)
+        self.masterlist_mtimes[bay] = mtime
+        return True
+
+    def build_windows(self, bay, now):
+        '''
+        Starts empty windows for every sensor type of a bay, so the next fetch of the bay covers the whole window
+
+        Inputs:
+        bay: string of either "E", "C" or "W"
+
+        now: datetime of the end of the poll
+
+        Outputs:
+        None
+        '''
+        #the running drift statistics of the old windows are kept
+        for sensor_type in self.sensor_types:
+            old = self.windows.get((bay, sensor_type.name))
+            if old is not None:
+                old.save_drift()
+
+        device_sensors = {}
+        for sensor_type in self.sensor_types:
+            if sensor_type.device not in device_sensors:
+                device_sensors[sensor_type.device] = sensor_catalog.active_sensors(bay, sensor_type.device)
+        self.device_sensors[bay] = device_sensors
+
+        expected_columns = self.window_minutes // data_fetch.SAMPLE_INTERVAL_MINUTES + 1
+        for sensor_type in self.sensor_types:
+            self.windows[(bay, sensor_type.name)] = live_window.LiveWindow(
+                device_sensors[sensor_type.device][0], sensor_type.name, self.window_minutes, expected_columns,
+                drift_path(bay, sensor_type.name))
+            #every sensor is reported again after a rebuild
+            self.pending.add((bay, sensor_type.name))
+
+        self.fetched_until[bay] = now - datetime.timedelta(minutes=self.window_minutes)
+
+    def poll_bay(self, bay, now):
+        '''
+        Fetches the new samples of a bay and updates the states of its sensors
+
+        Inputs:
+        bay: string of either "E", "C" or "W"
+
+        now: datetime of the end of the poll
+
+        Outputs:
+        None, the sensor types whose states changed are added to pending
+        '''
+        if self.refresh_masterlist(bay):
+            self.build_windows(bay, now)
+
+        window_start = now - datetime.timedelta(minutes=self.window_minutes)
+        query_start = max(self.fetched_until[bay] - self.late, window_start)
+
+        with telemetry.stage("fetch", bay) as record:
+            arrays = data_fetch.query_samples(bay, self.sensor_types, self.device_sensors[bay],
+                                              query_start.strftime(TIME_FORMAT), now.strftime(TIME_FORMAT),
+                                              fetch_engine.QUERY_TIMEOUT, record)
+
+        for sensor_type in self.sensor_types:
+            window = self.windows[(bay, sensor_type.name)]
+            timestamps, values = arrays[sensor_type.variable_id]
+
+            with telemetry.stage("detect", bay, sensor_type.name) as record:
+                #the re-queried rows replace the ones already in the window
+                rows = window.rewind(np.datetime64(query_start, "m"))
+                rows |= window.add(timestamps, values)
+                rows |= window.evict(np.datetime64(now, "m"))
+
+                changed = window.classify(rows)
+                window.save_drift()
+                record["sensors"] = int(rows.sum())
+                record["changes"] = int(changed.sum())
+
+            if changed.any():
+                self.pending.add((bay, sensor_type.name))
+
+        #only moved on once every sensor type of the bay is updated, so a poll that fails half way queries the whole
+        #gap again (the windows that were already updated are rewound to the start of that query)
+        self.fetched_until[bay] = now
+
+    def poll(self, now=None):
+        '''
+        Runs one poll: every bay is fetched and re-classified at the same time, then the state changes are added to
+        the state history and sent as a delta email
+
+        Inputs:
+        now: datetime of the end of the poll, the current minute by default
+
+        Outputs:
+        a list of the (bay, sensor_type) whose states changed.
+        Raises the first error of the bays once they are all done, the changes of the other bays are reported at the
+        next poll
+        '''
+        if now is None:
+            now = datetime.datetime.now().replace(second=0, microsecond=0)
+
+        self.n_polls += 1
+        telemetry.start_run(daemon_poll=self.n_polls, bays=self.bays, sensor_types=sensor_state_detector.SENSOR_TYPES)
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(len(self.bays), connection.POOL_MAX)),
+                                                       thread_name_prefix="poll") as executor:
+                futures = [executor.submit(self.poll_bay, bay, now) for bay in self.bays]
+            for future in futures:
+                future.result()
+
+            changed = sorted(self.pending)
+            for bay, sensor_type in changed:
+                window = self.windows[(bay, sensor_type)]
+                self.results[(bay, sensor_type)] = sensor_state_detector.bay_result(bay, sensor_type,
+                                                                                    window.sensor_health())
+
+            if changed:
+                if pipeline.STATE_HISTORY:
+                    with telemetry.stage("state_history"):
+                        state_history.record({key: self.results[key] for key in changed})
+
+                if self.send_alerts:
+                    window_start = now - datetime.timedelta(minutes=self.window_minutes)
+                    email_reporter.main(self.results, mode="delta",
+                                        window=(window_start.strftime(TIME_FORMAT), now.strftime(TIME_FORMAT)),
+                                        states_dir=STATES_DIR)
+
+            #pending is only cleared once the changes are recorded and sent, a failed email is retried next poll
+            self.pending.clear()
+        except Exception as e:
+            telemetry.finish_run(e)
+            raise
+
+        telemetry.finish_run()
+
+        return changed
+
+
+def run(bays=pipeline.BAYS, poll_minutes=POLL_MINUTES, max_polls=None):
+    '''
+    Polls every poll_minutes until stopped (Ctrl+C). A failed poll, e.g. while the database is not reachable, is
+    printed and retried at the next poll
+
+    Inputs:
+    bays: list of bay strings ("E", "C", "W")
+
+    poll_minutes: minutes between the starts of two polls
+
+    max_polls: stop after this many polls, None runs until stopped
+
+    Outputs:
+    None
+    '''
+    monitor = Monitor(bays)
+
+    try:
+        while max_polls is None or monitor.n_polls < max_polls:
+            started = time.monotonic()
+            try:
+                changed = monitor.poll()
+                print("Poll " + str(monitor.n_polls) + ": " + str(len(changed)) + " sensor type(s) changed state")
+            except Exception as e:
+                print("Poll " + str(monitor.n_polls) + " failed: " + str(e))
+
+            if max_polls is not None and monitor.n_polls >= max_polls:
+                break
+            time.sleep(max(0.0, poll_minutes * 60 - (time.monotonic() - started)))
+    except KeyboardInterrupt:
+        print("Stopping the monitor")
+    finally:
+        #the pool is kept open between polls and closed once the monitor stops
+        connection.close_pool()
+
+
+def main():
+    #monitors the East, Center, and West bays of LEO until stopped
+    run(["E", "C", "W"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""
+Small DAG executor for the stages of a run. Every node declares the nodes it depends on and a description of its other
+inputs (file hashes, the fetch window, settings, ...). When a node becomes ready, the content hash of its inputs and of
+the outputs of its dependencies is compared with the hash of its last successful run (kept in data/dag_state.json):
+if they match and its output files are still there the node is skipped and its output is loaded from disk instead.
+Nodes whose dependencies are done run in parallel on a thread pool, so re-running after e.g. an email failure only
+runs the email step again.
+"""
+
+import concurrent.futures
+import datetime
+import hashlib
+import json
+import os
+import threading
+
+import config
+import telemetry
+
+
+STATE_FILE = "data/dag_state.json"
+
+#maximum number of nodes running at the same time
+MAX_WORKERS = getattr(config, "dag_workers", 4)
+
+_state_lock = threading.Lock()
+
+
+class Node:
+    '''
+    One step of a run, e.g. the fetch of a bay
+    '''
+
+    def __init__(self, name, run, deps=(), inputs=None, outputs=(), load=None, digest=None, stage=None, bay=None):
+        '''
+        Inputs:
+        name: unique name of the node, e.g. "fetch E"
+
+        run: function called with a dictionary of dependency name to its output, returns the output of the node
+
+        deps: names of the nodes this node needs the outputs of
+
+        inputs: function returning a json-able description of the inputs that are not outputs of other nodes, called
+        once the dependencies are done. None (or a function returning None) means the node always runs
+
+        outputs: function returning the files the node writes, a skipped node needs all of them to still exist
+
+        load: function returning the output of the node from disk when it is skipped, the output is None without it
+
+        digest: function returning the content hash of an output, defaults to the hash of the inputs
+
+        stage, bay: telemetry stage name and bay of the node, recorded with "skipped" when the node is skipped
+        '''
+        self.name = name
+        self.run = run
+        self.deps = list(deps)
+        self.inputs = inputs
+        self.outputs = outputs
+        self.load = load
+        self.digest = digest
+        self.stage = stage or name
+        self.bay = bay
+
+
+def content_hash(*parts):
+    '''
+    Returns the sha256 hex digest of json-able parts, bytes are hashed as they are
+    '''
+    sha = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = json.dumps(part, sort_keys=True, default=str).encode("utf-8")
+        sha.update(hashlib.sha256(part).digest())
+    return sha.hexdigest()
+
+
+def load_state(path=STATE_FILE):
+    #returns the input and output hashes of the last successful run of every node
+    if not os.path.exists(path):
+        return {}
+
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_state(state, path=STATE_FILE):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp, path)
+
+
+def execute(node, values, hashes, state, force, path):
+    '''
+    Runs (or skips) one node
+
+    Inputs:
+    node: the Node
+
+    values, hashes: dictionaries of the outputs and output hashes of the nodes that are done
+
+    state: the saved state dictionary, updated when the node succeeds
+
+    force: run the node even if its inputs did not change
+
+    path: filename/path of the state file
+
+    Outputs:
+    (output of the node, output hash, True if the node was skipped)
+    '''
+    description = node.inputs() if node.inputs is not None else None
+    input_hash = None
+    if description is not None:
+        input_hash = content_hash(description, [hashes[dep] for dep in node.deps])
+
+    last = state.get(node.name)
+    outputs = node.outputs() if node.outputs else []
+    if (not force and input_hash is not None and last is not None and last["inputs"] == input_hash
+            and all(os.path.exists(output) for output in outputs)):
+        with telemetry.stage(node.stage, node.bay) as record:
+            record["skipped"] = True
+            value = node.load() if node.load is not None else None
+        return value, last["outputs"], True
+
+    value = node.run({dep: values[dep] for dep in node.deps})
+
+    if node.digest is not None:
+        output_hash = node.digest(value)
+    else:
+        #nodes that always run get a new hash every time, so the nodes after them run too
+        output_hash = input_hash or content_hash(node.name, datetime.datetime.now().isoformat())
+
+    if input_hash is not None:
+        with _state_lock:
+            state[node.name] = {"inputs": input_hash, "outputs": output_hash,
+                                "finished": datetime.datetime.now().isoformat(timespec="seconds")}
+            save_state(state, path)
+
+    return value, output_hash, False
+
+
+def run_dag(nodes, force=False, max_workers=MAX_WORKERS, path=STATE_FILE):
+    '''
+    Runs every node once its dependencies are done, skipping the nodes whose inputs did not change since their last
+    successful run. Nodes that are ready at the same time run in parallel. When a node fails the nodes that depend on
+    it are not run, the other ones still are
+
+    Inputs:
+    nodes: list of Nodes, in any order
+
+    force: run every node even if its inputs did not change
+
+    max_workers: maximum number of nodes running at the same time
+
+    path: filename/path of the state file
+
+    Outputs:
+    a dictionary of node name to its output.
+    Raises the first error seen once every node that could run has run
+    '''
+    pending = {node.name: node for node in nodes}
+    for node in nodes:
+        missing = [dep for dep in node.deps if dep not in pending]
+        if missing:
+            raise ValueError("Node " + node.name + " depends on unknown nodes " + ", ".join(missing))
+
+    state = load_state(path)
+    values = {}
+    hashes = {}
+    errors = {}
+    skipped = []
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="dag") as executor:
+        running = {}
+
+        while pending or running:
+            for name, node in list(pending.items()):
+                if any(dep in errors for dep in node.deps):
+                    errors[name] = None
+                    del pending[name]
+                    print("Not running " + name + ", a step it depends on failed")
+                elif all(dep in values for dep in node.deps):
+                    running[executor.submit(execute, node, values, hashes, state, force, path)] = name
+                    del pending[name]
+
+            if not running:
+                if pending:
+                    raise ValueError("Dependency cycle between " + ", ".join(pending))
+                break
+
+            finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    values[name], hashes[name], was_skipped = future.result()
+                except Exception as e:
+                    errors[name] = e
+                    print("Failed " + name + ": " + str(e))
+                    continue
+
+                if was_skipped:
+                    skipped.append(name)
+
+    if skipped:
+        print("Unchanged since the last run, skipped: " + ", ".join(skipped))
+
+    for error in errors.values():
+        if error is not None:
+            raise error
+
+    return values
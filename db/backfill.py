@@ -0,0 +1,215 @@
+'''
+This program backfills the local store over a past period, e.g. to re-evaluate sensor health after a masterlist
+correction. The date range is split into day chunks, and every bay x chunk is fetched (all sensor types in one query)
+on a bounded thread pool that shares the session pool with the daily run. Each fetched chunk is merged into the daily rollups next to the
+sample store (see db/daily_rollups.py), and its sensors are classified and recorded in the state history at the end of
+the chunk, the same way the daily run records them (see detection/state_history.py). Finished chunks are recorded in a
+checkpoint file, so an interrupted backfill picks up where it stopped when it is started again with the same arguments.
+
+Usage: python -m db.backfill 2025/04/01 2025/10/01 --bays E C W
+'''
+
+import argparse
+import concurrent.futures
+import datetime
+import json
+import os
+import threading
+
+import config
+from db import connection
+from db import data_fetch
+from db import fetch_engine
+from db import sensor_types as types
+from detection import sensor_state_detector
+from detection import state_history
+
+
+CHECKPOINT_FILE = "data/backfill_checkpoint.json"
+
+#number of days fetched per query and the maximum number of queries in flight
+CHUNK_DAYS = getattr(config, "backfill_chunk_days", 1)
+MAX_WORKERS = getattr(config, "backfill_workers", 4)
+
+DATE_FORMAT = "%Y/%m/%d"
+
+#record the states of the backfilled chunks in the state history, like the daily run does
+STATE_HISTORY = getattr(config, "state_history", True)
+
+_checkpoint_lock = threading.Lock()
+
+
+def day_chunks(start_date, end_date, chunk_days=CHUNK_DAYS):
+    '''
+    Splits [start_date, end_date) into chunks of whole days
+
+    Inputs:
+    start_date, end_date: datetime.dates
+
+    chunk_days: number of days per chunk, the last chunk may be shorter
+
+    Outputs:
+    a list of (chunk start, chunk end) datetime.date tuples
+    '''
+    chunks = []
+    chunk_start = start_date
+    while chunk_start < end_date:
+        chunk_end = min(chunk_start + datetime.timedelta(chunk_days), end_date)
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_end
+    return chunks
+
+
+def chunk_key(bay, sensor_type, chunk_start, chunk_end):
+    return bay + "|" + sensor_type + "|" + chunk_start.strftime(DATE_FORMAT) + "|" + chunk_end.strftime(DATE_FORMAT)
+
+
+def chunk_keys(bay, sensor_types, chunk_start, chunk_end):
+    return [chunk_key(bay, sensor_type, chunk_start, chunk_end) for sensor_type in sensor_types]
+
+
+def load_checkpoint(path=CHECKPOINT_FILE):
+    #returns the set of chunk keys that were already fetched
+    if not os.path.exists(path):
+        return set()
+
+    with open(path, "r") as f:
+        return set(json.load(f))
+
+
+def save_checkpoint(done, path=CHECKPOINT_FILE):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(sorted(done), f, indent=1)
+    os.replace(tmp, path)
+
+
+def classify_chunk(bay, samples_by_type, chunk_end, record_states=STATE_HISTORY):
+    '''
+    Classifies the sensors of a fetched chunk and records their states in the state history at the end of the chunk
+
+    Inputs:
+    bay: string of either "E", "C" or "W"
+
+    samples_by_type: dictionary of sensor type name to the SampleSet of the chunk (see data_fetch.main_data)
+
+    chunk_end: datetime.date the chunk ends at, the states are recorded at its midnight
+
+    record_states: add the states to the state history
+
+    Outputs:
+    a dictionary of (bay, sensor_type) to BayResult
+    '''
+    results = {}
+    for sensor_type, samples in samples_by_type.items():
+        #the running drift statistics belong to the daily run and are not updated with past samples
+        sensor_health, outlier_times = sensor_state_detector.classify_samples(samples, sensor_type, drift_path=None)
+        results[(bay, sensor_type)] = sensor_state_detector.bay_result(bay, sensor_type, sensor_health, outlier_times)
+
+    if record_states and results:
+        run_time = int(datetime.datetime.combine(chunk_end, datetime.time()).timestamp())
+        state_history.record(results, run_time)
+
+    return results
+
+
+def backfill(start_date, end_date, bays, sensor_types=None, chunk_days=CHUNK_DAYS, max_workers=MAX_WORKERS,
+             timeout=fetch_engine.QUERY_TIMEOUT, checkpoint=CHECKPOINT_FILE):
+    '''
+    Fetches every bay x day chunk of [start_date, end_date) whose sensor types are not all in the checkpoint yet,
+    merges it into the daily rollups and records the states of its sensors in the state history (see
+    classify_chunk). The sample stores of the daily run are left untouched
+
+    Inputs:
+    start_date, end_date: datetime.dates of the period
+
+    bays: list of bay strings ("E", "C", "W")
+
+    sensor_types: list of sensor type names, defaults to the types enabled in the config file
+
+    chunk_days: number of days per query
+
+    max_workers: maximum number of queries in flight
+
+    timeout: number of seconds a single query is allowed to run before it is cancelled
+
+    checkpoint: filename/path of the checkpoint file
+
+    Outputs:
+    the number of chunks fetched by this call.
+    Raises the first error seen once all of the chunks have been tried, the failed chunks are retried on the next call
+    '''
+    done = load_checkpoint(checkpoint)
+    sensor_types = [t.name for t in types.enabled_types(sensor_types)]
+
+    jobs = []
+    for bay in bays:
+        for chunk_start, chunk_end in day_chunks(start_date, end_date, chunk_days):
+            #only the types of a chunk that are not done yet are fetched
+            todo = [t for t in sensor_types if chunk_key(bay, t, chunk_start, chunk_end) not in done]
+            if todo:
+                jobs.append((bay, todo, chunk_start, chunk_end))
+
+    print(str(len(jobs)) + " chunks to fetch, " + str(len(done)) + " already in the checkpoint")
+    if not jobs:
+        return 0
+
+    max_workers = max(1, min(max_workers, connection.POOL_MAX, len(jobs)))
+    n_fetched = 0
+    errors = {}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="backfill") as executor:
+        futures = {}
+        for bay, todo, chunk_start, chunk_end in jobs:
+            #write_files=False keeps the daily sample stores as they are, the rollups are always updated. The chunks
+            #are only fetched once, so they are kept out of the fetch cache
+            future = executor.submit(data_fetch.main_data, bay, todo, timeout=timeout, mode="samples",
+                                     write_files=False, start_date=chunk_start, end_date=chunk_end, use_cache=False)
+            label = bay + " " + chunk_start.strftime(DATE_FORMAT) + "-" + chunk_end.strftime(DATE_FORMAT)
+            futures[future] = (label, bay, chunk_end, chunk_keys(bay, todo, chunk_start, chunk_end))
+
+        for future in concurrent.futures.as_completed(futures):
+            label, bay, chunk_end, keys = futures[future]
+            try:
+                #the chunks are classified one at a time here, so only one thread writes the state history. The
+                #samples themselves are not kept, so memory stays bounded by the chunks in flight
+                classify_chunk(bay, future.result(), chunk_end)
+            except Exception as e:
+                errors[label] = e
+                print("Failed to backfill " + label + ": " + str(e))
+                continue
+
+            with _checkpoint_lock:
+                done.update(keys)
+                save_checkpoint(done, checkpoint)
+            n_fetched += 1
+            print("Backfilled " + label + " (" + str(n_fetched) + "/" + str(len(jobs)) + ")")
+
+    if errors:
+        raise next(iter(errors.values()))
+
+    return n_fetched
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backfill the daily rollups and the state history over a past period")
+    parser.add_argument("start", help="first day, YYYY/MM/DD")
+    parser.add_argument("end", help="day after the last day, YYYY/MM/DD")
+    parser.add_argument("--bays", nargs="+", default=["E", "C", "W"])
+    parser.add_argument("--types", nargs="+", default=None, help="sensor types, defaults to all")
+    parser.add_argument("--chunk-days", type=int, default=CHUNK_DAYS)
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    args = parser.parse_args(argv)
+
+    start_date = datetime.datetime.strptime(args.start, DATE_FORMAT).date()
+    end_date = datetime.datetime.strptime(args.end, DATE_FORMAT).date()
+
+    try:
+        backfill(start_date, end_date, args.bays, args.types, args.chunk_days, args.workers)
+    finally:
+        connection.close_pool()
+
+
+if __name__ == "__main__":
+    main()
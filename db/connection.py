@@ -0,0 +1,141 @@
+'''
+This program manages the connections to the research database. Instead of every query opening (and closing) its own
+connection, a single oracledb session pool is created once per process and shared by every fetch for every bay and
+sensor type. Statement caching is turned on for the pooled sessions so repeated queries skip the parse step.
+'''
+
+import threading
+
+import oracledb
+
+import config
+
+
+#change lib_dir location
+LIB_DIR = r"lib\instantclient_23_7"
+
+#rows fetched from the database per round trip
+ARRAYSIZE = 100
+
+#pool sizing and statement cache size, can be overridden in the config file
+POOL_MIN = getattr(config, "db_pool_min", 1)
+POOL_MAX = getattr(config, "db_pool_max", 6)
+POOL_INCREMENT = getattr(config, "db_pool_increment", 1)
+STMT_CACHE_SIZE = getattr(config, "db_stmt_cache_size", 40)
+
+#network traffic of the current session so far, used by the run telemetry (see telemetry.py)
+sql_session_bytes = """
+    select sum(m.value) from v$mystat m join v$statname n on m.statistic# = n.statistic#
+    where n.name in ('bytes sent via SQL*Net to client', 'bytes received via SQL*Net from client')
+    """
+
+_client_ready = False
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def init_client():
+    '''
+    Initializes the oracle instant client. Only the first call does any work, later calls are ignored
+
+    Inputs:
+    None
+
+    Outputs:
+    None
+    '''
+    global _client_ready
+
+    if _client_ready:
+        return
+
+    oracledb.init_oracle_client(lib_dir=LIB_DIR)
+    oracledb.defaults.arraysize = ARRAYSIZE
+    _client_ready = True
+
+
+def get_pool():
+    '''
+    Returns the session pool for the research database, creating it on the first call
+
+    Inputs:
+    None
+
+    Outputs:
+    an oracledb ConnectionPool that is shared by the whole process
+    '''
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            init_client()
+
+            # database connection values stored in config file
+            _pool = oracledb.create_pool(
+                user=config.db_un,
+                password=config.db_pw,
+                host=config.db_host,
+                port=1521,
+                sid=config.db_sn,
+                min=POOL_MIN,
+                max=POOL_MAX,
+                increment=POOL_INCREMENT,
+                stmtcachesize=STMT_CACHE_SIZE,
+                getmode=oracledb.POOL_GETMODE_WAIT,
+            )
+            print("Created Oracle Database session pool")
+
+    return _pool
+
+
+def acquire():
+    '''
+    Acquires a connection from the shared pool. Use it in a with statement so the connection is released back
+    into the pool (not closed) once the query is done
+
+    Inputs:
+    None
+
+    Outputs:
+    a pooled oracledb connection
+    '''
+    return get_pool().acquire()
+
+
+def session_bytes(conn):
+    '''
+    Reads the number of bytes the session of a connection has sent and received so far
+
+    Inputs:
+    conn: an oracledb connection
+
+    Outputs:
+    the number of bytes, or None if the database user is not allowed to read the session statistics
+    '''
+    try:
+        cursor = conn.cursor()
+        cursor.execute(sql_session_bytes)
+        (n_bytes,) = cursor.fetchone()
+        cursor.close()
+    except oracledb.DatabaseError:
+        return None
+
+    return int(n_bytes or 0)
+
+
+def close_pool():
+    '''
+    Closes the shared pool and all of its sessions. Should be called once at the end of a run
+
+    Inputs:
+    None
+
+    Outputs:
+    None
+    '''
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close(force=True)
+            _pool = None
@@ -0,0 +1,263 @@
+'''
+This program keeps per sensor daily rollups next to each sample store. Every fetch reduces the samples it got to one
+row of statistics per sensor and day (number of samples, nulls, samples in the valid range, min, max, sum and sum
+of squares), and merges them into the rollup file of the bay and sensor type. Long-horizon health and trend metrics
+(e.g. over 7, 30 or 90 days) are then computed from a few hundred rollup rows per sensor instead of re-querying the raw
+datavalues for every day of the period; the full email report lists the sensors with a low availability over
+long_term_days with them (see outputs/email_reporter.py).
+'''
+
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+#statistics kept per sensor and day, all sensors x days arrays
+COUNT_FIELDS = ["count", "nulls", "in_range"]
+VALUE_FIELDS = ["min", "max", "sum", "sumsq"]
+
+#metrics horizons (days) computed by health_metrics
+HORIZONS = (7, 30, 90)
+
+#fetches of several days (e.g. a backfill) can update the same rollup file at the same time
+_rollup_lock = threading.Lock()
+
+
+def rollup_path(store_path):
+    return store_path + "_rollups.npz"
+
+
+def compute_rollups(timestamps, values, valid_range, null_value):
+    '''
+    Reduces a window of samples to per sensor daily statistics. The samples are split into days once and every
+    statistic is taken for all sensors at the same time with reduceat
+
+    Inputs:
+    timestamps: sorted numpy datetime64 array, one per column of values
+
+    values: sensors x time numpy array of the sensor outputs, NaN where a sensor has no sample
+
+    valid_range: (low, high) tuple, samples with low <= value < high are counted as in range
+
+    null_value: value the research database stores for a missing sample of the sensor type
+
+    Outputs:
+    a dictionary with "days" (datetime64[D] array), "slots" (number of timestamps of each day) and one sensors x days
+    array per field of COUNT_FIELDS and VALUE_FIELDS. min and max are NaN on days without samples
+    '''
+    days_of = np.asarray(timestamps).astype("datetime64[D]")
+    days, starts = np.unique(days_of, return_index=True)
+    n_sensors = values.shape[0]
+
+    rollups = {"days": days, "slots": np.diff(np.append(starts, len(days_of))).astype(np.int32)}
+    if len(days) == 0:
+        for field in COUNT_FIELDS:
+            rollups[field] = np.zeros((n_sensors, 0), dtype=np.int32)
+        for field in VALUE_FIELDS:
+            rollups[field] = np.zeros((n_sensors, 0))
+        return rollups
+
+    values = values.astype(np.float64, copy=False)
+    null = values == null_value
+    sample = ~np.isnan(values) & ~null
+
+    rollups["count"] = np.add.reduceat(sample, starts, axis=1).astype(np.int32)
+    rollups["nulls"] = np.add.reduceat(null, starts, axis=1).astype(np.int32)
+    with np.errstate(invalid="ignore"):
+        in_range = sample & (values >= valid_range[0]) & (values < valid_range[1])
+    rollups["in_range"] = np.add.reduceat(in_range, starts, axis=1).astype(np.int32)
+
+    rollups["min"] = np.minimum.reduceat(np.where(sample, values, np.inf), starts, axis=1)
+    rollups["max"] = np.maximum.reduceat(np.where(sample, values, -np.inf), starts, axis=1)
+    rollups["min"][rollups["count"] == 0] = np.nan
+    rollups["max"][rollups["count"] == 0] = np.nan
+
+    sample_values = np.where(sample, values, 0.0)
+    rollups["sum"] = np.add.reduceat(sample_values, starts, axis=1)
+    rollups["sumsq"] = np.add.reduceat(sample_values * sample_values, starts, axis=1)
+
+    return rollups
+
+
+def load_rollups(path):
+    '''
+    Loads a rollup file
+
+    Inputs:
+    path: filename/path of the .npz rollup file
+
+    Outputs:
+    (sensor names list, rollups dictionary, see compute_rollups), or None if the file does not exist yet
+    '''
+    if not os.path.exists(path):
+        return None
+
+    with np.load(path) as saved:
+        rollups = {key: saved[key] for key in saved.files if key != "sensor_names"}
+        return saved["sensor_names"].tolist(), rollups
+
+
+def save_rollups(path, sensor_names, rollups):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp.npz"
+    np.savez(tmp, sensor_names=np.asarray(sensor_names, dtype=str), **rollups)
+    os.replace(tmp, path)
+
+
+def merge_rollups(old_names, old, new_names, new):
+    '''
+    Merges new daily rollups into the saved ones. Days that are in both are taken from whichever saw more timestamps,
+    so the partly covered first day of a rolling window never replaces a complete day
+
+    Inputs:
+    old_names, old: sensor names and rollups of the saved file
+
+    new_names, new: sensor names and rollups computed from the latest fetch
+
+    Outputs:
+    (sensor names list, merged rollups dictionary)
+    '''
+    names = list(old_names) + [name for name in new_names if name not in set(old_names)]
+    days = np.union1d(old["days"], new["days"])
+
+    old_rows = pd.Index(names).get_indexer(old_names)
+    new_rows = pd.Index(names).get_indexer(new_names)
+    old_cols = np.searchsorted(days, old["days"])
+    new_cols = np.searchsorted(days, new["days"])
+
+    slots = np.zeros(len(days), dtype=np.int32)
+    slots[old_cols] = old["slots"]
+    #days of the new fetch that replace the saved ones
+    replace = new["slots"] >= slots[new_cols]
+    slots[new_cols[replace]] = new["slots"][replace]
+
+    merged = {"days": days, "slots": slots}
+    for field in COUNT_FIELDS + VALUE_FIELDS:
+        if field in COUNT_FIELDS:
+            array = np.zeros((len(names), len(days)), dtype=np.int32)
+        else:
+            array = np.full((len(names), len(days)), np.nan if field in ["min", "max"] else 0.0)
+
+        array[np.ix_(old_rows, old_cols)] = old[field]
+        array[np.ix_(new_rows, new_cols[replace])] = new[field][:, replace]
+        merged[field] = array
+
+    return names, merged
+
+
+def update_rollups(path, sensor_names, timestamps, values, valid_range, null_value):
+    '''
+    Computes the daily rollups of a fetch and merges them into the rollup file
+
+    Inputs:
+    path: filename/path of the .npz rollup file (see rollup_path)
+
+    sensor_names: list of sensor names, one per row of values
+
+    timestamps: sorted numpy datetime64 array, one per column of values
+
+    values: sensors x time numpy array of the sensor outputs, NaN where a sensor has no sample
+
+    valid_range: (low, high) tuple of the sensor type's valid range
+
+    null_value: null value of the sensor type
+
+    Outputs:
+    None
+    '''
+    new = compute_rollups(timestamps, values, valid_range, null_value)
+
+    with _rollup_lock:
+        saved = load_rollups(path)
+
+        if saved is None:
+            names, rollups = list(sensor_names), new
+        else:
+            names, rollups = merge_rollups(saved[0], saved[1], sensor_names, new)
+
+        save_rollups(path, names, rollups)
+
+
+def window_metrics(sensor_names, rollups, n_days, end_day=None):
+    '''
+    Computes health and trend metrics of every sensor over the last n_days days of rollups
+
+    Inputs:
+    sensor_names, rollups: see load_rollups
+
+    n_days: number of days in the window
+
+    end_day: last day (datetime64[D]) of the window, defaults to the last day in the rollups
+
+    Outputs:
+    a dataframe with one row per sensor: the days with samples, availability (samples / timestamps, %), in range
+    (% of samples), mean, sd, min, max and trend (least squares slope of the daily means per day)
+    '''
+    days = rollups["days"]
+    if end_day is None:
+        end_day = days[-1] if len(days) else np.datetime64("today", "D")
+    window = (days > end_day - np.timedelta64(n_days, "D")) & (days <= end_day)
+
+    count = rollups["count"][:, window].astype(np.float64)
+    total = count.sum(axis=1)
+    slots = rollups["slots"][window].sum()
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = rollups["sum"][:, window].sum(axis=1) / total
+        var = rollups["sumsq"][:, window].sum(axis=1) / total - mean * mean
+        sd = np.sqrt(np.maximum(var * total / (total - 1), 0))
+
+        #slope of the daily means, weighted by whether the day has samples
+        x = (days[window] - end_day).astype(np.float64)
+        daily_mean = rollups["sum"][:, window] / count
+        has = count > 0
+        n = has.sum(axis=1)
+        x_mean = (has * x).sum(axis=1) / n
+        y_mean = np.where(has, daily_mean, 0).sum(axis=1) / n
+        dx = np.where(has, x - x_mean[:, None], 0)
+        trend = (dx * np.where(has, daily_mean - y_mean[:, None], 0)).sum(axis=1) / (dx * dx).sum(axis=1)
+
+        availability = 100 * total / slots if slots else np.full(len(total), np.nan)
+        in_range = 100 * rollups["in_range"][:, window].sum(axis=1) / total
+
+    return pd.DataFrame({
+        "sensor name": sensor_names,
+        "days": n,
+        "availability": availability,
+        "in range": in_range,
+        "mean": mean,
+        "sd": sd,
+        "min": np.fmin.reduce(rollups["min"][:, window], axis=1, initial=np.nan),
+        "max": np.fmax.reduce(rollups["max"][:, window], axis=1, initial=np.nan),
+        "trend": trend,
+    })
+
+
+def health_metrics(store_path, horizons=HORIZONS, end_day=None):
+    '''
+    Computes the window_metrics of a bay and sensor type for several horizons from its rollup file
+
+    Inputs:
+    store_path: path of the sample store, the rollups are kept next to it (see rollup_path)
+
+    horizons: tuple of window lengths in days
+
+    end_day: last day (datetime64[D]) of the windows, defaults to the last day in the rollups
+
+    Outputs:
+    a dataframe with a "horizon" column and the window_metrics columns, one row per sensor and horizon. Empty if
+    there are no rollups yet
+    '''
+    saved = load_rollups(rollup_path(store_path))
+    if saved is None:
+        return pd.DataFrame()
+
+    frames = []
+    for n_days in horizons:
+        frame = window_metrics(saved[0], saved[1], n_days, end_day)
+        frame.insert(0, "horizon", n_days)
+        frames.append(frame)
+
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,321 @@
+'''
+This program queries the sensor data of a bay. It dynamically queries data from the previous 24 hour day period, and
+queries every requested sensor type (see db/sensor_types.py) of every sensor in the hillslope that has not been
+removed (see masterlists/sensor_catalog.py) with a single query:
+the variables of a kind of sensor are selected together with "variableid in (...)", and the long form rows that come
+back are split into one SampleSet per sensor type. This program then writes each of them to its sample store in the
+data folder.
+'''
+
+from db import connection
+from db import features
+from db import fetch_cache
+from db import rolling_cache
+from db import sample_store
+from db import daily_rollups
+from db import sensor_types as types
+from masterlists import sensor_catalog
+import config
+import telemetry
+
+import datetime
+
+import numpy as np
+
+
+#number of days queried, and whether raw samples or server side features are fetched ("samples" or "features")
+WINDOW_DAYS = getattr(config, "window_days", 1)
+FETCH_MODE = getattr(config, "fetch_mode", "samples")
+
+#only query rows newer than the last fetch and keep a local rolling window (see db/rolling_cache.py)
+INCREMENTAL = getattr(config, "incremental_fetch", False)
+
+#answer repeated fetches of the same window from the local fetch cache (see db/fetch_cache.py)
+FETCH_CACHE = getattr(config, "fetch_cache", True)
+
+#merge per sensor daily statistics of every fetch into the rollups next to the sample store (see db/daily_rollups.py)
+ROLLUPS = getattr(config, "daily_rollups", True)
+
+#rows per fetchmany round trip (also the number of rows prefetched with the execute), and the expected minutes between
+#samples, used to size the sample buffers before the query runs
+FETCH_ARRAYSIZE = getattr(config, "db_fetch_arraysize", 5000)
+SAMPLE_INTERVAL_MINUTES = getattr(config, "sample_interval_minutes", 15)
+
+#one row per timestamp, variable and sensor. Samples at the same minute are averaged like the old PIVOT did
+sql_samples = """
+    select to_char(localdatetime, 'YYYY/MM/DD HH24:MI') as DateTime, variableid, sensorid, AVG(datavalue)
+    from {}.datavalues where ({})
+    and localdatetime >= to_date(:start_time, 'YYYY/MM/DD HH24:MI')
+    and localdatetime < to_date(:end_time, 'YYYY/MM/DD HH24:MI')
+    group by to_char(localdatetime, 'YYYY/MM/DD HH24:MI'), variableid, sensorid
+    order by DateTime
+    """
+
+
+def sensor_check(sensor_types, device_sensors):
+    '''
+    Builds the SQL condition that selects every requested variable of every sensor, grouping the variables of each
+    kind of sensor under one sensorid list
+
+    Inputs:
+    sensor_types: list of SensorTypes
+
+    device_sensors: dictionary of device to its (sensor names, sensor ids) lists
+
+    Outputs:
+    a string like "(variableid in (6,3) and sensorid in (1,2,...)) or (variableid in (7) and sensorid in (...))"
+    '''
+    checks = []
+    for device, (sensor_names, sensor_ids) in device_sensors.items():
+        variable_ids = [str(t.variable_id) for t in sensor_types if t.device == device]
+        checks.append("(variableid in ({}) and sensorid in ({}))".format(
+            ",".join(variable_ids), ",".join(str(sensor_id) for sensor_id in sensor_ids)))
+
+    return " or ".join(checks)
+
+
+def query_window(start_date=None, end_date=None):
+    '''
+    Returns the start and end time of the query, the previous day(s) unless a date range is given
+
+    Inputs:
+    start_date, end_date: optional datetime.dates of the period [start_date, end_date)
+
+    Outputs:
+    (startTime, endTime) strings, 'YYYY/MM/DD HH:MM'
+    '''
+    #generates a valid start and end time of query using dynamic dates
+    today = datetime.date.today()
+    start = today - datetime.timedelta(WINDOW_DAYS)
+    end = today
+
+    if start_date is not None:
+        start = start_date
+        end = end_date
+
+    return start.strftime("%Y/%m/%d 00:00"), end.strftime("%Y/%m/%d 00:00")
+
+
+def bytes_since(conn, bytes_before):
+    #bytes the session of conn sent and received since session_bytes returned bytes_before, None when unknown
+    if bytes_before is None:
+        return None
+
+    bytes_after = connection.session_bytes(conn)
+    return None if bytes_after is None else bytes_after - bytes_before
+
+
+def query_samples(bay, sensor_types, device_sensors, startTime, endTime, timeout=None, record=None):
+    '''
+    Queries the samples of the given sensor types of a bay with a single query
+
+    Inputs:
+    bay: string of either "E", "C" or "W"
+
+    sensor_types: list of SensorTypes
+
+    device_sensors: dictionary of device to its (sensor names, sensor ids) lists
+
+    startTime, endTime: 'YYYY/MM/DD HH:MM' strings of the query window
+
+    timeout: optional number of seconds the query may run before it is cancelled
+
+    record: optional telemetry record the number of rows and bytes are added to
+
+    Outputs:
+    a dictionary of variableid to (timestamps, values), see RowBuffer.arrays
+    '''
+    if record is None:
+        record = {}
+
+    #changes slope being queried depending on bay param
+    slope = types.SLOPES[bay]
+    check = sensor_check(sensor_types, {t.device: device_sensors[t.device] for t in sensor_types})
+
+    #the buffers are preallocated for every sample slot of the window, and grow only if more timestamps come back
+    window_minutes = (datetime.datetime.strptime(endTime, "%Y/%m/%d %H:%M")
+        - datetime.datetime.strptime(startTime, "%Y/%m/%d %H:%M")).total_seconds() / 60
+    buffer = sample_store.RowBuffer({t.variable_id: device_sensors[t.device][1] for t in sensor_types},
+        window_minutes // SAMPLE_INTERVAL_MINUTES + 1)
+
+    #connection is borrowed from the shared session pool (see db/connection.py)
+    conn = connection.acquire()
+    try:
+        cursor = conn.cursor()
+
+        #call_timeout is in milliseconds, 0 means no limit
+        if timeout:
+            conn.call_timeout = int(timeout * 1000)
+
+        cursor.arraysize = FETCH_ARRAYSIZE
+        cursor.prefetchrows = FETCH_ARRAYSIZE
+
+        bytes_before = connection.session_bytes(conn) if telemetry.DB_BYTES else None
+
+        sqle = sql_samples.format(slope, check)
+        #dates are bind variables so the statement text is the same every run and hits the statement cache
+        results = cursor.execute(sqle, start_time=startTime, end_time=endTime)
+
+        #rows are (datetime, variableid, sensorid, value), streamed into the buffers one batch at a time
+        record["rows"] = 0
+        while True:
+            rows = results.fetchmany()
+            if not rows:
+                break
+            buffer.add(rows)
+            record["rows"] += len(rows)
+
+        record["bytes"] = bytes_since(conn, bytes_before)
+
+        cursor.close()
+    finally:
+        #releases the connection back into the pool, also when the query failed or was cancelled, so a failing
+        #database does not use up the pool
+        conn.call_timeout = 0
+        conn.close()
+
+    return buffer.arrays()
+
+
+def main_data(bay, sensor_types=None, timeout=None, mode=None, write_files=True, start_date=None, end_date=None,
+              use_cache=None):
+    '''
+    Queries the previous day(s) of data of every requested sensor type for the given bay and writes it to the sample
+    stores in the data folder. In "features" mode one row of health features per sensor is written to the features
+    csvs instead
+
+    Inputs:
+    bay: string of either "E", "C" or "W"
+
+    sensor_types: list of sensor type names, defaults to the types enabled in the config file
+
+    timeout: optional number of seconds the query may run before it is cancelled
+
+    mode: "samples" or "features", defaults to the fetch_mode in the config file
+
+    write_files: also write the queried data to the sample stores (or the features csvs). Incremental fetches always
+    write the stores, since they hold the rolling window
+
+    start_date, end_date: optional datetime.dates to query [start_date, end_date) instead of the previous day(s),
+    used by the backfill (see db/backfill.py). Such fetches are never incremental
+
+    use_cache: look the samples up in (and add them to) the fetch cache, defaults to fetch_cache in the config file.
+    False always queries the database. Incremental and "features" fetches do not use the cache
+
+    Outputs:
+    a dictionary of sensor type name to a SampleSet of its queried data, or in "features" mode to a dictionary of
+    sensor name to its features
+    '''
+    if mode is None:
+        mode = FETCH_MODE
+
+    if use_cache is None:
+        use_cache = FETCH_CACHE
+
+    sensor_types = types.enabled_types(sensor_types)
+
+    #startTime, endTime = 'YYYY/MM/DD HH:MM'
+    startTime, endTime = query_window(start_date, end_date)
+
+    #sensor names and ids of each kind of sensor the requested types are read from, sensors the masterlist marks as
+    #removed are left out of the query
+    device_sensors = {}
+    for sensor_type in sensor_types:
+        if sensor_type.device not in device_sensors:
+            device_sensors[sensor_type.device] = sensor_catalog.active_sensors(bay, sensor_type.device)
+
+    #incremental fetches run up to the current minute and start shortly before the newest row already cached (see
+    #db/rolling_cache.py). The variables are fetched together, so the query starts at the oldest of their starts
+    incremental = INCREMENTAL and mode != "features" and start_date is None
+    if incremental:
+        end_dt = datetime.datetime.now().replace(second=0, microsecond=0)
+        window_start = end_dt - datetime.timedelta(WINDOW_DAYS)
+        query_start = min(rolling_cache.query_start(bay, t.variable_id, window_start,
+            types.sample_store_path(bay, t.name), device_sensors[t.device][0]) for t in sensor_types)
+        startTime = query_start.strftime("%Y/%m/%d %H:%M")
+        endTime = end_dt.strftime("%Y/%m/%d %H:%M")
+
+    print(startTime)
+    print(endTime)
+
+    #changes slope being queried depending on bay param
+    slope = types.SLOPES[bay]
+
+    if mode == "features":
+        check = sensor_check(sensor_types, device_sensors)
+
+        fname_features = {}
+        if write_files:
+            fname_features = {t.name: types.features_path(bay, t.name) for t in sensor_types}
+
+        #connection is borrowed from the shared session pool (see db/connection.py)
+        conn = connection.acquire()
+        try:
+            cursor = conn.cursor()
+
+            #call_timeout is in milliseconds, 0 means no limit
+            if timeout:
+                conn.call_timeout = int(timeout * 1000)
+
+            with telemetry.stage("fetch", bay) as record:
+                bytes_before = connection.session_bytes(conn) if telemetry.DB_BYTES else None
+                features_by_type = features.fetch_features(cursor, slope, sensor_types, device_sensors, check,
+                    startTime, endTime, fname_features)
+                record["rows"] = sum(len(features_of_type) for features_of_type in features_by_type.values())
+                record["bytes"] = bytes_since(conn, bytes_before)
+
+            cursor.close()
+        finally:
+            conn.call_timeout = 0
+            conn.close()
+
+        return features_by_type
+
+    #variables already in the fetch cache are not queried again
+    arrays = {}
+    if use_cache and not incremental:
+        for sensor_type in sensor_types:
+            cached = fetch_cache.get(bay, sensor_type.variable_id, device_sensors[sensor_type.device][1], startTime,
+                endTime)
+            if cached is not None:
+                arrays[sensor_type.variable_id] = cached
+
+    query_types = [t for t in sensor_types if t.variable_id not in arrays]
+
+    with telemetry.stage("fetch", bay) as record:
+        record["cache_hits"] = len(arrays)
+        if query_types:
+            arrays.update(query_samples(bay, query_types, device_sensors, startTime, endTime, timeout, record))
+
+            if use_cache and not incremental:
+                for sensor_type in query_types:
+                    timestamps, values = arrays[sensor_type.variable_id]
+                    fetch_cache.put(bay, sensor_type.variable_id, device_sensors[sensor_type.device][1], startTime,
+                        endTime, timestamps, values)
+        else:
+            print("Samples of bay " + bay + " taken from the fetch cache")
+
+    samples = {}
+    for sensor_type in sensor_types:
+        sensor_names = device_sensors[sensor_type.device][0]
+        timestamps, values = arrays[sensor_type.variable_id]
+        store_out = types.sample_store_path(bay, sensor_type.name)
+
+        with telemetry.stage("store", bay, sensor_type.name) as record:
+            #samples the query returned for the sensor type
+            record["rows"] = int(np.count_nonzero(~np.isnan(values)))
+
+            #new rows are added to the rolling window already in the store, otherwise the store is replaced
+            if incremental:
+                timestamps, values = rolling_cache.update_store(store_out, bay, sensor_type.variable_id, sensor_names,
+                    timestamps, values, window_start, query_start)
+            elif write_files:
+                sample_store.write_store(store_out, sensor_names, timestamps, values)
+
+            if ROLLUPS:
+                daily_rollups.update_rollups(daily_rollups.rollup_path(store_out), sensor_names, timestamps, values,
+                    sensor_type.valid_range, sensor_type.null_value)
+
+        samples[sensor_type.name] = sample_store.SampleSet(sensor_names, timestamps, values)
+
+    return samples
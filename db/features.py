@@ -0,0 +1,95 @@
+'''
+This program handles the "server-side features" fetch mode. Instead of pulling every sample of every sensor back
+from the research database, the database aggregates the samples of each sensor into a single row of health features
+(sample count, null count, min, max, out of range count, mean and standard deviation). The sensor state detector can
+classify each sensor straight from these rows, which keeps the transfer small even for 7 or 30 day windows.
+'''
+
+import csv
+
+
+FEATURE_COLUMNS = ["sensor name", "samples", "nulls", "min", "max", "outliers", "mean", "stddev"]
+
+#the null sentinel and the range check of each variable are filled in from the sensor type table, the range check is
+#done on valid samples only. Rows with a NULL datavalue are not counted at all, like the "samples" mode treats them as
+#missing samples (NaN), so both modes find the same states
+sql_features = """
+    select variableid, sensorid,
+    count(datavalue) as samples,
+    sum(case when ({null_check}) then 1 else 0 end) as nulls,
+    min(case when not ({null_check}) then datavalue end) as minval,
+    max(case when not ({null_check}) then datavalue end) as maxval,
+    sum(case when not ({null_check}) and ({range_check}) then 1 else 0 end) as outliers,
+    avg(case when not ({null_check}) then datavalue end) as meanval,
+    stddev(case when not ({null_check}) then datavalue end) as stddevval
+    from {slope}.datavalues where ({sensor_check}) 
+    and localdatetime >= to_date(:start_time, 'YYYY/MM/DD HH24:MI') 
+    and localdatetime < to_date(:end_time, 'YYYY/MM/DD HH24:MI') 
+    group by variableid, sensorid
+    """
+
+
+def fetch_features(cursor, slope, sensor_types, device_sensors, sensor_check, start_time, end_time, fname_outs):
+    '''
+    Queries one row of health features per sensor for every requested sensor type in a single query, and writes them
+    to a csv file per sensor type
+
+    Inputs:
+    cursor: an open database cursor
+
+    slope: the schema of the hillslope being queried ("leo_east", ...)
+
+    sensor_types: list of SensorTypes (see db/sensor_types.py) being queried
+
+    device_sensors: dictionary of device to its (sensor names, sensor ids) lists
+
+    sensor_check: the SQL condition that selects the variables and sensors of the query
+
+    start_time, end_time: 'YYYY/MM/DD HH:MM' strings bounding the query window
+
+    fname_outs: dictionary of sensor type name to the filename/path of its features csv, a missing (or None) path
+    skips writing the file
+
+    Outputs:
+    a dictionary of sensor type name to a dictionary with the sensor name as the key and a dictionary of its features
+    as the value. Sensors that returned no rows get a sample count of 0
+    '''
+    null_values = set(t.null_value for t in sensor_types)
+    if len(null_values) == 1:
+        null_check = "datavalue = {}".format(null_values.pop())
+    else:
+        null_check = " or ".join(
+            "(variableid = {} and datavalue = {})".format(t.variable_id, t.null_value) for t in sensor_types)
+    range_check = " or ".join(
+        "(variableid = {} and (datavalue < {} or datavalue >= {}))".format(t.variable_id, *t.valid_range)
+        for t in sensor_types)
+
+    sqle = sql_features.format(null_check=null_check, range_check=range_check, slope=slope, sensor_check=sensor_check)
+    results = cursor.execute(sqle, start_time=start_time, end_time=end_time)
+
+    features_by_id = {}
+    for row in results:
+        features_by_id[(int(row[0]), int(row[1]))] = row[2:]
+
+    features_by_type = {}
+    for sensor_type in sensor_types:
+        sensor_names, sensor_ids = device_sensors[sensor_type.device]
+
+        features_dict = {}
+        for sensor_id, code in zip(sensor_ids, sensor_names):
+            features = features_by_id.get((sensor_type.variable_id, sensor_id))
+            if features is None:
+                features = (0, 0, None, None, 0, None, None)
+            features_dict[code] = dict(zip(FEATURE_COLUMNS[1:], features))
+
+        fname_out = fname_outs.get(sensor_type.name)
+        if fname_out is not None:
+            with open(fname_out, "w", newline="") as csvfile:
+                writer = csv.writer(csvfile)
+                writer.writerow(FEATURE_COLUMNS)
+                for code, features in features_dict.items():
+                    writer.writerow([code] + list(features.values()))
+
+        features_by_type[sensor_type.name] = features_dict
+
+    return features_by_type
@@ -0,0 +1,190 @@
+'''
+This program keeps a local cache of fetched samples in front of the research database. Every entry holds the samples
+of one bay and variable for one set of sensor ids over one query window, saved as an uncompressed .npz file (sensor
+ids, datetime64 timestamps and the float64 values exactly as they were fetched) in data/fetch_cache. A fetch that is
+repeated while its entry is younger than the TTL (e.g. re-running the job the same day, or detection experiments with
+other settings) is answered from the cache instead of querying the database again. Entries are evicted when they
+expire, and the least recently used ones are removed when the cache grows past its size limit.
+'''
+
+import hashlib
+import os
+import threading
+import time
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+import config
+
+
+CACHE_DIR = getattr(config, "fetch_cache_dir", "data/fetch_cache")
+
+#hours an entry is used for after it was fetched, and the total size of the cache folder
+TTL_HOURS = getattr(config, "fetch_cache_ttl_hours", 24)
+MAX_MB = getattr(config, "fetch_cache_max_mb", 1024)
+
+#the fetches of the bays run in parallel and can evict at the same time
+_cache_lock = threading.Lock()
+
+
+def entry_path(bay, variable_id, sensor_ids, start_time, end_time, cache_dir=CACHE_DIR):
+    '''
+    Returns the file of the cache entry of a fetch
+
+    Inputs:
+    bay: string of either "E", "C" or "W"
+
+    variable_id: database variableid
+
+    sensor_ids: list of the queried sensor ids, their order does not matter
+
+    start_time, end_time: 'YYYY/MM/DD HH:MM' strings of the query window
+
+    cache_dir: folder of the cache
+
+    Outputs:
+    the filename/path of the .npz entry
+    '''
+    key = "|".join([bay, str(variable_id), ",".join(str(sensor_id) for sensor_id in sorted(sensor_ids)), start_time,
+                    end_time])
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:24]
+    return os.path.join(cache_dir, bay + "_" + str(variable_id) + "_" + digest + ".npz")
+
+
+def get(bay, variable_id, sensor_ids, start_time, end_time, cache_dir=CACHE_DIR, ttl_hours=TTL_HOURS):
+    '''
+    Looks up the samples of a fetch in the cache
+
+    Inputs:
+    see entry_path, and ttl_hours: maximum age of the entry in hours
+
+    Outputs:
+    (timestamps, values) with the rows of values in the order of sensor_ids, or None if the fetch is not cached or its
+    entry has expired or cannot be read
+    '''
+    path = entry_path(bay, variable_id, sensor_ids, start_time, end_time, cache_dir)
+
+    try:
+        with np.load(path) as entry:
+            if time.time() - float(entry["fetched_at"]) > ttl_hours * 3600:
+                remove(path)
+                return None
+
+            rows = pd.Index(entry["sensor_ids"]).get_indexer(np.asarray(sensor_ids, dtype=np.int64))
+            timestamps = entry["timestamps"]
+            values = entry["values"][rows]
+    except FileNotFoundError:
+        return None
+    except (OSError, EOFError, ValueError, KeyError, zipfile.BadZipFile) as e:
+        #a damaged entry (e.g. left by a full disk) is a cache miss, it is removed and fetched again
+        print("Removing unreadable fetch cache entry " + path + ": " + str(e))
+        remove(path)
+        return None
+
+    #the modification time of an entry is its last use, for the LRU eviction. The entry may have been evicted since
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+    return timestamps, values
+
+
+def remove(path):
+    #removes a file that another thread may have removed already
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def put(bay, variable_id, sensor_ids, start_time, end_time, timestamps, values, cache_dir=CACHE_DIR,
+        max_mb=MAX_MB, ttl_hours=TTL_HOURS):
+    '''
+    Adds the samples of a fetch to the cache and evicts entries if the cache is over its size limit
+
+    Inputs:
+    bay, variable_id, sensor_ids, start_time, end_time: see entry_path
+
+    timestamps: numpy datetime64 array, one per column of values
+
+    values: sensors x time numpy array, one row per sensor id
+
+    max_mb, ttl_hours: size limit of the cache and maximum age of the entries
+
+    Outputs:
+    None
+    '''
+    path = entry_path(bay, variable_id, sensor_ids, start_time, end_time, cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    #written to a temporary file first and moved into place, so a reader never sees a partial entry. Every thread has
+    #its own temporary file
+    tmp = path + "." + str(os.getpid()) + "_" + str(threading.get_ident()) + ".tmp.npz"
+    try:
+        np.savez(tmp, sensor_ids=np.asarray(sensor_ids, dtype=np.int64), timestamps=timestamps, values=values,
+                 fetched_at=np.float64(time.time()))
+        os.replace(tmp, path)
+    except OSError as e:
+        #the samples were fetched, a cache that cannot be written does not fail the fetch
+        print("Could not add the fetch to the cache: " + str(e))
+        remove(tmp)
+        return
+
+    evict(cache_dir, max_mb, ttl_hours)
+
+
+def evict(cache_dir=CACHE_DIR, max_mb=MAX_MB, ttl_hours=TTL_HOURS):
+    '''
+    Removes the entries that were not used within the TTL (they have expired), then the least recently used ones
+    until the cache fits in max_mb. Temporary files left by an interrupted write are removed once they are older than
+    the TTL
+
+    Inputs:
+    cache_dir: folder of the cache
+
+    max_mb, ttl_hours: size limit of the cache and maximum age of the entries
+
+    Outputs:
+    the number of entries removed
+    '''
+    with _cache_lock:
+        if not os.path.isdir(cache_dir):
+            return 0
+
+        oldest_use = time.time() - ttl_hours * 3600
+        removed = 0
+
+        entries = []
+        for name in os.listdir(cache_dir):
+            if not name.endswith(".npz"):
+                continue
+            try:
+                stat = os.stat(os.path.join(cache_dir, name))
+            except FileNotFoundError:
+                continue
+
+            if not name.endswith(".tmp.npz"):
+                entries.append((stat.st_mtime, stat.st_size, name))
+            elif stat.st_mtime < oldest_use:
+                remove(os.path.join(cache_dir, name))
+                removed += 1
+
+        #least recently used first
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+
+        for mtime, size, name in entries:
+            if mtime >= oldest_use and total <= max_mb * 2**20:
+                break
+            remove(os.path.join(cache_dir, name))
+            total -= size
+            removed += 1
+
+    return removed
+
+
+def clear(cache_dir=CACHE_DIR):
+    #removes every entry of the cache
+    return evict(cache_dir, max_mb=0)
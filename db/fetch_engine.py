@@ -0,0 +1,66 @@
+'''
+This program runs the database queries for every bay at the same time. Each bay is fetched with a single query for all
+of its sensor types (see db/data_fetch.py), in its own worker thread with a connection borrowed from the shared session
+pool, so the fetch stage takes about as long as the slowest single query instead of the sum of all of them. Every
+query gets a timeout, and results are collected as the queries finish.
+'''
+
+import concurrent.futures
+
+import config
+from db import connection
+from db import data_fetch
+
+
+#per query timeout in seconds, can be overridden in the config file
+QUERY_TIMEOUT = getattr(config, "db_query_timeout", 300)
+
+
+def fetch_all(bays, sensor_types=None, timeout=QUERY_TIMEOUT, max_workers=None, write_files=True):
+    '''
+    Runs the query of every bay concurrently on a bounded thread pool
+
+    Inputs:
+    bays: list of bay strings ("E", "C", "W")
+
+    sensor_types: list of sensor type names, defaults to the types enabled in the config file
+
+    timeout: number of seconds a single query is allowed to run before it is cancelled
+
+    max_workers: maximum number of queries in flight, defaults to the size of the session pool
+
+    write_files: passed on to the fetch function, False keeps the results in memory only
+
+    Outputs:
+    a dictionary with (bay, sensor_type) as the key and the fetched data (a SampleSet, or a features dictionary) as
+    the value.
+    Raises the first error seen once all of the queries have finished
+    '''
+    if max_workers is None:
+        max_workers = connection.POOL_MAX
+    max_workers = max(1, min(max_workers, len(bays)))
+
+    results = {}
+    errors = {}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fetch") as executor:
+        futures = {}
+        for bay in bays:
+            future = executor.submit(data_fetch.main_data, bay, sensor_types, timeout=timeout, write_files=write_files)
+            futures[future] = bay
+
+        #collects results in the order the queries finish
+        for future in concurrent.futures.as_completed(futures):
+            bay = futures[future]
+            try:
+                for sensor_type, data in future.result().items():
+                    results[(bay, sensor_type)] = data
+                print("Fetched data for bay " + bay)
+            except Exception as e:
+                errors[bay] = e
+                print("Failed to fetch data for bay " + bay + ": " + str(e))
+
+    if errors:
+        raise next(iter(errors.values()))
+
+    return results
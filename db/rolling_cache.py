@@ -0,0 +1,173 @@
+'''
+This program keeps a local rolling window of the queried sensor data for incremental fetches. For every bay and
+variableid it stores a high-watermark (the newest timestamp already fetched), and the sample store of the bay is used
+as the cache of the rows inside the analysis window. Each run only queries the rows newer than the watermark (and the
+last incremental_late_minutes before it again, for rows that reach the database late), replaces the re-queried part
+of the store with them and evicts samples that have fallen out of the window, so frequent runs stay cheap against the
+research database. When the store is missing or its sensor list changed the whole window is queried again.
+'''
+
+import datetime
+import json
+import os
+import threading
+
+import numpy as np
+
+from db import sample_store
+import config
+
+
+CACHE_DIR = "data"
+WATERMARK_FILE = os.path.join(CACHE_DIR, "watermarks.json")
+
+#format of the DateTime column returned by the queries
+TIME_FORMAT = "%Y/%m/%d %H:%M"
+
+#minutes before the watermark that are queried again for rows that reached the database late
+LATE_MINUTES = getattr(config, "incremental_late_minutes", 60)
+
+#several fetches update the watermark file at the same time
+_watermark_lock = threading.Lock()
+
+
+def load_watermark(bay, variable_id):
+    '''
+    Returns the newest timestamp already fetched for a bay and variableid
+
+    Inputs:
+    bay: string of either "E", "C" or "W"
+
+    variable_id: the database variableid
+
+    Outputs:
+    a datetime of the newest fetched row, or None if nothing has been fetched yet
+    '''
+    with _watermark_lock:
+        if not os.path.exists(WATERMARK_FILE):
+            return None
+
+        with open(WATERMARK_FILE, "r") as f:
+            watermarks = json.load(f)
+
+    watermark = watermarks.get(bay + "_" + str(variable_id))
+    if watermark is None:
+        return None
+
+    return datetime.datetime.strptime(watermark, TIME_FORMAT)
+
+
+def save_watermark(bay, variable_id, watermark):
+    '''
+    Stores the newest timestamp fetched for a bay and variableid
+
+    Inputs:
+    bay: string of either "E", "C" or "W"
+
+    variable_id: the database variableid
+
+    watermark: datetime of the newest fetched row, None clears the watermark so the next fetch queries the whole
+    window
+
+    Outputs:
+    None
+    '''
+    with _watermark_lock:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+
+        watermarks = {}
+        if os.path.exists(WATERMARK_FILE):
+            with open(WATERMARK_FILE, "r") as f:
+                watermarks = json.load(f)
+
+        if watermark is None:
+            watermarks.pop(bay + "_" + str(variable_id), None)
+        else:
+            watermarks[bay + "_" + str(variable_id)] = watermark.strftime(TIME_FORMAT)
+
+        with open(WATERMARK_FILE, "w") as f:
+            json.dump(watermarks, f, indent=1)
+
+
+def store_matches(path, sensor_names):
+    #whether the sample store exists and holds the rows of exactly these sensors
+    return sample_store.store_exists(path) and sample_store.open_store(path)[0] == list(sensor_names)
+
+
+def query_start(bay, variable_id, window_start, path, sensor_names):
+    '''
+    Works out where an incremental query should start: LATE_MINUTES before the minute after the watermark, but never
+    before the start of the analysis window. The whole window is queried when nothing was fetched yet, or when the
+    sample store is missing or was written for another sensor list
+
+    Inputs:
+    bay: string of either "E", "C" or "W"
+
+    variable_id: the database variableid
+
+    window_start: datetime of the start of the analysis window
+
+    path: the folder of the sample store
+
+    sensor_names: list of the sensor names that are queried
+
+    Outputs:
+    a datetime to start the query from
+    '''
+    watermark = load_watermark(bay, variable_id)
+    if watermark is None or not store_matches(path, sensor_names):
+        return window_start
+
+    #DateTime is queried with minute resolution, so the next unseen row is at least a minute later
+    return max(watermark + datetime.timedelta(minutes=1 - LATE_MINUTES), window_start)
+
+
+def update_store(path, bay, variable_id, sensor_names, new_timestamps, new_values, window_start, fetched_from):
+    '''
+    Merges newly fetched samples into the sample store of a bay, evicts the samples older than the window start
+    and moves the watermark forward. The fetch is complete from fetched_from on, so the cached samples at and after
+    fetched_from are replaced by it, which also adds the rows that reached the database late
+
+    Inputs:
+    path: the folder of the sample store
+
+    bay: string of either "E", "C" or "W"
+
+    variable_id: the database variableid
+
+    sensor_names: list of sensor names, one per row of new_values
+
+    new_timestamps: numpy datetime64[m] array of the newly fetched timestamps, in time order
+
+    new_values: sensors x time matrix of the newly fetched samples
+
+    window_start: datetime of the start of the analysis window
+
+    fetched_from: datetime the query of the new samples started at
+
+    Outputs:
+    timestamps, values: the timestamp axis and sensors x time matrix of the window now in the store
+    '''
+    timestamps, values = new_timestamps, new_values
+    complete = fetched_from <= window_start
+
+    #the cached samples are dropped if the sensor list changed since they were written (query_start then queries the
+    #whole window, so this only happens when the sensors changed in between)
+    if store_matches(path, sensor_names):
+        complete = True
+        old_names, old_timestamps, old_values = sample_store.open_store(path, mmap_mode=None)
+        older = old_timestamps < np.datetime64(fetched_from, "m")
+        timestamps = np.concatenate([old_timestamps[older], new_timestamps])
+        values = np.concatenate([old_values[:, older], new_values], axis=1)
+
+    keep = timestamps >= np.datetime64(window_start, "m")
+    timestamps, values = timestamps[keep], values[:, keep]
+    sample_store.write_store(path, sensor_names, timestamps, values)
+
+    #without the part of the window before the fetch, the next run has to query the whole window again
+    if not complete:
+        save_watermark(bay, variable_id, None)
+    elif len(timestamps):
+        save_watermark(bay, variable_id, timestamps[-1].astype(datetime.datetime))
+
+    return timestamps, values
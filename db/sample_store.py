@@ -0,0 +1,223 @@
+'''
+This program handles the samples that are handed from the fetch stage to the sensor state detector. In memory they
+are a SampleSet: a timestamp axis, a float64 sensors x time matrix of the queried values (missing samples are NaN)
+and the list of sensor names. On disk the same data is a sample store folder, with the arrays saved as .npy files
+(float32 values) so the detector can open them memory mapped instead of parsing text.
+'''
+
+from dataclasses import dataclass
+import json
+import os
+
+import numpy as np
+
+
+TIMESTAMPS_FILE = "timestamps.npy"
+VALUES_FILE = "values.npy"
+SENSORS_FILE = "sensors.json"
+
+#format of the DateTime column returned by the queries
+TIME_FORMAT = "%Y/%m/%d %H:%M"
+
+
+@dataclass
+class SampleSet:
+    '''
+    The queried samples of one bay and sensor type
+    '''
+    sensor_names: list
+    timestamps: np.ndarray
+    values: np.ndarray
+
+
+class RowBuffer:
+    '''
+    Streams long form query rows (DateTime string, variableid, sensorid, value) into one preallocated float64
+    sensors x time matrix per variable, batch by batch as they come off the cursor. The matrices are sized from the
+    sensor count and the expected number of timestamps of the window, so the memory of a fetch is about 8 bytes per
+    sample slot and known before the query runs; they only grow (doubling the time axis) if more timestamps arrive
+    than expected
+    '''
+
+    def __init__(self, variable_sensors, expected_columns):
+        '''
+        Inputs:
+        variable_sensors: dictionary of variableid to the list of sensor ids that become the rows of its matrix
+
+        expected_columns: expected number of distinct timestamps in the window
+        '''
+        capacity = max(1, int(expected_columns))
+        self.n_columns = 0
+        self.last_time = None
+        self.times = np.empty(capacity, dtype="datetime64[m]")
+        self.variables = {}
+
+        for variable_id, sensor_ids in variable_sensors.items():
+            sensor_ids = np.asarray(sensor_ids, dtype=np.int64)
+            #sensor id -> matrix row, -1 for ids that are not part of the variable
+            lookup = np.full(int(sensor_ids.max(initial=0)) + 1, -1, dtype=np.int64)
+            lookup[sensor_ids] = np.arange(len(sensor_ids))
+            self.variables[variable_id] = {
+                "lookup": lookup,
+                "values": np.full((len(sensor_ids), capacity), np.nan),
+                "used": np.zeros(capacity, dtype=bool),
+            }
+
+    def reserve(self, n_columns):
+        #grows the time axis of every matrix to hold at least n_columns timestamps
+        capacity = len(self.times)
+        if n_columns <= capacity:
+            return
+
+        capacity = max(n_columns, 2 * capacity)
+        times = np.empty(capacity, dtype="datetime64[m]")
+        times[:self.n_columns] = self.times[:self.n_columns]
+        self.times = times
+
+        for buffer in self.variables.values():
+            values = np.full((buffer["values"].shape[0], capacity), np.nan)
+            values[:, :self.n_columns] = buffer["values"][:, :self.n_columns]
+            used = np.zeros(capacity, dtype=bool)
+            used[:self.n_columns] = buffer["used"][:self.n_columns]
+            buffer["values"], buffer["used"] = values, used
+
+    def add(self, rows):
+        '''
+        Adds a batch of rows. Batches must come in time order (the queries order by DateTime)
+
+        Inputs:
+        rows: list of rows (DateTime string, variableid, sensorid, value)
+
+        Outputs:
+        None
+        '''
+        if not rows:
+            return
+
+        times, variables, sensors, samples = zip(*rows)
+        #the DateTime strings sort in time order, so the unique strings of a batch are its part of the time axis
+        unique_times, time_index = np.unique(np.array(times), return_inverse=True)
+
+        #the first timestamp of a batch can be the last one of the previous batch
+        continued = self.last_time is not None and unique_times[0] == self.last_time
+        new_times = unique_times[1:] if continued else unique_times
+        columns = time_index + (self.n_columns - 1 if continued else self.n_columns)
+
+        if len(new_times):
+            self.reserve(self.n_columns + len(new_times))
+            self.times[self.n_columns:self.n_columns + len(new_times)] = (
+                np.char.replace(np.char.replace(new_times, "/", "-"), " ", "T").astype("datetime64[m]"))
+            self.n_columns += len(new_times)
+        self.last_time = unique_times[-1]
+
+        variables = np.array(variables, dtype=np.int64)
+        sensors = np.array(sensors, dtype=np.int64)
+        #None is converted to NaN by numpy for float arrays
+        samples = np.array(samples, dtype=np.float64)
+
+        for variable_id, buffer in self.variables.items():
+            mask = variables == variable_id
+            if not mask.any():
+                continue
+
+            lookup = buffer["lookup"]
+            ids = sensors[mask]
+            rows_of = np.where(ids < len(lookup), lookup[np.minimum(ids, len(lookup) - 1)], -1)
+            known = rows_of >= 0
+
+            buffer["values"][rows_of[known], columns[mask][known]] = samples[mask][known]
+            buffer["used"][columns[mask][known]] = True
+
+    def arrays(self):
+        '''
+        Outputs:
+        a dictionary of variableid to (timestamps, values): a numpy datetime64[m] array and a float64 sensors x time
+        matrix with NaN where a sensor has no sample. A timestamp is only on the axis of a variable if at least one of
+        its sensors has a row there. When every timestamp is used the matrix is a view of the buffer, not a copy
+        '''
+        arrays = {}
+        timestamps = self.times[:self.n_columns]
+
+        for variable_id, buffer in self.variables.items():
+            values = buffer["values"][:, :self.n_columns]
+            used = buffer["used"][:self.n_columns]
+            if used.all():
+                arrays[variable_id] = (timestamps, values)
+            else:
+                arrays[variable_id] = (timestamps[used], values[:, used])
+
+        return arrays
+
+
+def write_store(path, sensor_names, timestamps, values):
+    '''
+    Writes a sample store to disk. Each file is written to a temporary name first and then moved into place, so a
+    reader never sees a half written store
+
+    Inputs:
+    path: the folder of the sample store
+
+    sensor_names: list of sensor names, one per row of values
+
+    timestamps: numpy datetime64[m] array, one per column of values
+
+    values: sensors x time numpy array of the sample values
+
+    Outputs:
+    None
+    '''
+    os.makedirs(path, exist_ok=True)
+
+    for fname, array in [(TIMESTAMPS_FILE, timestamps.astype("datetime64[m]")), (VALUES_FILE, values.astype(np.float32))]:
+        tmp = os.path.join(path, fname + ".tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp, os.path.join(path, fname))
+
+    tmp = os.path.join(path, SENSORS_FILE + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(list(sensor_names), f)
+    os.replace(tmp, os.path.join(path, SENSORS_FILE))
+
+
+def open_store(path, mmap_mode="r"):
+    '''
+    Opens a sample store. By default the arrays are memory mapped, so nothing is read until it is used
+
+    Inputs:
+    path: the folder of the sample store
+
+    mmap_mode: mmap mode passed to numpy.load, None loads the arrays into memory
+
+    Outputs:
+    sensor_names: list of sensor names, one per row of values
+
+    timestamps: numpy datetime64[m] array, one per column of values
+
+    values: sensors x time float32 numpy array of the sample values
+    '''
+    with open(os.path.join(path, SENSORS_FILE), "r") as f:
+        sensor_names = json.load(f)
+
+    timestamps = np.load(os.path.join(path, TIMESTAMPS_FILE), mmap_mode=mmap_mode)
+    values = np.load(os.path.join(path, VALUES_FILE), mmap_mode=mmap_mode)
+
+    return sensor_names, timestamps, values
+
+
+def store_exists(path):
+    return all(os.path.exists(os.path.join(path, fname)) for fname in [TIMESTAMPS_FILE, VALUES_FILE, SENSORS_FILE])
+
+
+def load_samples(path):
+    '''
+    Opens a sample store memory mapped as a SampleSet
+
+    Inputs:
+    path: the folder of the sample store
+
+    Outputs:
+    a SampleSet of the store
+    '''
+    sensor_names, timestamps, values = open_store(path)
+    return SampleSet(sensor_names, timestamps, values)
@@ -0,0 +1,112 @@
+'''
+This program is the table of sensor types the monitor knows about. A sensor type is one database variable read from
+one kind of sensor (the 5TMs report volumetric water content, soil temperature and bulk permittivity, the MPS-2s water
+potential). Every stage looks a type up here instead of having its own copy of the variableid, query strings, valid
+range or file names, so monitoring another variable only takes a new row in SENSOR_TYPES and its name in the
+sensor_types list of the config file. The kinds of sensor themselves (the suffix of the sensor names, where the
+masterlist marks them as removed and their name in the query strings) are listed in DEVICES.
+'''
+
+from dataclasses import dataclass
+
+import config
+
+
+@dataclass(frozen=True)
+class SensorType:
+    '''
+    One monitored variable of one kind of sensor
+    '''
+    #key used in every (bay, sensor type) dictionary and in the reports
+    name: str
+    #the sensor the variable is read from, which is also the suffix of the sensor names ("5TM" or "MPS-2")
+    device: str
+    #database variableid
+    variable_id: int
+    #valid samples satisfy low <= value < high
+    valid_range: tuple
+    #value the research database stores for a missing sample
+    null_value: float = -9999
+    #added to the sample store, features and output file names of the type
+    file_suffix: str = ""
+    #shown in the email report
+    label: str = ""
+    #consecutive samples closer than this count as the same value when looking for flatlined sensors
+    flat_tolerance: float = 0.0
+    #(low, high) range of readings where a steady value is expected (e.g. saturated soil), low <= value < high never
+    #counts towards a flatline. None: every valid reading does
+    flat_exempt: tuple = None
+    #largest physically possible change between two consecutive samples, larger jumps are spikes (None: not checked)
+    spike_limit: float = None
+
+
+@dataclass(frozen=True)
+class Device:
+    '''
+    One kind of sensor installed at the sensor locations, the variables of every SensorType are read from one of them
+    '''
+    #suffix of the sensor names, and the device of the SensorTypes read from it
+    name: str
+    #column of a masterlist item that is filled in once the sensor has been removed
+    removed_column: int
+    #name of the sensor in the query strings modules (query_<name>_ids and query_<name>_order)
+    query_name: str
+
+
+DEVICES = {
+    "5TM": Device("5TM", 3, "5TM"),
+    "MPS-2": Device("MPS-2", 2, "MPS2"),
+}
+
+
+SENSOR_TYPES = {
+    "5TM": SensorType("5TM", "5TM", 6, (-2, 102), label="5TM", spike_limit=25),
+    #wet soils near saturation read a steady -9 to -12 kPa to the 0.1 kPa resolution of the sensor, which is not a
+    #flatline
+    "MPS-2": SensorType("MPS-2", "MPS-2", 7, (-750, -3.75), file_suffix="_mps", label="MPS2", spike_limit=250,
+                        flat_exempt=(-20, -3.75)),
+    "5TM-temp": SensorType("5TM-temp", "5TM", 3, (-40, 60), file_suffix="_temp", label="5TM soil temperature",
+                           spike_limit=10),
+    "5TM-perm": SensorType("5TM-perm", "5TM", 4, (1, 80), file_suffix="_perm", label="5TM bulk permittivity",
+                           spike_limit=25),
+}
+
+#types that are fetched, classified and reported
+ENABLED = getattr(config, "sensor_types", ["5TM", "MPS-2"])
+
+SLOPES = {
+    "E": "leo_east",
+    "C": "leo_center",
+    "W": "leo_west",
+}
+
+BAY_FILE_NAMES = {
+    "E": "east",
+    "C": "center",
+    "W": "west",
+}
+
+
+def get(name):
+    return SENSOR_TYPES[name]
+
+
+def enabled_types(sensor_types=None):
+    #returns the SensorTypes of the given names, defaults to the types enabled in the config file
+    if sensor_types is None:
+        sensor_types = ENABLED
+    return [SENSOR_TYPES[name] for name in sensor_types]
+
+
+def sample_store_path(bay, sensor_type):
+    return "data/samples_" + BAY_FILE_NAMES[bay] + SENSOR_TYPES[sensor_type].file_suffix
+
+
+def features_path(bay, sensor_type):
+    return "masterlists/features_" + BAY_FILE_NAMES[bay] + SENSOR_TYPES[sensor_type].file_suffix + ".csv"
+
+
+def output_paths(bay, sensor_type):
+    #(zone csv, sensor csv) the detector writes for a bay and sensor type
+    suffix = SENSOR_TYPES[sensor_type].file_suffix
+    return ("outputs/zone_health_" + bay + suffix + ".csv", "outputs/sensor_health_" + bay + suffix + ".csv")
@@ -0,0 +1,166 @@
+'''
+This program keeps persistent running statistics of every sensor between runs, so slow drift can be found even
+though each run only looks at a short window. For each sensor it stores the long-term count, mean and sum of squared
+differences (Welford) and a short-term exponentially weighted moving average (EWMA). Only samples newer than the last
+sample already folded in for the same sensor are used, so an update costs O(1) per new sample no matter how much
+history has been seen. The watermark is kept per sensor, so the rows of a sensor that reach the database late (a
+logger uploading a backlog) are still folded in by the next update; a late row older than a sample already folded in
+for its sensor is skipped, which keeps the EWMA of every sensor in time order. A sensor whose
+short-term EWMA has moved more than a few long-term standard deviations away from its long-term mean is reported as
+drifting and in need of recalibration.
+'''
+
+import os
+
+import numpy as np
+
+
+def empty_stats(sensor_names):
+    n = len(sensor_names)
+    return {
+        "sensor_names": np.array(sensor_names),
+        "count": np.zeros(n),
+        "mean": np.zeros(n),
+        "m2": np.zeros(n),
+        "ewma": np.full(n, np.nan),
+        "ewma_time": np.full(n, np.datetime64("NaT"), dtype="datetime64[m]"),
+        "last_time": np.full(n, np.datetime64("NaT"), dtype="datetime64[m]"),
+    }
+
+
+def load_stats(path, sensor_names):
+    '''
+    Loads the running statistics of a bay and sensor type. Sensors that were not tracked yet start out empty
+
+    Inputs:
+    path: filename/path of the .npz statistics file
+
+    sensor_names: list of sensor names, the returned arrays follow this order
+
+    Outputs:
+    a dictionary of numpy arrays (see empty_stats)
+    '''
+    stats = empty_stats(sensor_names)
+    if not os.path.exists(path):
+        return stats
+
+    with np.load(path) as saved:
+        index = {name: i for i, name in enumerate(saved["sensor_names"].tolist())}
+        #files written before the watermark was kept per sensor have one last_time for all of them
+        last_time = saved["last_time"]
+        if last_time.ndim == 0:
+            last_time = np.full(len(index), last_time)
+        for i, name in enumerate(sensor_names):
+            j = index.get(name)
+            if j is not None:
+                for key in ["count", "mean", "m2", "ewma", "ewma_time"]:
+                    stats[key][i] = saved[key][j]
+                stats["last_time"][i] = last_time[j]
+
+    return stats
+
+
+def save_stats(path, stats):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp.npz"
+    np.savez(tmp, **stats)
+    os.replace(tmp, path)
+
+
+def update_stats(stats, timestamps, values, valid_range, null_value, halflife_hours):
+    '''
+    Folds the samples of every sensor that are newer than its last_time into the running statistics. The long-term
+    mean and variance are merged with Chan's parallel form of Welford's algorithm, and the EWMA is advanced one
+    timestamp at a time with a decay based on the time since each sensor's previous sample
+
+    Inputs:
+    stats: dictionary of running statistics (see load_stats), updated in place
+
+    timestamps: sorted numpy datetime64 array, one per column of values
+
+    values: sensors x time numpy array of the sensor outputs, NaN where a sensor has no sample
+
+    valid_range: (low, high) tuple, only samples with low <= value < high are used
+
+    null_value: value the research database stores for a missing sample of the sensor type
+
+    halflife_hours: half-life of the EWMA in hours
+
+    Outputs:
+    None
+    '''
+    timestamps = np.asarray(timestamps, dtype="datetime64[m]")
+    last_time = stats["last_time"]
+    #samples after the last one folded in for the same sensor
+    new = np.isnat(last_time)[:, None] | (timestamps[None, :] > last_time[:, None])
+    columns = new.any(axis=0)
+
+    if not columns.any():
+        return
+
+    x = np.asarray(values[:, columns], dtype=np.float64)
+    new = new[:, columns]
+    new_times = timestamps[columns]
+    low, high = valid_range
+    valid = new & (x == x) & (x != null_value) & (x >= low) & (x < high)
+
+    #long-term statistics of the new batch, merged into the stored ones
+    n_b = valid.sum(axis=1).astype(np.float64)
+    has_b = n_b > 0
+    mean_b = np.where(has_b, np.where(valid, x, 0.0).sum(axis=1) / np.maximum(n_b, 1), 0.0)
+    m2_b = np.where(valid, (x - mean_b[:, None]) ** 2, 0.0).sum(axis=1)
+
+    n_a, mean_a, m2_a = stats["count"], stats["mean"], stats["m2"]
+    n = n_a + n_b
+    delta = mean_b - mean_a
+    with np.errstate(invalid="ignore", divide="ignore"):
+        stats["mean"] = np.where(has_b, mean_a + delta * n_b / n, mean_a)
+        stats["m2"] = np.where(has_b, m2_a + m2_b + delta * delta * n_a * n_b / n, m2_a)
+    stats["count"] = n
+
+    #short-term EWMA, one column at a time over the new samples only
+    halflife = halflife_hours * 60.0
+    ewma = stats["ewma"]
+    ewma_time = stats["ewma_time"]
+    for j in range(x.shape[1]):
+        col_valid = valid[:, j]
+        if not col_valid.any():
+            continue
+
+        t = new_times[j]
+        first = col_valid & np.isnan(ewma)
+        later = col_valid & ~first
+
+        elapsed = (t - ewma_time[later]).astype(np.float64)
+        weight = 1.0 - 0.5 ** (elapsed / halflife)
+        ewma[later] += weight * (x[later, j] - ewma[later])
+        ewma[first] = x[first, j]
+        ewma_time[col_valid] = t
+
+    #the watermark of a sensor moves to its newest row, also a null or out of range one
+    present = new & (x == x)
+    has_rows = present.any(axis=1)
+    newest = new_times[x.shape[1] - 1 - np.argmax(present[:, ::-1], axis=1)]
+    stats["last_time"] = np.where(has_rows, newest, last_time)
+
+
+def find_drifting(stats, n_sd, min_count):
+    '''
+    Finds the sensors whose short-term EWMA is more than n_sd long-term standard deviations from the long-term mean
+
+    Inputs:
+    stats: dictionary of running statistics (see load_stats)
+
+    n_sd: number of long-term standard deviations the EWMA may move before the sensor counts as drifting
+
+    min_count: sensors with fewer long-term samples than this are never flagged
+
+    Outputs:
+    a numpy bool array that is True for every drifting sensor
+    '''
+    count = stats["count"]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sd = np.sqrt(stats["m2"] / (count - 1))
+        drifting = (count >= min_count) & (np.abs(stats["ewma"] - stats["mean"]) > n_sd * sd)
+
+    return drifting
@@ -0,0 +1,345 @@
+'''
+This program keeps the rolling window of samples of one bay and sensor type in memory for the continuous monitor (see
+daemon.py), together with everything the sensor states are worked out from. The window is a sensors x time matrix
+with room for about twice the window, new samples are written after the newest column and old ones are dropped by
+moving the start of the window forward, so the samples are only moved once the end of the buffer is reached.
+
+Next to the samples it keeps the counts of valid, null and out of range samples of every sensor in the window, and a
+flag per sample for rolling outliers ("rolling" outlier mode), flatlines and spikes (see
+sensor_state_detector.scan_chunk). A poll scans only the new samples, carrying on from the run length and last valid
+value of the sample before them, adds their counts and flags and takes out those of the samples that left the window.
+Rolling outliers are only recomputed within half a window of the new (or dropped) samples, and flatlines and spikes
+only for the first samples after the start of the window, so the work of a poll follows the amount of new data and not
+the length of the window. Only the sensors that got or lost samples are re-classified.
+'''
+
+import numpy as np
+
+from db import sample_store
+from db import sensor_types as types
+from detection import drift_tracker
+from detection import rolling_outliers
+from detection import sensor_state_detector as detector
+
+
+#per sample arrays of the buffer and the value of an empty slot
+BUFFERS = {"values": np.nan, "last": np.nan, "run": 0, "outliers": False, "flat": False, "spike": False}
+
+
+class LiveWindow:
+    '''
+    The samples of one bay and sensor type inside the analysis window, and the states of its sensors
+    '''
+
+    def __init__(self, sensor_names, sensor_type, window_minutes, expected_columns, drift_path=None):
+        '''
+        Inputs:
+        sensor_names: list of the names of the queried sensors, one per row
+
+        sensor_type: sensor type name (see db/sensor_types.py)
+
+        window_minutes: length of the analysis window in minutes
+
+        expected_columns: expected number of timestamps in the window, sizes the buffer
+
+        drift_path: filename/path of the running statistics file of the bay and sensor type, drift is not tracked
+        when it is None (see detection/drift_tracker.py)
+        '''
+        self.sensor_names = list(sensor_names)
+        self.sensor_type = sensor_type
+        self.window = np.timedelta64(int(window_minutes), "m")
+        self.rolling = detector.OUTLIER_MODE == "rolling"
+        self.half_window = np.timedelta64(int(detector.OUTLIER_HALF_WINDOW_HOURS * 60), "m")
+        self.spike_limit = types.get(sensor_type).spike_limit if detector.SPIKE_DETECTION else None
+        self.null_value = types.get(sensor_type).null_value
+
+        n_sensors = len(self.sensor_names)
+        capacity = max(2, 2 * int(expected_columns))
+        self.times = np.empty(capacity, dtype="datetime64[m]")
+        for name, empty in BUFFERS.items():
+            setattr(self, name, np.full((n_sensors, capacity), empty))
+        #live columns of the buffer are [start, end)
+        self.start = 0
+        self.end = 0
+
+        #last valid value and run length of every sensor before the first column of the buffer
+        self.head_last = np.full(n_sensors, np.nan)
+        self.head_run = np.zeros(n_sensors, dtype=np.int64)
+
+        self.n_valid = np.zeros(n_sensors, dtype=np.int64)
+        self.n_null = np.zeros(n_sensors, dtype=np.int64)
+        self.n_outlier = np.zeros(n_sensors, dtype=np.int64)
+        self.n_rolling = np.zeros(n_sensors, dtype=np.int64)
+        self.n_flat = np.zeros(n_sensors, dtype=np.int64)
+        self.n_spike = np.zeros(n_sensors, dtype=np.int64)
+
+        self.drift_path = drift_path
+        self.drift_stats = None
+        if detector.DRIFT_TRACKING and drift_path is not None:
+            self.drift_stats = drift_tracker.load_stats(drift_path, self.sensor_names)
+
+        self.states = detector.states_from_counts(self.n_valid, self.n_null, self.n_outlier)
+
+    def timestamps(self):
+        return self.times[self.start:self.end]
+
+    def samples(self):
+        #the window as a SampleSet, the arrays are views of the buffer
+        return sample_store.SampleSet(self.sensor_names, self.times[self.start:self.end],
+                                      self.values[:, self.start:self.end])
+
+    def column(self, time, side="left"):
+        #buffer column of the first timestamp >= time (> time with side="right")
+        return self.start + int(np.searchsorted(self.times[self.start:self.end], time, side=side))
+
+    def carry(self, column):
+        #last valid value and run length of every sensor just before a buffer column, see scan_chunk
+        if column > 0:
+            return self.last[:, column - 1], self.run[:, column - 1]
+        return self.head_last, self.head_run
+
+    def make_room(self, n_columns):
+        #makes sure n_columns more timestamps fit after the end, moving the window to the front of the buffer (and
+        #growing it when it is more than half full) only when the end of the buffer is reached
+        if self.end + n_columns <= len(self.times):
+            return
+
+        self.head_last, self.head_run = [array.copy() for array in self.carry(self.start)]
+
+        live = self.end - self.start
+        capacity = max(len(self.times), 2 * (live + n_columns))
+        times = np.empty(capacity, dtype="datetime64[m]")
+        times[:live] = self.times[self.start:self.end]
+        self.times = times
+
+        for name, empty in BUFFERS.items():
+            old = getattr(self, name)
+            new = np.full((old.shape[0], capacity), empty, dtype=old.dtype)
+            new[:, :live] = old[:, self.start:self.end]
+            setattr(self, name, new)
+
+        self.start, self.end = 0, live
+
+    def take_out(self, first, last):
+        '''
+        Takes the counts and flags of columns [first, last) out of the window
+
+        Inputs:
+        first, last: buffer columns
+
+        Outputs:
+        a numpy bool array that is True for every sensor that has samples there
+        '''
+        values = self.values[:, first:last]
+        valid, null, outlier = detector.sample_flags(values, self.sensor_type)
+        self.n_valid -= valid.sum(axis=1)
+        self.n_null -= null.sum(axis=1)
+        self.n_outlier -= outlier.sum(axis=1)
+
+        for name, counts in [("outliers", self.n_rolling), ("flat", self.n_flat), ("spike", self.n_spike)]:
+            flags = getattr(self, name)[:, first:last]
+            counts -= flags.sum(axis=1)
+            flags[:] = False
+
+        return (values == values).any(axis=1)
+
+    def rewind(self, time):
+        '''
+        Drops the samples at and after time, so the part of the window the database may still add late rows to can be
+        queried again
+
+        Inputs:
+        time: numpy datetime64
+
+        Outputs:
+        a numpy bool array that is True for every sensor that lost samples
+        '''
+        first = self.column(time)
+        changed = self.take_out(first, self.end)
+        self.values[:, first:self.end] = np.nan
+        self.end = first
+
+        if self.rolling and changed.any():
+            #the windows of the samples within half a window before time have lost samples
+            self.update_rolling(changed, time - self.half_window, time)
+
+        return changed
+
+    def add(self, timestamps, values):
+        '''
+        Appends newly fetched samples after the newest timestamp in the window
+
+        Inputs:
+        timestamps: sorted numpy datetime64[m] array
+
+        values: sensors x time numpy array, rows in the order of sensor_names
+
+        Outputs:
+        a numpy bool array that is True for every sensor that got samples
+        '''
+        timestamps = np.asarray(timestamps, dtype="datetime64[m]")
+        if self.end > self.start and len(timestamps):
+            newer = timestamps > self.times[self.end - 1]
+            timestamps, values = timestamps[newer], values[:, newer]
+
+        n_new = len(timestamps)
+        if n_new == 0:
+            return np.zeros(len(self.sensor_names), dtype=bool)
+
+        self.make_room(n_new)
+        first, last = self.end, self.end + n_new
+        self.times[first:last] = timestamps
+        self.values[:, first:last] = values
+
+        scan = detector.scan_chunk(values, self.sensor_type, *self.carry(first))
+        self.last[:, first:last] = scan["last"]
+        self.run[:, first:last] = scan["run"]
+
+        #runs and jumps only count within the window: the k-th valid sample of a sensor in the window has a run of at
+        #most k, and the first one has no previous sample
+        k = self.n_valid[:, None] + np.cumsum(scan["valid"], axis=1)
+        if detector.FLATLINE_SAMPLES > 0:
+            self.flat[:, first:last] = scan["valid"] & (np.minimum(scan["run"], k) >= detector.FLATLINE_SAMPLES)
+            self.n_flat += self.flat[:, first:last].sum(axis=1)
+        if self.spike_limit is not None:
+            self.spike[:, first:last] = (k >= 2) & (scan["jump"] > self.spike_limit)
+            self.n_spike += self.spike[:, first:last].sum(axis=1)
+
+        self.n_valid += scan["valid"].sum(axis=1)
+        self.n_null += scan["null"].sum(axis=1)
+        self.n_outlier += scan["outlier"].sum(axis=1)
+        self.end = last
+
+        if self.drift_stats is not None:
+            drift_tracker.update_stats(self.drift_stats, timestamps, values, detector.VALID_RANGES[self.sensor_type],
+                                       self.null_value, detector.DRIFT_HALFLIFE_HOURS)
+
+        changed = (values == values).any(axis=1)
+        if self.rolling and changed.any():
+            #the flags of the samples up to half a window before the new ones depend on them
+            self.update_rolling(changed, timestamps[0] - self.half_window, timestamps[-1] + self.half_window)
+
+        return changed
+
+    def evict(self, end_time):
+        '''
+        Drops the samples that are older than the window ending at end_time
+
+        Inputs:
+        end_time: numpy datetime64 of the end of the window
+
+        Outputs:
+        a numpy bool array that is True for every sensor that lost samples
+        '''
+        last = self.column(end_time - self.window)
+        if last == self.start:
+            return np.zeros(len(self.sensor_names), dtype=bool)
+
+        changed = self.take_out(self.start, last)
+        self.values[:, self.start:last] = np.nan
+        self.start = last
+
+        if changed.any() and self.end > self.start:
+            self.clear_head(changed)
+
+            if self.rolling:
+                #the windows of the samples within half a window of the start have lost samples
+                first_time = self.times[self.start]
+                self.update_rolling(changed, first_time, first_time + self.half_window)
+
+        return changed
+
+    def clear_head(self, rows):
+        '''
+        For some sensors, clears the flatline flags of the samples that are now fewer than flatline_samples valid
+        samples into the window and the spike flag of the first valid sample, whose runs and jumps reached back to
+        samples that left the window
+
+        Inputs:
+        rows: numpy bool array of the sensors that lost samples
+
+        Outputs:
+        None
+        '''
+        rows = np.nonzero(rows)[0]
+        needed = max(detector.FLATLINE_SAMPLES, 2)
+
+        #enough columns for every sensor to have the needed number of valid samples, or the whole window
+        width = needed
+        while True:
+            last = min(self.end, self.start + width)
+            valid = detector.sample_flags(self.values[rows, self.start:last], self.sensor_type)[0]
+            k = np.cumsum(valid, axis=1)
+            if last == self.end or (k[:, -1] >= needed).all():
+                break
+            width *= 2
+
+        for name, counts, cleared in [("flat", self.n_flat, k < detector.FLATLINE_SAMPLES),
+                                      ("spike", self.n_spike, k < 2)]:
+            flags = getattr(self, name)
+            head = flags[rows, self.start:last]
+            counts[rows] -= (head & cleared).sum(axis=1)
+            flags[rows, self.start:last] = head & ~cleared
+
+    def update_rolling(self, rows, first_time, last_time):
+        '''
+        Recomputes the rolling outlier flags of the samples between first_time and last_time for some sensors, using
+        the samples within half a window of them (see detection/rolling_outliers.py)
+
+        Inputs:
+        rows: numpy bool array of the sensors to recompute
+
+        first_time, last_time: numpy datetime64 range of the samples whose flags are recomputed
+
+        Outputs:
+        None
+        '''
+        first = self.column(first_time)
+        last = self.column(last_time, side="right")
+        lo = self.column(first_time - self.half_window)
+        hi = self.column(last_time + self.half_window, side="right")
+        if first >= last:
+            return
+
+        rows = np.nonzero(rows)[0]
+        flags = rolling_outliers.rolling_outliers(self.values[rows, lo:hi], self.times[lo:hi], self.null_value,
+                                                  detector.OUTLIER_HALF_WINDOW_HOURS, detector.OUTLIER_N_SD)
+        flags = flags[:, first - lo:last - lo]
+
+        self.n_rolling[rows] += flags.sum(axis=1) - self.outliers[rows, first:last].sum(axis=1)
+        self.outliers[rows, first:last] = flags
+
+    def classify(self, rows):
+        '''
+        Re-classifies some of the sensors from the counts and flags of the window, like classify_samples does for the
+        whole window
+
+        Inputs:
+        rows: numpy bool array of the sensors to re-classify
+
+        Outputs:
+        a numpy bool array that is True for every sensor whose state changed
+        '''
+        #state 3 comes from the rolling outliers in "rolling" mode, see classify_samples
+        n_outlier = self.n_rolling if self.rolling else self.n_outlier
+        flatlined = self.n_flat[rows] > 0 if detector.FLATLINE_SAMPLES > 0 else None
+        spiking = self.n_spike[rows] > 0 if self.spike_limit is not None else None
+        states = detector.states_from_counts(self.n_valid[rows], self.n_null[rows], n_outlier[rows], flatlined, spiking)
+
+        if self.drift_stats is not None:
+            stats = {key: self.drift_stats[key][rows] for key in ["count", "mean", "m2", "ewma"]}
+            drifting = drift_tracker.find_drifting(stats, detector.DRIFT_N_SD, detector.DRIFT_MIN_COUNT)
+            states[(states == 4) & drifting] = 5
+
+        changed = np.zeros(len(self.sensor_names), dtype=bool)
+        changed[rows] = self.states[rows] != states
+        self.states[rows] = states
+        return changed
+
+    def save_drift(self):
+        #writes the running statistics, so batch runs and a restarted monitor carry on from them
+        if self.drift_stats is not None:
+            drift_tracker.save_stats(self.drift_path, self.drift_stats)
+
+    def sensor_health(self):
+        return dict(zip(self.sensor_names, self.states.tolist()))
@@ -0,0 +1,94 @@
+'''
+This program finds outliers using rolling statistics instead of fixed ranges. For every sample it computes the mean
+and standard deviation (SD) of the other samples of the same sensor inside a centered time window (+/- 3-4 hours),
+and flags the sample when it falls outside AVG +/- 3*SD. Window sums are taken from cumulative sums, so each sensor
+costs O(n), and all sensors of a bay are worked on together as a sensors x time matrix.
+'''
+
+import numpy as np
+
+
+#number of sensors (rows) processed at a time, bounds the size of the temporary arrays
+ROW_CHUNK = 64
+
+#relative size of the rounding error of the window sums. A sample has to be further than this from the window mean to
+#be flagged, so the samples of a window where the sensor is flat (SD of 0) are not flagged by rounding alone
+ROUNDING = 1e-9
+
+
+def window_bounds(timestamps, half_window):
+    '''
+    Finds the first and one past the last index of the centered window around every timestamp
+
+    Inputs:
+    timestamps: sorted numpy datetime64 array
+
+    half_window: numpy timedelta64 of half the window length
+
+    Outputs:
+    lo, hi: numpy integer arrays, the window of timestamp i is [lo[i], hi[i])
+    '''
+    lo = np.searchsorted(timestamps, timestamps - half_window, side="left")
+    hi = np.searchsorted(timestamps, timestamps + half_window, side="right")
+    return lo, hi
+
+
+def rolling_outliers(values, timestamps, null_value, half_window_hours=3.5, n_sd=3.0, min_samples=8):
+    '''
+    Flags every sample that falls outside the mean +/- n_sd standard deviations of the other valid samples of its
+    sensor inside the centered window. Null and NaN samples are never used and never flagged
+
+    Inputs:
+    values: sensors x time numpy array of the sensor outputs, NaN where a sensor has no sample
+
+    timestamps: sorted numpy datetime64 array, one per column of values
+
+    null_value: value the research database stores for a missing sample of the sensor type
+
+    half_window_hours: half the window length in hours
+
+    n_sd: number of standard deviations a sample may be from the window mean
+
+    min_samples: windows with fewer other valid samples than this are not tested
+
+    Outputs:
+    a sensors x time numpy bool array that is True where a sample is an outlier
+    '''
+    n_sensors, n_times = values.shape
+    outliers = np.zeros((n_sensors, n_times), dtype=bool)
+
+    if n_times == 0:
+        return outliers
+
+    half_window = np.timedelta64(int(half_window_hours * 60), "m")
+    lo, hi = window_bounds(np.asarray(timestamps, dtype="datetime64[m]"), half_window)
+
+    for start in range(0, n_sensors, ROW_CHUNK):
+        chunk = np.asarray(values[start:start + ROW_CHUNK], dtype=np.float64)
+        valid = (chunk == chunk) & (chunk != null_value)
+
+        #samples are shifted by the sensor mean first so the sums of squares do not lose precision
+        counts = valid.sum(axis=1, keepdims=True)
+        shift = np.where(valid, chunk, 0.0).sum(axis=1, keepdims=True) / np.maximum(counts, 1)
+        x = np.where(valid, chunk - shift, 0.0)
+        v = valid.astype(np.float64)
+
+        #cumulative sums with a leading zero, so a window sum is cs[hi] - cs[lo]
+        cs_n = np.concatenate([np.zeros((chunk.shape[0], 1)), np.cumsum(v, axis=1)], axis=1)
+        cs_x = np.concatenate([np.zeros((chunk.shape[0], 1)), np.cumsum(x, axis=1)], axis=1)
+        cs_xx = np.concatenate([np.zeros((chunk.shape[0], 1)), np.cumsum(x * x, axis=1)], axis=1)
+
+        #the sample being tested is taken back out of its own window
+        n = cs_n[:, hi] - cs_n[:, lo] - v
+        s = cs_x[:, hi] - cs_x[:, lo] - x
+        ss = cs_xx[:, hi] - cs_xx[:, lo] - x * x
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = s / n
+            var = np.maximum(ss / n - mean * mean, 0.0)
+            sd = np.sqrt(var)
+            flagged = valid & (n >= min_samples) & (np.abs(x - mean) > n_sd * sd + ROUNDING * (np.abs(chunk) + 1.0))
+
+        outliers[start:start + chunk.shape[0]] = flagged
+
+    return outliers
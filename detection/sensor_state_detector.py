@@ -1,35 +1,96 @@
 '''
-This program categorizes 5TMs and MPS2 sensors into given states. It uses the database outputs of the sensors
-and uses these values to put into one of 5 state (see header of determine health functions). It will find the state
-of each sensor zone. It will report these values into csvs in the outputs folder.
+This program categorizes the sensors of every sensor type (see db/sensor_types.py) into given states. It uses the database outputs of the sensors
+and uses these values to put each sensor into one of the states 0-7 (removed, dead, in and out, outliers, healthy,
+drifting, flatlined, spikes; see header of classify_matrix). It will find the state
+of each sensor zone. It returns these values as BayResult objects, and can also report them into csvs in the outputs
+folder.
 '''
 
+from dataclasses import dataclass
 import csv
 import json
-import copy
 
-def generate_sensor_dict(filename_csv):
+import numpy as np
+
+import config
+import telemetry
+from db import sample_store
+from db import sensor_types as types
+from detection import rolling_outliers
+from detection import drift_tracker
+from masterlists import sensor_registry
+from masterlists import sensor_catalog
+from masterlists.sensor_registry import get_sensor_loc, get_sensor_name
+
+
+#valid (low, high) range of each sensor type, a valid sample satisfies low <= value < high
+VALID_RANGES = {name: sensor_type.valid_range for name, sensor_type in types.SENSOR_TYPES.items()}
+
+#number of timestamps classified at a time by classify_matrix, bounds the size of the temporary arrays
+CLASSIFY_CHUNK = 4096
+
+#"samples" classifies from the queried time series, "features" from the per sensor rows aggregated by the database
+FETCH_MODE = getattr(config, "fetch_mode", "samples")
+
+#"range" uses VALID_RANGES for state 3, "rolling" flags values outside AVG +/- 3*SD of a centered window instead
+OUTLIER_MODE = getattr(config, "outlier_mode", "range")
+OUTLIER_HALF_WINDOW_HOURS = getattr(config, "outlier_half_window_hours", 3.5)
+OUTLIER_N_SD = getattr(config, "outlier_n_sd", 3.0)
+
+#sensors that repeat one value for flatline_hours are flatlined (state 6, off with 0, the default), and sensors with a
+#jump between consecutive samples over the spike_limit of their type have spikes (state 7, see db/sensor_types.py)
+FLATLINE_HOURS = getattr(config, "flatline_hours", 0)
+FLATLINE_SAMPLES = int(round(FLATLINE_HOURS * 60 / getattr(config, "sample_interval_minutes", 15)))
+SPIKE_DETECTION = getattr(config, "spike_detection", True)
+
+#persistent per sensor statistics used to flag healthy sensors that drift (state 5, see detection/drift_tracker.py)
+DRIFT_TRACKING = getattr(config, "drift_tracking", True)
+DRIFT_HALFLIFE_HOURS = getattr(config, "drift_ewma_halflife_hours", 24)
+DRIFT_N_SD = getattr(config, "drift_n_sd", 3.0)
+DRIFT_MIN_COUNT = getattr(config, "drift_min_count", 672)
+
+#sensor types classified by main, see db/sensor_types.py for the files of each (bay, sensor type)
+SENSOR_TYPES = types.ENABLED
+
+
+@dataclass
+class BayResult:
+    '''
+    The detector output for one sensor type of one bay: the state of every sensor and of every zone
+    '''
+    bay: str
+    sensor_type: str
+    sensor_names: list
+    states: np.ndarray
+    zone_names: list
+    zone_states: np.ndarray
+    outlier_times: dict = None
+
+    def sensor_health(self):
+        return dict(zip(self.sensor_names, self.states.tolist()))
+
+    def zone_health(self):
+        return dict(zip(self.zone_names, self.zone_states.tolist()))
+
+def generate_sensor_dict(store_path):
     '''
-    Takes a CSV of queried sensor outputs from the research database and loads it into a dictionary
+    Opens the sample store of queried sensor outputs from the research database (see db/sample_store.py) and
+    loads it into a dictionary. The store is memory mapped, so only the samples that are used get read
 
     Inputs:
-    filename_csv: The filename/path to the csv file that holds the queried sensor information
+    store_path: The path to the sample store folder that holds the queried sensor information
 
     Outputs:
-    sensor_dict: A dictionary that contains the sensor name as a key and an array of floats as the values
+    sensor_dict: A dictionary that contains the sensor name as a key and an array of floats as the values.
+    Timestamps where the sensor has no sample at all (NaN in the store) are left out
     '''
     sensor_dict = {}
-    with open(filename_csv, "r") as sensorfile:
-        reader = csv.reader(sensorfile)
-        for line in reader:
-            sensor_dict[line[0]] = []
+    sensor_names, timestamps, values = sample_store.open_store(store_path)
+
+    for i, name in enumerate(sensor_names):
+        row = values[i]
+        sensor_dict[name] = row[~np.isnan(row)]
 
-            for val in line[1:]:
-                try:
-                    sensor_dict[line[0]].append(float(val))
-                except:
-                    sensor_dict[line[0]] = []
-    
     return sensor_dict
 
 def generate_json_dict(filename_json):
@@ -50,50 +111,279 @@ def generate_json_dict(filename_json):
     return sensors_dict
     
 
-def determine_health_5tm(outputs):
+def classify_matrix(values, sensor_type):
     #0 = sensor removed
     #1 = sensor fully dead
     #2 = in and out of data
     #3 = outlier data point present
     #4 = sensor healthy
-    
+    #5 = sensor drifting, needs recalibration (set by classify_store)
+    #6 = sensor flatlined, stuck on one value
+    #7 = spikes present, jumps larger than the sensor type allows
+
     '''
-    determines what state (see defined integer states above) a 5tm sensor is in based off its database output
+    determines what state (see defined integer states above) every sensor of a bay is in at once, using masked numpy
+    operations over the sensors x time matrix. States 1-4 come from the valid, null and out of range samples of each
+    row with the NaN (no sample) entries left out (bench/regression.py checks them against a loop over each sensor).
+    Sensors that would be healthy are flatlined when they repeat the same value for flatline_hours, and have spikes
+    when two consecutive samples are further apart than the spike_limit of the sensor type
 
     Inputs:
-    outputs: an array of floats that contains the sensor's data from the database
+    values: sensors x time numpy array of the sensor outputs, NaN where a sensor has no sample
+
+    sensor_type: sensor type name (see db/sensor_types.py), selects the valid range and null sentinel
 
     Outputs:
-    an integer encoding the sensors health state
+    a numpy int8 array with the health state of each sensor (row)
     '''
+    features = sensor_features(values, sensor_type)
+    return states_from_counts(features["n_valid"], features["n_null"], features["n_outlier"], *flags(features))
 
-    all_null = True
-    has_null = False
-    has_outlier = False
+def sample_flags(chunk, sensor_type):
+    '''
+    Inputs:
+    chunk: sensors x time numpy array of sensor outputs, NaN where a sensor has no sample
 
-    for point in outputs:
+    sensor_type: sensor type name (see db/sensor_types.py)
 
-        if point != -9999:
-            all_null = False
+    Outputs:
+    valid, null, outlier: sensors x time bool arrays of the valid samples, the null samples and the valid samples that
+    are out of the valid range
+    '''
+    low, high = VALID_RANGES[sensor_type]
+    null = chunk == types.get(sensor_type).null_value
+    #NaN compares false, so missing samples are neither valid nor outliers
+    valid = (chunk == chunk) & ~null
+    outlier = valid & ((chunk < low) | (chunk >= high))
 
-        elif point == -9999:
-            has_null = True
-        
-        if (point < -2 or point >= 102) and (point != -9999):
-            has_outlier = True
-    
-    if all_null:
-        return 1
-    
-    if has_null:
-        return 2
-    
-    if has_outlier:
-        return 3
-    
-    return 4
+    return valid, null, outlier
+
+def scan_chunk(chunk, sensor_type, last, run):
+    '''
+    one step of the single pass over the time axis. Besides the sample flags it finds, for every sample, the jump from
+    the previous valid sample of its sensor and the length of the run of identical values (within the flat_tolerance
+    of the sensor type) it is part of, counted in valid samples. Missing samples neither end a run nor start one. The
+    previous valid value and run length at the end of the chunk are carried into the next one
+
+    Inputs:
+    chunk: sensors x time numpy array of sensor outputs, NaN where a sensor has no sample
+
+    sensor_type: sensor type name (see db/sensor_types.py)
+
+    last: the last valid value of every sensor before the chunk, NaN if there is none
+
+    run: the run length of every sensor at the end of the previous chunk, 0 if there is none
+
+    Outputs:
+    a dictionary of sensors x time arrays: "valid", "null", "outlier" (see sample_flags), "jump" (NaN where there is no
+    previous valid sample), "run" (the run length of the last valid sample up to each sample) and "last" (the last valid
+    value up to each sample)
+    '''
+    chunk = np.asarray(chunk, dtype=np.float64)
+    n_sensors, n_times = chunk.shape
+    valid, null, outlier = sample_flags(chunk, sensor_type)
+
+    #last valid value up to every sample: the column of the last valid sample is carried forward with a running max
+    column = np.where(valid, np.arange(n_times), -1)
+    np.maximum.accumulate(column, axis=1, out=column)
+    filled = np.where(column >= 0, np.take_along_axis(chunk, np.maximum(column, 0), axis=1), last[:, None])
+
+    previous = np.concatenate([last[:, None], filled[:, :-1]], axis=1)
+    #NaN where the sample or its previous valid sample is missing
+    jump = np.where(valid, np.abs(chunk - previous), np.nan)
+
+    #a run starts at every valid sample that differs from the one before it. Runs are counted in valid samples: the
+    #count of valid samples before the latest start is carried forward the same way as the last valid value
+    #jumps are rounded so a change of exactly one resolution step compares equal to a tolerance of one step. A reading
+    #in the flat_exempt range of the type starts a new run, so those readings never add up to a flatline
+    sensor = types.get(sensor_type)
+    n_seen = np.cumsum(valid, axis=1)
+    starts = valid & ~(np.round(jump, 6) <= sensor.flat_tolerance)
+    if sensor.flat_exempt is not None:
+        with np.errstate(invalid="ignore"):
+            starts |= valid & (chunk >= sensor.flat_exempt[0]) & (chunk < sensor.flat_exempt[1])
+    before_start = np.where(starts, n_seen - 1, -1)
+    np.maximum.accumulate(before_start, axis=1, out=before_start)
+    runs = np.where(before_start >= 0, n_seen - before_start, run[:, None] + n_seen)
+
+    return {"valid": valid, "null": null, "outlier": outlier, "jump": jump, "run": runs, "last": filled}
+
+def sensor_features(values, sensor_type):
+    '''
+    computes every feature the states are found from in one pass over the time axis of the sensors x time matrix,
+    using scan_chunk
+
+    Inputs:
+    values: sensors x time numpy array of the sensor outputs, NaN where a sensor has no sample
+
+    sensor_type: sensor type name (see db/sensor_types.py)
+
+    Outputs:
+    a dictionary of numpy arrays with one entry per sensor: "n_valid", "n_null", "n_outlier" (valid samples out of the
+    valid range), "longest_flat" (longest run of identical values) and "n_spike" (jumps over the spike_limit)
+    '''
+    n_sensors = values.shape[0]
+    spike_limit = types.get(sensor_type).spike_limit
+
+    features = {key: np.zeros(n_sensors, dtype=np.int64)
+                for key in ["n_valid", "n_null", "n_outlier", "longest_flat", "n_spike"]}
+    last = np.full(n_sensors, np.nan)
+    run = np.zeros(n_sensors, dtype=np.int64)
+
+    #the time axis is worked through in chunks so memory stays flat for long or minute resolution windows
+    for start in range(0, values.shape[1], CLASSIFY_CHUNK):
+        scan = scan_chunk(values[:, start:start + CLASSIFY_CHUNK], sensor_type, last, run)
+
+        features["n_valid"] += scan["valid"].sum(axis=1)
+        features["n_null"] += scan["null"].sum(axis=1)
+        features["n_outlier"] += scan["outlier"].sum(axis=1)
+        #between valid samples the run length of the last one is carried, so the max over the chunk is a run length
+        features["longest_flat"] = np.maximum(features["longest_flat"], scan["run"].max(axis=1))
+        if spike_limit is not None:
+            features["n_spike"] += (scan["jump"] > spike_limit).sum(axis=1)
+
+        last, run = scan["last"][:, -1], scan["run"][:, -1]
+
+    return features
+
+def flags(features):
+    #flatlined and spiking sensors from their features (see sensor_features)
+    flatlined = None
+    if FLATLINE_SAMPLES > 0:
+        flatlined = features["longest_flat"] >= FLATLINE_SAMPLES
+
+    spiking = None
+    if SPIKE_DETECTION:
+        spiking = features["n_spike"] > 0
+
+    return flatlined, spiking
+
+def states_from_counts(n_valid, n_null, n_outlier, flatlined=None, spiking=None):
+    #health states 1-4, 6 and 7 of classify_matrix from the sample counts and the flatline and spike flags of every
+    #sensor. Flatlines and spikes are only reported for sensors that would be healthy otherwise
+    states = np.full(len(n_valid), 4, dtype=np.int8)
+    if spiking is not None:
+        states[spiking] = 7
+    if flatlined is not None:
+        states[flatlined] = 6
+    states[n_outlier > 0] = 3
+    states[n_null > 0] = 2
+    states[n_valid == 0] = 1
+
+    return states
+
+def classify_samples(samples, sensor_type, outlier_mode=None, drift_path=None):
+    '''
+    classifies every sensor of a SampleSet (see db/sample_store.py) with classify_matrix. In "rolling" outlier mode
+    state 3 comes from the rolling AVG +/- 3*SD check (see detection/rolling_outliers.py) instead of VALID_RANGES.
+    With drift tracking on (and a drift_path given), the new samples are folded into the sensors' running statistics and healthy sensors
+    that have drifted from their long-term baseline are moved to state 5
+
+    Inputs:
+    samples: SampleSet of the queried sensor information
+
+    sensor_type: sensor type name (see db/sensor_types.py)
+
+    outlier_mode: "range" or "rolling", defaults to the outlier_mode in the config file
+
+    drift_path: filename/path of the running statistics file of the bay and sensor type (see drift_tracker.py)
 
-def determine_health_mps(outputs):
+    Outputs:
+    sensor_health: a dictionary with the sensor name as a key and its integer health state as the value
+
+    outlier_times: a dictionary with the name of every sensor that has rolling outliers as a key and the list of
+    timestamps of its outliers as the value (empty in "range" mode)
+    '''
+    if outlier_mode is None:
+        outlier_mode = OUTLIER_MODE
+
+    sensor_names, timestamps, values = samples.sensor_names, samples.timestamps, samples.values
+    features = sensor_features(values, sensor_type)
+    n_outlier = features["n_outlier"]
+    outlier_times = {}
+
+    if outlier_mode == "rolling":
+        #state 3 of the sensors that got past the dead and in and out checks comes from the rolling outliers instead
+        outliers = rolling_outliers.rolling_outliers(values, timestamps, types.get(sensor_type).null_value,
+                                                    OUTLIER_HALF_WINDOW_HOURS, OUTLIER_N_SD)
+        n_outlier = outliers.sum(axis=1)
+
+        for i in np.nonzero(n_outlier)[0]:
+            outlier_times[sensor_names[i]] = [str(t) for t in timestamps[outliers[i]]]
+
+    states = states_from_counts(features["n_valid"], features["n_null"], n_outlier, *flags(features))
+
+    if DRIFT_TRACKING and drift_path is not None:
+        stats = drift_tracker.load_stats(drift_path, sensor_names)
+        drift_tracker.update_stats(stats, timestamps, values, VALID_RANGES[sensor_type],
+                                   types.get(sensor_type).null_value, DRIFT_HALFLIFE_HOURS)
+        drift_tracker.save_stats(drift_path, stats)
+
+        drifting = drift_tracker.find_drifting(stats, DRIFT_N_SD, DRIFT_MIN_COUNT)
+        states[(states == 4) & drifting] = 5
+
+    return dict(zip(sensor_names, states.tolist())), outlier_times
+
+def classify_store(store_path, sensor_type, outlier_mode=None):
+    '''
+    classifies every sensor in a sample store folder with classify_samples
+
+    Inputs:
+    store_path: The path to the sample store folder that holds the queried sensor information
+
+    sensor_type: sensor type name (see db/sensor_types.py)
+
+    outlier_mode: "range" or "rolling", defaults to the outlier_mode in the config file
+
+    Outputs:
+    see classify_samples
+    '''
+    samples = sample_store.load_samples(store_path)
+    return classify_samples(samples, sensor_type, outlier_mode, store_path + "_drift.npz")
+
+def write_outlier_file(f_out_outliers, outlier_times):
+    '''
+    writes the number of rolling outliers of each sensor and when they happened to a csv file
+
+    Inputs:
+    f_out_outliers: the filename/path of the csv file
+
+    outlier_times: dictionary of sensor name to list of outlier timestamps (see classify_store)
+
+    Outputs:
+    None
+    '''
+    with open(f_out_outliers, "w", newline="") as outlierfile:
+        writer = csv.writer(outlierfile)
+        writer.writerow(["sensor name", "outliers", "times"])
+        for k,v in outlier_times.items():
+            writer.writerow([k, len(v), " ".join(v)])
+
+
+def generate_features_dict(filename_csv):
+    '''
+    Takes a CSV of per sensor health features aggregated by the research database (see db/features.py) and loads it
+    into a dictionary
+
+    Inputs:
+    filename_csv: The filename/path to the csv file that holds the sensor features
+
+    Outputs:
+    features_dict: A dictionary that contains the sensor name as a key and a dictionary of its features as the value
+    '''
+    features_dict = {}
+    with open(filename_csv, "r") as featurefile:
+        reader = csv.DictReader(featurefile)
+        for line in reader:
+            features_dict[line["sensor name"]] = {
+                "samples": int(line["samples"] or 0),
+                "nulls": int(line["nulls"] or 0),
+                "outliers": int(line["outliers"] or 0),
+            }
+
+    return features_dict
+
+def determine_health_features(features):
     #0 = sensor removed
     #1 = sensor fully dead
     #2 = in and out of data
@@ -101,65 +391,53 @@ def determine_health_mps(outputs):
     #4 = sensor healthy
 
     '''
-    determines what state (see defined integer states above) an MPS2 sensor is in based off its database output
+    determines what state (see defined integer states above) a sensor is in based off the health features the
+    database aggregated for it. Gives the same states 1-4 as classify_matrix
 
     Inputs:
-    outputs: an array of floats that contains the sensor's data from the database
+    features: a dictionary with the sample count, null count and out of range count of the sensor
 
     Outputs:
     an integer encoding the sensors health state
     '''
-
-    all_null = True
-    has_null = False
-    has_outlier = False
-
-    for point in outputs:
-
-        if point != -9999:
-            all_null = False
-
-        elif point == 9999:
-            has_null = True
-        
-        if (point < -750 or point >= -3.75) and (point != -9999):
-            has_outlier = True
-    
-    if all_null:
+    if features["samples"] - features["nulls"] <= 0:
         return 1
-    
-    if has_null:
+
+    if features["nulls"] > 0:
         return 2
-    
-    if has_outlier:
+
+    if features["outliers"] > 0:
         return 3
-    
+
     return 4
 
 
-def build_zone_dict(outputs_dict, masterlist_dict, bay, sensor_type):
+def build_zone_dict(outputs_dict, registry, sensor_type):
     '''
-    masterlist_dict_copy = {{zone a: {{sensor 1: 0}, {sensor 2: 3}, ...}, {zone b: {{sensor 1: 0}, {sensor 2: 3}, ...}, ...}
+    zone_dict = {{zone a: {{sensor 1: 0}, {sensor 2: 3}, ...}, {zone b: {{sensor 1: 0}, {sensor 2: 3}, ...}, ...}
 
     Creates a dictionary of the sensor state values that also encodes zones. See above line for details
 
     Inputs:
     outputs_dict: dictionary of sensors and they're associated health state
 
-    masterlist_dict: dictionary that encodes masterlist info
+    registry: SensorRegistry of the bay (see masterlists/sensor_registry.py)
 
-    sensor_type: string of either "5TM" or "MPS-2"
+    sensor_type: sensor type name (see db/sensor_types.py)
 
     Outputs:
     dictionary of dictionaries that encodes sensor states by zone
     '''
-    masterlist_dict_copy = copy.deepcopy(masterlist_dict)
+    zone_dict = {}
+    #the sensor names end in the device the variable is read from
+    device = types.get(sensor_type).device
 
-    for zone in masterlist_dict_copy:
-        for sensor in masterlist_dict_copy[zone]:
-            masterlist_dict_copy[zone][sensor] = outputs_dict[get_sensor_name(sensor, bay, sensor_type)]
+    for zone, locs in registry.locs_by_zone.items():
+        zone_dict[zone] = {}
+        for loc in locs:
+            zone_dict[zone][loc] = outputs_dict[get_sensor_name(loc, registry.bay, device)]
 
-    return masterlist_dict_copy
+    return zone_dict
 
 def generate_zone_health_dict(health_dict):
     #0 = zone down
@@ -192,159 +470,212 @@ def generate_zone_health_dict(health_dict):
     return zone_health_dict
     
 
-def compare_sensors_5tm(sensor_dict, json_dict):
+def compare_sensors(sensor_dict, registry):
     """
-    compares the sensor health dict to the masterlist for 5TMs, and will filter out sensors which have already been removed by setting their state to 0
+    compares the sensor health dict to the masterlist, and will filter out sensors which have already been removed by setting their state to 0
 
     input:
-    sensor_dict: dictionary of dictionaries of sensor health information encoded by zone (see build_zone_dict)
-    json_dict: dictionary of masterlist
+    sensor_dict: dictionary of sensors and their health state
+    registry: SensorRegistry of the bay (see masterlists/sensor_registry.py)
 
     output:
     None, modifies sensor_dict
     """
     for sensor in sensor_dict:
-        if sensor_dict[sensor] == 1:
-            for group in json_dict:
-                if get_sensor_loc(sensor) in json_dict[group]:
-                    if len(json_dict[group][get_sensor_loc(sensor)][3]) != 0:
-                        sensor_dict[sensor] = 0
-                        #print(json_dict[group][get_sensor_loc(sensor)])
-                        #print(sensor + ":" + str(sensor_dict[sensor]))
-
-def compare_sensors_mps(sensor_dict, json_dict):
-    """
-    compares the sensor health dict to the masterlist for MPS2, and will filter out sensors which have already been removed by setting their state to 0
+        if sensor_dict[sensor] == 1 and registry.is_removed(sensor):
+            sensor_dict[sensor] = 0
 
-    input:
-    sensor_dict: dictionary of dictionaries of sensor health information encoded by zone (see build_zone_dict)
-    json_dict: dictionary of masterlist
 
-    output:
-    None, modifies sensor_dict
-    """
-    for sensor in sensor_dict:
-        if sensor_dict[sensor] == 1:
-            for group in json_dict:
-                if get_sensor_loc(sensor) in json_dict[group]:
-                    if len(json_dict[group][get_sensor_loc(sensor)][2]) != 0:
-                        sensor_dict[sensor] = 0
-                        #print(json_dict[group][get_sensor_loc(sensor)])
-                        #print(sensor + ":" + str(sensor_dict[sensor]))
-        
-def get_sensor_loc(sensor_name):
-    loc_items = sensor_name.split("_")
-    return loc_items[1] + "_" + loc_items[2] + "_" + loc_items[3]
+def detect(bay, sensor_type, data=None, mode=None):
+    '''
+    finds the state of every sensor and every zone of one sensor type in a bay
 
-def get_sensor_name(sensor_loc, bay, type):
-    return "LEO-" + bay + "_" + sensor_loc + "_" + type
+    Inputs:
+    bay: string of either "E", "C" or "W"
 
+    sensor_type: sensor type name (see db/sensor_types.py)
 
-def main(bay):
-    #for 5TM checking
-    f_name_json = "masterlists/sensor_status_center.json"
-    f_name_csv = "masterlists/true_data_center.csv"
+    data: the output of the fetch stage, a SampleSet (or a features dictionary in "features" mode). When it is None
+    the data is read from the sample store (or features csv) the fetch stage wrote
 
-    if bay == "E":
-        f_name_json = "masterlists/sensor_status_east.json"
-        f_name_csv = "masterlists/true_data_east.csv"
+    mode: "samples" or "features", defaults to the fetch_mode in the config file
 
+    Outputs:
+    a BayResult with the sensor and zone states
+    '''
+    if mode is None:
+        mode = FETCH_MODE
 
-    if bay == "C":
-        f_name_json = "masterlists/sensor_status_center.json"
-        f_name_csv = "masterlists/true_data_center.csv"
+    registry = sensor_registry.get_registry(bay)
+    outlier_times = None
 
+    if mode == "features":
+        if data is None:
+            data = generate_features_dict(types.features_path(bay, sensor_type))
 
-    if bay == "W":
-        f_name_json = "masterlists/sensor_status_west.json"
-        f_name_csv = "masterlists/true_data_west.csv"
-    
-    sensors = generate_sensor_dict(f_name_csv)
-    json_dict = generate_json_dict(f_name_json)
+        sensor_health = {}
+        for k,v in data.items():
+            sensor_health[k] = determine_health_features(v)
+    else:
+        store_path = types.sample_store_path(bay, sensor_type)
+        if data is None:
+            data = sample_store.load_samples(store_path)
+
+        sensor_health, outlier_times = classify_samples(data, sensor_type, drift_path=store_path + "_drift.npz")
+        if OUTLIER_MODE != "rolling":
+            outlier_times = None
+
+    return bay_result(bay, sensor_type, sensor_health, outlier_times, registry)
+
+def bay_result(bay, sensor_type, sensor_health, outlier_times=None, registry=None):
+    '''
+    adds the removed sensors (state 0) and the zone states to the states of the queried sensors
+
+    Inputs:
+    bay: string of either "E", "C" or "W"
 
-    sensor_health = {}
-    zone_health = {}
+    sensor_type: sensor type name (see db/sensor_types.py)
 
-    for k,v in sensors.items():
-        sensor_health[k] = determine_health_5tm(v)
+    sensor_health: dictionary of the name of every queried sensor to its state
 
-    compare_sensors_5tm(sensor_health, json_dict)
+    outlier_times: optional dictionary of sensor name to its rolling outlier timestamps
 
-    sensor_health_by_zone = build_zone_dict(sensor_health, json_dict, bay, "5TM")
+    registry: SensorRegistry of the bay, looked up when None
+
+    Outputs:
+    a BayResult
+    '''
+    if registry is None:
+        registry = sensor_registry.get_registry(bay)
+
+    #removed sensors are not queried (see masterlists/sensor_catalog.py), they are reported in state 0
+    sensor_names, _ = sensor_catalog.all_sensors(bay, types.get(sensor_type).device)
+    sensor_health = {name: sensor_health.get(name, 0) for name in sensor_names}
+
+    compare_sensors(sensor_health, registry)
+
+    sensor_health_by_zone = build_zone_dict(sensor_health, registry, sensor_type)
 
     zone_health = generate_zone_health_dict(sensor_health_by_zone)
 
-    if bay == "W":
-        f_out_zone = "outputs/zone_health_W.csv"
-        f_out_sensors = "outputs/sensor_health_W.csv"
+    return BayResult(
+        bay,
+        sensor_type,
+        list(sensor_health),
+        np.array(list(sensor_health.values()), dtype=np.int8),
+        list(zone_health),
+        np.array(list(zone_health.values()), dtype=np.int8),
+        outlier_times,
+    )
+
+def write_result(result):
+    '''
+    writes the zone and sensor states of a BayResult to their csvs in the outputs folder (and the rolling outliers,
+    when they were computed)
 
-    if bay == "E":
-        f_out_zone = "outputs/zone_health_E.csv"
-        f_out_sensors = "outputs/sensor_health_E.csv"
-    
-    if bay == "C":
-        f_out_zone = "outputs/zone_health_C.csv"
-        f_out_sensors = "outputs/sensor_health_C.csv"
+    Inputs:
+    result: a BayResult
+
+    Outputs:
+    None
+    '''
+    f_out_zone, f_out_sensors = types.output_paths(result.bay, result.sensor_type)
 
     with open(f_out_zone, "w") as zonefile:
         zonefile.write("zone,state\n")
-        for k,v in zone_health.items():
+        for k,v in result.zone_health().items():
             zonefile.write(k + "," + str(v) + "\n")
         
     with open(f_out_sensors, "w") as sensorfile:
         sensorfile.write("sensor name,state\n")
-        for k,v in sensor_health.items():
+        for k,v in result.sensor_health().items():
             sensorfile.write(k + "," + str(v) + "\n")
 
-
-    #for MPS2
-    f_name_csv_mps = "masterlists/true_data_center_mps.csv"
-
-    if bay == "E":
-        f_name_csv_mps = "masterlists/true_data_east_mps.csv"
+    if result.outlier_times is not None:
+        write_outlier_file(f_out_sensors.replace("sensor_health", "outliers"), result.outlier_times)
 
 
-    if bay == "C":
-        f_name_csv_mps = "masterlists/true_data_center_mps.csv"
+def read_result(bay, sensor_type):
+    '''
+    reads the states of a bay and sensor type back from the csvs write_result wrote, the rolling outliers are not read
 
+    Inputs:
+    bay: string of either "E", "C" or "W"
 
-    if bay == "W":
-        f_name_csv_mps = "masterlists/true_data_west_mps.csv"
+    sensor_type: sensor type name (see db/sensor_types.py)
 
-    sensors_mps = generate_sensor_dict(f_name_csv_mps)
-    json_dict_mps = generate_json_dict(f_name_json)
+    Outputs:
+    a BayResult
+    '''
+    f_out_zone, f_out_sensors = types.output_paths(bay, sensor_type)
+
+    with open(f_out_zone, "r") as zonefile:
+        zone_rows = list(csv.reader(zonefile))[1:]
+
+    with open(f_out_sensors, "r") as sensorfile:
+        sensor_rows = list(csv.reader(sensorfile))[1:]
+
+    return BayResult(
+        bay,
+        sensor_type,
+        [row[0] for row in sensor_rows],
+        np.array([int(row[1]) for row in sensor_rows], dtype=np.int8),
+        [row[0] for row in zone_rows],
+        np.array([int(row[1]) for row in zone_rows], dtype=np.int8),
+    )
+
+
+def settings():
+    #the settings the states depend on besides the samples and the masterlist
+    return {
+        "sensor_types": SENSOR_TYPES,
+        "fetch_mode": FETCH_MODE,
+        "outlier_mode": OUTLIER_MODE,
+        "outlier_half_window_hours": OUTLIER_HALF_WINDOW_HOURS,
+        "outlier_n_sd": OUTLIER_N_SD,
+        "drift_tracking": DRIFT_TRACKING,
+        "drift_halflife_hours": DRIFT_HALFLIFE_HOURS,
+        "drift_n_sd": DRIFT_N_SD,
+        "drift_min_count": DRIFT_MIN_COUNT,
+        "valid_ranges": VALID_RANGES,
+        "flatline_samples": FLATLINE_SAMPLES,
+        "spike_detection": SPIKE_DETECTION,
+        "flat_tolerances": {name: sensor_type.flat_tolerance for name, sensor_type in types.SENSOR_TYPES.items()},
+        "spike_limits": {name: sensor_type.spike_limit for name, sensor_type in types.SENSOR_TYPES.items()},
+    }
+
+
+def main(bay, mode=None, samples=None, write_files=True):
+    '''
+    finds the sensor and zone states of every enabled sensor type in a bay. All of the types come from the same
+    fetch of the bay
 
-    sensor_health_mps = {}
-    zone_health_mps = {}
+    Inputs:
+    bay: string of either "E", "C" or "W"
 
-    for k,v in sensors_mps.items():
-        sensor_health_mps[k] = determine_health_mps(v)
+    mode: "samples" or "features", defaults to the fetch_mode in the config file
 
-    compare_sensors_mps(sensor_health_mps, json_dict_mps)
+    samples: optional dictionary of (bay, sensor_type) to the output of the fetch stage (see fetch_engine.fetch_all).
+    Sensor types that are missing from it are read from the files the fetch stage wrote
 
-    sensor_health_by_zone_mps = build_zone_dict(sensor_health_mps, json_dict_mps, bay, "MPS-2")
+    write_files: also write the states to the csvs in the outputs folder
 
-    zone_health_mps = generate_zone_health_dict(sensor_health_by_zone_mps)
+    Outputs:
+    a dictionary of (bay, sensor_type) to BayResult
+    '''
+    results = {}
 
+    for sensor_type in SENSOR_TYPES:
+        data = None
+        if samples is not None:
+            data = samples.get((bay, sensor_type))
 
-    if bay == "W":
-        f_out_zone_mps = "outputs/zone_health_W_mps.csv"
-        f_out_sensors_mps = "outputs/sensor_health_W_mps.csv"
+        with telemetry.stage("detect", bay, sensor_type) as record:
+            result = detect(bay, sensor_type, data, mode)
+            if write_files:
+                write_result(result)
+            record["sensors"] = len(result.sensor_names)
 
-    if bay == "E":
-        f_out_zone_mps = "outputs/zone_health_E_mps.csv"
-        f_out_sensors_mps = "outputs/sensor_health_E_mps.csv"
-    
-    if bay == "C":
-        f_out_zone_mps = "outputs/zone_health_C_mps.csv"
-        f_out_sensors_mps = "outputs/sensor_health_C_mps.csv"
+        results[(bay, sensor_type)] = result
 
-    with open(f_out_zone_mps, "w") as zonefile:
-        zonefile.write("zone,state\n")
-        for k,v in zone_health_mps.items():
-            zonefile.write(k + "," + str(v) + "\n")
-        
-    with open(f_out_sensors_mps, "w") as sensorfile:
-        sensorfile.write("sensor name,state\n")
-        for k,v in sensor_health_mps.items():
-            sensorfile.write(k + "," + str(v) + "\n")
+    return results
@@ -0,0 +1,394 @@
+'''
+This program keeps the history of the sensor and zone states in a local SQLite database, so questions like "how long
+has this sensor been down" or "how many days this month was zone X down" can be answered without old csvs. Instead of
+a snapshot per run, the history is an append-only log of state transitions: a row is only added when a sensor (or zone)
+changes state, and each row together with the next one for the same sensor forms a state interval. The log is
+clustered on (entity, time), so range queries over a year of history only touch the rows of the sensors asked for.
+'''
+
+import os
+import sqlite3
+import time
+
+import pandas as pd
+
+import config
+from masterlists import sensor_registry
+
+
+HISTORY_DB = getattr(config, "state_history_db", "data/state_history.sqlite")
+
+#states that count as "up" in the uptime queries: sensors that report data, zones that are alive
+UP_STATES = {
+    "sensor": (2, 3, 4, 5, 6, 7),
+    "zone": (1,),
+}
+
+#states that count as "down" in down_since
+DOWN_STATES = {
+    "sensor": (1,),
+    "zone": (0,),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entities (
+    entity INTEGER PRIMARY KEY,
+    bay TEXT NOT NULL,
+    sensor_type TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    sensor_id INTEGER,
+    zone TEXT,
+    UNIQUE (bay, sensor_type, kind, name)
+);
+CREATE INDEX IF NOT EXISTS entities_sensor_id ON entities (sensor_id);
+CREATE INDEX IF NOT EXISTS entities_zone ON entities (bay, sensor_type, zone);
+
+CREATE TABLE IF NOT EXISTS transitions (
+    entity INTEGER NOT NULL,
+    time INTEGER NOT NULL,
+    state INTEGER NOT NULL,
+    prev_state INTEGER,
+    PRIMARY KEY (entity, time)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS transitions_time ON transitions (time);
+
+CREATE TABLE IF NOT EXISTS current (
+    entity INTEGER PRIMARY KEY,
+    state INTEGER NOT NULL,
+    since INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS runs (
+    time INTEGER PRIMARY KEY
+);
+"""
+
+#every transition becomes an interval that lasts until the next transition of the same entity, or the last run
+SQL_INTERVALS = """
+WITH iv AS (
+    SELECT t.entity, t.state, t.time AS start_time,
+           COALESCE(LEAD(t.time) OVER (PARTITION BY t.entity ORDER BY t.time), :last_run) AS end_time
+    FROM transitions t
+    JOIN entities e ON e.entity = t.entity
+    WHERE e.bay = :bay AND e.sensor_type = :sensor_type AND e.kind = :kind
+)
+"""
+
+
+def connect(path=HISTORY_DB):
+    '''
+    Opens the history database, creating the tables on the first call
+
+    Inputs:
+    path: filename/path of the SQLite database
+
+    Outputs:
+    an sqlite3 connection
+    '''
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def entity_keys(conn, bay, sensor_type, kind, names, sensor_ids, zones):
+    #returns the entity key of every name, adding the ones that are not in the database yet
+    conn.executemany(
+        "INSERT OR IGNORE INTO entities (bay, sensor_type, kind, name, sensor_id, zone) VALUES (?, ?, ?, ?, ?, ?)",
+        [(bay, sensor_type, kind, name, sensor_id, zone) for name, sensor_id, zone in zip(names, sensor_ids, zones)],
+    )
+    rows = conn.execute(
+        "SELECT name, entity FROM entities WHERE bay = ? AND sensor_type = ? AND kind = ?", (bay, sensor_type, kind)
+    )
+    keys = dict(rows.fetchall())
+    return [keys[name] for name in names]
+
+
+def append_states(conn, keys, states, run_time):
+    '''
+    Adds a transition for every entity whose state at run_time differs from the new one. run_time is usually after
+    every transition of the entity, but can also be in the past (see db/backfill.py): the transition is then put in
+    between, the state the entity had at the next recorded run is restored there, and the next transition is removed
+    if it no longer changes the state
+
+    Inputs:
+    conn: sqlite3 connection of the history database
+
+    keys: list of entity keys
+
+    states: list of the state of every entity at run_time
+
+    run_time: unix time (seconds) of the run
+
+    Outputs:
+    the number of transitions that were added
+    '''
+    placeholders = ",".join("?" * len(keys))
+    #state of every entity in effect at run_time (with the time it started), and its next transition. SQLite returns
+    #the other columns of the row with the MAX/MIN time
+    before = {key: (state, time) for key, state, time in conn.execute(
+        f"SELECT entity, state, MAX(time) FROM transitions WHERE entity IN ({placeholders}) AND time <= ? "
+        "GROUP BY entity", (*keys, run_time)).fetchall()}
+    after = {key: (state, time) for key, state, time in conn.execute(
+        f"SELECT entity, state, MIN(time) FROM transitions WHERE entity IN ({placeholders}) AND time > ? "
+        "GROUP BY entity", (*keys, run_time)).fetchall()}
+
+    changed = []
+    for key, state in zip(keys, states):
+        previous, since = before.get(key, (None, None))
+        if previous == state:
+            continue
+
+        if since == run_time:
+            #a run at the same time is replaced, the state before it is the one its transition came from
+            conn.execute("DELETE FROM transitions WHERE entity = ? AND time = ?", (key, run_time))
+            row = conn.execute("SELECT state FROM transitions WHERE entity = ? AND time < ? ORDER BY time DESC LIMIT 1",
+                               (key, run_time)).fetchone()
+            previous = row[0] if row is not None else None
+            if previous == state:
+                changed.append(key)
+                continue
+
+        conn.execute("INSERT INTO transitions (entity, time, state, prev_state) VALUES (?, ?, ?, ?)",
+                     (key, run_time, state, previous))
+        changed.append(key)
+
+    #the state only holds until the next recorded run. If the entity has no transition there it was still in the state
+    #it had before this run, which now needs a transition back to it
+    next_run = conn.execute("SELECT MIN(time) FROM runs WHERE time > ?", (run_time,)).fetchone()[0]
+
+    #the next transition of a changed entity either repeats the new state or now changes from it
+    new_states = dict(zip(keys, states))
+    for key in changed:
+        state = new_states[key]
+        if next_run is not None and (key not in after or after[key][1] > next_run):
+            old_state = before.get(key, (None, None))[0]
+            if old_state is not None and old_state != state:
+                conn.execute("INSERT INTO transitions (entity, time, state, prev_state) VALUES (?, ?, ?, ?)",
+                             (key, next_run, old_state, state))
+        elif key in after:
+            next_state, next_time = after[key]
+            if next_state == state:
+                conn.execute("DELETE FROM transitions WHERE entity = ? AND time = ?", (key, next_time))
+            else:
+                conn.execute("UPDATE transitions SET prev_state = ? WHERE entity = ? AND time = ?",
+                             (state, key, next_time))
+
+    if changed:
+        placeholders = ",".join("?" * len(changed))
+        conn.execute(
+            f"INSERT INTO current (entity, state, since) SELECT entity, state, MAX(time) FROM transitions "
+            f"WHERE entity IN ({placeholders}) GROUP BY entity "
+            "ON CONFLICT (entity) DO UPDATE SET state = excluded.state, since = excluded.since", changed)
+
+    return len(changed)
+
+
+def record(results, run_time=None, path=HISTORY_DB):
+    '''
+    Adds the states of a run to the history
+
+    Inputs:
+    results: dictionary of (bay, sensor_type) to BayResult returned by the detector
+
+    run_time: unix time (seconds) of the run, now if None
+
+    path: filename/path of the SQLite database
+
+    Outputs:
+    the number of sensor and zone state changes that were appended
+    '''
+    if run_time is None:
+        run_time = int(time.time())
+
+    n_changed = 0
+    conn = connect(path)
+    try:
+        with conn:
+            for (bay, sensor_type), result in results.items():
+                registry = sensor_registry.get_registry(bay)
+                names = list(result.sensor_names)
+
+                keys = entity_keys(conn, bay, sensor_type, "sensor", names,
+                                   [registry.sensor_id(name) for name in names],
+                                   [registry.zone_of(name) for name in names])
+                n_changed += append_states(conn, keys, result.states.tolist(), run_time)
+
+                zones = list(result.zone_names)
+                keys = entity_keys(conn, bay, sensor_type, "zone", zones, [None] * len(zones), zones)
+                n_changed += append_states(conn, keys, result.zone_states.tolist(), run_time)
+
+            conn.execute("INSERT OR IGNORE INTO runs (time) VALUES (?)", (run_time,))
+    finally:
+        conn.close()
+
+    return n_changed
+
+
+def last_run(conn):
+    return conn.execute("SELECT MAX(time) FROM runs").fetchone()[0]
+
+
+def down_since(bay, sensor_type, kind="sensor", path=HISTORY_DB):
+    '''
+    Lists the sensors (or zones) that are down at the last run, and since when
+
+    Inputs:
+    bay: bay string ("E", "C", "W")
+
+    sensor_type: sensor type name (see db/sensor_types.py)
+
+    kind: "sensor" or "zone"
+
+    path: filename/path of the SQLite database
+
+    Outputs:
+    a dataframe with the name, sensor_id, zone and the datetime they went down ("since"), longest down first
+    '''
+    states = DOWN_STATES[kind]
+    conn = connect(path)
+    try:
+        df = pd.read_sql_query(
+            f"""SELECT e.name, e.sensor_id, e.zone, c.since
+            FROM current c JOIN entities e ON e.entity = c.entity
+            WHERE e.bay = ? AND e.sensor_type = ? AND e.kind = ? AND c.state IN ({",".join("?" * len(states))})
+            ORDER BY c.since""",
+            conn, params=(bay, sensor_type, kind, *states),
+        )
+    finally:
+        conn.close()
+
+    df["since"] = pd.to_datetime(df["since"], unit="s")
+    return df
+
+
+def uptime(bay, sensor_type, days=30, kind="sensor", path=HISTORY_DB):
+    '''
+    Computes the percentage of the last N days each sensor (or zone) was up, see UP_STATES. Only the time covered by
+    the history counts, so a sensor that was added a week ago is measured over that week
+
+    Inputs:
+    bay: bay string ("E", "C", "W")
+
+    sensor_type: sensor type name (see db/sensor_types.py)
+
+    days: number of days before the last run to look at
+
+    kind: "sensor" or "zone"
+
+    path: filename/path of the SQLite database
+
+    Outputs:
+    a dataframe with the name, sensor_id, zone, the hours covered by the history and the uptime percentage
+    '''
+    states = UP_STATES[kind]
+    conn = connect(path)
+    try:
+        end = last_run(conn)
+        if end is None:
+            end = int(time.time())
+        start = end - int(days * 86400)
+
+        df = pd.read_sql_query(
+            SQL_INTERVALS + f"""
+            , clipped AS (
+                SELECT entity, state, MIN(end_time, :end) - MAX(start_time, :start) AS seconds
+                FROM iv
+                WHERE end_time > :start AND start_time < :end
+            )
+            SELECT e.name, e.sensor_id, e.zone,
+                   SUM(c.seconds) / 3600.0 AS hours,
+                   100.0 * SUM(CASE WHEN c.state IN ({",".join(str(int(s)) for s in states)}) THEN c.seconds ELSE 0 END)
+                         / NULLIF(SUM(c.seconds), 0) AS uptime
+            FROM clipped c JOIN entities e ON e.entity = c.entity
+            GROUP BY c.entity
+            ORDER BY uptime""",
+            conn, params={"bay": bay, "sensor_type": sensor_type, "kind": kind, "last_run": end,
+                          "start": start, "end": end},
+        )
+    finally:
+        conn.close()
+
+    return df
+
+
+def sensor_intervals(bay, sensor_type, sensor_id, path=HISTORY_DB):
+    '''
+    Lists the state intervals of one sensor, looked up by its database sensor id
+
+    Inputs:
+    bay: bay string ("E", "C", "W")
+
+    sensor_type: sensor type name (see db/sensor_types.py)
+
+    sensor_id: database sensor id (see the query strings), only unique within a bay and sensor type
+
+    path: filename/path of the SQLite database
+
+    Outputs:
+    a dataframe with the state, start and end datetime of every interval, oldest first. The last interval ends at the
+    last run
+    '''
+    conn = connect(path)
+    try:
+        df = pd.read_sql_query(
+            """SELECT t.state, t.time AS start,
+                   COALESCE(LEAD(t.time) OVER (PARTITION BY t.entity ORDER BY t.time), (SELECT MAX(time) FROM runs)) AS end
+            FROM entities e JOIN transitions t ON t.entity = e.entity
+            WHERE e.sensor_id = ? AND e.bay = ? AND e.sensor_type = ? AND e.kind = 'sensor'
+            ORDER BY t.time""",
+            conn, params=(sensor_id, bay, sensor_type),
+        )
+    finally:
+        conn.close()
+
+    df["start"] = pd.to_datetime(df["start"], unit="s")
+    df["end"] = pd.to_datetime(df["end"], unit="s")
+    return df
+
+
+def flapping(bay, sensor_type, days=30, kind="sensor", min_changes=1, path=HISTORY_DB):
+    '''
+    Counts the state changes of each sensor (or zone) in the last N days. Sensors that keep switching between states
+    are usually failing intermittently
+
+    Inputs:
+    bay: bay string ("E", "C", "W")
+
+    sensor_type: sensor type name (see db/sensor_types.py)
+
+    days: number of days before the last run to look at
+
+    kind: "sensor" or "zone"
+
+    min_changes: sensors with fewer state changes than this are left out
+
+    path: filename/path of the SQLite database
+
+    Outputs:
+    a dataframe with the name, sensor_id, zone, the number of state changes and how many of them went down,
+    most changes first
+    '''
+    down = DOWN_STATES[kind]
+    conn = connect(path)
+    try:
+        end = last_run(conn)
+        if end is None:
+            end = int(time.time())
+
+        df = pd.read_sql_query(
+            f"""SELECT e.name, e.sensor_id, e.zone, COUNT(*) AS changes,
+                   SUM(t.state IN ({",".join(str(int(s)) for s in down)})) AS went_down
+            FROM transitions t JOIN entities e ON e.entity = t.entity
+            WHERE e.bay = ? AND e.sensor_type = ? AND e.kind = ?
+              AND t.time > ? AND t.prev_state IS NOT NULL
+            GROUP BY t.entity
+            HAVING COUNT(*) >= ?
+            ORDER BY changes DESC""",
+            conn, params=(bay, sensor_type, kind, end - int(days * 86400), min_changes),
+        )
+    finally:
+        conn.close()
+
+    return df
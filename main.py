@@ -2,25 +2,12 @@
 Main python script for the automated sensor monitor.
 """
 
-from db import data_5tm
-from db import data_mps2
-from detection import sensor_state_detector
-from outputs import email_reporter
-from masterlists import masterlist_json_creator
+import pipeline
 
 
 def main():
-    bays = ["E", "C", "W"]
-
-    #runs system for each East, Center, and West bays of LEO
-    for bay in bays:
-        masterlist_json_creator.main(bay)
-        data_5tm.main_data(bay)
-        data_mps2.main_data(bay)
-        sensor_state_detector.main(bay)
-
-    #reports sensor health states via email
-    email_reporter.main()
+    #runs system for each East, Center, and West bays of LEO, see pipeline.py for the stages
+    pipeline.run(["E", "C", "W"])
 
 
 
@@ -1,46 +1,107 @@
 import pandas as pd
+import hashlib
 import json
+import os
 import config
 
 #converts the excel masterspread sheet into a json file that encodes zone and sensor health information
 
-def load_sheet(f_excel, sheet, csv_list):
+#sheets of the workbook, one per sensor group
+SHEETS = ["A", "B", "C", "D", "E", "F", "G", "H", "I", "J", "K", "L", "M", "N", "O", "P"]
+
+
+def column_to_strings(column):
+    '''
+    Converts a column of an excel sheet into the same strings pandas writes for it in a csv (empty for missing cells)
+
+    Inputs:
+    column: a pandas series of one column of the sheet
+
+    Output:
+    a list of strings of the cell values
+    '''
+    if pd.api.types.is_datetime64_any_dtype(column):
+        #like to_csv, date columns without any time of day are written as dates only
+        dates = column.dropna()
+        fmt = "%Y-%m-%d" if (dates == dates.dt.normalize()).all() else "%Y-%m-%d %H:%M:%S"
+        return ["" if pd.isna(value) else value.strftime(fmt) for value in column]
+
+    return ["" if pd.isna(value) else str(value) for value in column]
+
+def load_sheet(df, sheet, csv_list):
     '''
-    Loads an excel sheet from a workbook into a pandas dataframe
+    Loads the rows of an excel sheet into csv_list, adding the group (sheet name) and sensor height to each row
 
     Inputs:
-    f_excel: a string containing the filepath extension to the excel workbook
+    df: a pandas dataframe of the first four columns of the excel sheet
 
-    sheet: a string denoting the sheet name to be loaded into the dataframe
+    sheet: a string denoting the sheet name
+
+    csv_list: list the rows are appended to
 
     Output:
-    A pandas dataframe of the excel sheet
+    None, modifies csv_list
     '''
-    df = pd.read_excel(f_excel, sheet_name=sheet, usecols = [0,1,2,3])
-    df_csv = df.to_csv(header=False, index=False)
-    df_csv = df_csv.split("\n")
-
-    #loads items from csv of execl sheet into csv_list
-    #adds height and group to each item
-    for item in df_csv:
-        if len(item) > 3:
-            item_as_list = item.strip("\r").split(",")
-            item_as_list.append(sheet)
-            try:
-                height = int(item_as_list[0].split("_")[2])
-            except:
-                print(item_as_list)
-            
-            item_as_list.append(height)
-            csv_list.append(item_as_list)
-
-def main_create_csv(f_name_excel, f_out):
+    height = None
+    columns = [column_to_strings(df[name]) for name in df.columns]
+
+    for row in zip(*columns):
+        item_as_list = list(row)
+
+        #skips empty rows (all four cells blank)
+        if len(",".join(item_as_list)) <= 3:
+            continue
+
+        item_as_list.append(sheet)
+        try:
+            height = int(item_as_list[0].split("_")[2])
+        except:
+            print(item_as_list)
+
+        item_as_list.append(height)
+        csv_list.append(item_as_list)
+
+def file_hash(f_name):
+    '''
+    Returns the sha256 hash of a file's contents
+    '''
+    sha = hashlib.sha256()
+    with open(f_name, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+def main_create_csv(f_name_excel, f_out, force=False):
+    '''
+    Converts an excel masterlist workbook into the masterlist json. The conversion is skipped when the workbook has
+    not changed since the json was last written (its content hash is stored next to the json)
+
+    Inputs:
+    f_name_excel: a string containing the filepath extension to the excel workbook
+
+    f_out: the filename/path of the json file
+
+    force: rebuild the json even if the workbook has not changed
+
+    Output:
+    True if the json was rebuilt, False if the cached json was kept
+    '''
+    f_hash = f_out + ".sha256"
+    workbook_hash = file_hash(f_name_excel)
+
+    if not force and os.path.exists(f_out) and os.path.exists(f_hash):
+        with open(f_hash, "r") as f:
+            if f.read().strip() == workbook_hash:
+                return False
+
     list_items = []
-    sheets = ["A", "B", "C", "D", "E", "F", "G", "H", "I", "J", "K", "L", "M", "N", "O", "P"]
+
+    #reads every sheet of the workbook in one pass
+    sheet_dfs = pd.read_excel(f_name_excel, sheet_name=SHEETS, usecols = [0,1,2,3])
 
     #loads each sheet, adds to list_itmes
-    for sheet in sheets:
-        load_sheet(f_name_excel, sheet, list_items)
+    for sheet in SHEETS:
+        load_sheet(sheet_dfs[sheet], sheet, list_items)
     
     #sorts list by group
     list_items.sort(key= lambda item:item[4])
@@ -56,12 +117,17 @@ def main_create_csv(f_name_excel, f_out):
         del group_dict["O"]["26_-3_2"]
         del group_dict["O"]["26_-2_2"]
     
-    
-    f_out = open(f_out, "w")
-    f_out.write(json.dumps(group_dict))
+    with open(f_out, "w") as f:
+        f.write(json.dumps(group_dict))
+
+    with open(f_hash, "w") as f:
+        f.write(workbook_hash)
+
+    return True
     
 
-def main(bay):
+def paths(bay):
+    #returns the filenames/paths of the excel workbook and the masterlist json of a bay
     f_excel = ""
     f_out = ""
 
@@ -77,4 +143,9 @@ def main(bay):
         f_excel = config.path_east_masterlist
         f_out = "masterlists/sensor_status_east.json"
 
+    return f_excel, f_out
+
+def main(bay):
+    f_excel, f_out = paths(bay)
+
     main_create_csv(f_excel, f_out)
\ No newline at end of file
@@ -0,0 +1,139 @@
+'''
+This program builds the sensor catalog of a bay at runtime: for every kind of sensor, the full sensor names and database
+sensor ids (from the id/name lists of the query strings) together with the removed flag of each sensor from the
+masterlist. The fetch stage only queries the sensors that are not removed, so sensors that were taken out of the
+hillslope are no longer transferred just to be set to state 0. The catalog is cached in the data folder under the
+hash of the files it is built from, and is only rebuilt when the masterlist or the query strings change.
+'''
+
+import hashlib
+import json
+import os
+import threading
+
+from db import sensor_types as types
+from masterlists import sensor_registry
+
+
+CATALOG_FILE = "data/sensor_catalog_{}.json"
+
+#kinds of sensors in the catalog, the suffix of their sensor names
+DEVICES = list(types.DEVICES)
+
+#catalogs already loaded in this process
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def source_hash(bay):
+    '''
+    Hashes the masterlist json and the query strings of a bay, the files the catalog is built from
+
+    Inputs:
+    bay: string of either "E", "C" or "W"
+
+    Outputs:
+    the sha256 hex digest of the files
+    '''
+    digest = hashlib.sha256()
+    for path in [sensor_registry.MASTERLIST_JSON[bay], sensor_registry.QUERY_STRINGS[bay].__file__]:
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def build_catalog(bay, digest):
+    '''
+    Builds the catalog of a bay
+
+    Inputs:
+    bay: string of either "E", "C" or "W"
+
+    digest: source_hash of the bay, stored in the catalog
+
+    Outputs:
+    a dictionary {"hash": digest, "devices": {device: {"names": [...], "ids": [...], "removed": [...]}}} with the
+    sensors of each device in query string order
+    '''
+    registry = sensor_registry.get_registry(bay)
+    sensor_ids = sensor_registry.load_sensor_ids(bay)
+
+    devices = {}
+    for device in DEVICES:
+        names = [name for name in sensor_ids if name.endswith("_" + device)]
+        devices[device] = {
+            "names": names,
+            "ids": [sensor_ids[name] for name in names],
+            "removed": [registry.is_removed(name) for name in names],
+        }
+
+    return {"hash": digest, "devices": devices}
+
+
+def get_catalog(bay):
+    '''
+    Returns the catalog of a bay. It is taken from memory or from the catalog file when the source hash still matches,
+    and rebuilt (and saved) otherwise
+
+    Inputs:
+    bay: string of either "E", "C" or "W"
+
+    Outputs:
+    the catalog dictionary, see build_catalog
+    '''
+    digest = source_hash(bay)
+
+    with _catalogs_lock:
+        catalog = _catalogs.get(bay)
+        if catalog is not None and catalog["hash"] == digest:
+            return catalog
+
+        path = CATALOG_FILE.format(bay)
+        catalog = None
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                catalog = json.load(f)
+
+        if catalog is None or catalog["hash"] != digest:
+            catalog = build_catalog(bay, digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(catalog, f)
+            os.replace(tmp, path)
+            print("Built sensor catalog for bay " + bay)
+
+        _catalogs[bay] = catalog
+
+    return catalog
+
+
+def all_sensors(bay, device):
+    '''
+    Inputs:
+    bay: string of either "E", "C" or "W"
+
+    device: "5TM" or "MPS-2"
+
+    Outputs:
+    sensor_names, sensor_ids: lists of every sensor of the device in the bay, removed ones included
+    '''
+    entry = get_catalog(bay)["devices"][device]
+    return entry["names"], entry["ids"]
+
+
+def active_sensors(bay, device):
+    '''
+    Inputs:
+    bay: string of either "E", "C" or "W"
+
+    device: "5TM" or "MPS-2"
+
+    Outputs:
+    sensor_names, sensor_ids: lists of the sensors of the device in the bay that the masterlist does not mark as
+    removed, these are the ones that get queried
+    '''
+    entry = get_catalog(bay)["devices"][device]
+    keep = [not removed for removed in entry["removed"]]
+    return ([name for name, k in zip(entry["names"], keep) if k],
+            [sensor_id for sensor_id, k in zip(entry["ids"], keep) if k])
@@ -0,0 +1,178 @@
+'''
+This program builds an indexed registry of the sensors of a bay from its masterlist json. The registry is built once
+per run and shared by the detector and the email reporter, so looking up a sensor's location, zone, removed flag or
+database sensor id is a single dictionary lookup instead of a scan of the masterlist.
+'''
+
+import json
+import os
+import threading
+
+from db import query_strings_E
+from db import query_strings_W
+from db import query_strings_C
+from db import sensor_types as types
+
+
+MASTERLIST_JSON = {
+    "E": "masterlists/sensor_status_east.json",
+    "C": "masterlists/sensor_status_center.json",
+    "W": "masterlists/sensor_status_west.json",
+}
+
+QUERY_STRINGS = {
+    "E": query_strings_E,
+    "C": query_strings_C,
+    "W": query_strings_W,
+}
+
+
+class SensorRecord:
+    '''
+    Everything the monitor knows about one sensor
+    '''
+    __slots__ = ("name", "loc", "zone", "bay", "sensor_type", "removed", "sensor_id", "height")
+
+    def __init__(self, name, loc, zone, bay, sensor_type, removed, sensor_id, height):
+        self.name = name
+        self.loc = loc
+        self.zone = zone
+        self.bay = bay
+        self.sensor_type = sensor_type
+        self.removed = removed
+        self.sensor_id = sensor_id
+        self.height = height
+
+    def __repr__(self):
+        return "SensorRecord(" + self.name + ", zone " + self.zone + ")"
+
+
+def get_sensor_loc(sensor_name):
+    loc_items = sensor_name.split("_")
+    return loc_items[1] + "_" + loc_items[2] + "_" + loc_items[3]
+
+def get_sensor_name(sensor_loc, bay, type):
+    return "LEO-" + bay + "_" + sensor_loc + "_" + type
+
+
+def load_sensor_ids(bay):
+    '''
+    Reads the database sensor id of every sensor of a bay from its query strings
+
+    Inputs:
+    bay: string of either "E", "C" or "W"
+
+    Outputs:
+    a dictionary with the full sensor name as the key and the database sensor id as the value
+    '''
+    query_strings = QUERY_STRINGS[bay]
+    sensor_ids = {}
+
+    for device in types.DEVICES.values():
+        codes = getattr(query_strings, "query_" + device.query_name + "_order").split(",")
+        ids = getattr(query_strings, "query_" + device.query_name + "_ids").split(",")
+
+        for code, sensor_id in zip(codes, ids):
+            #the last name in the query strings is cut short ("..._5T")
+            sensor_ids[get_sensor_name(get_sensor_loc(code), bay, device.name)] = int(sensor_id)
+
+    return sensor_ids
+
+
+class SensorRegistry:
+    '''
+    Indexed view of the masterlist of one bay. Every sensor of every type gets one SensorRecord, and the maps below
+    give O(1) lookups between full sensor name, location, zone, removed flag and database sensor id
+    '''
+
+    def __init__(self, bay, masterlist_dict, sensor_ids=None):
+        '''
+        Inputs:
+        bay: string of either "E", "C" or "W"
+
+        masterlist_dict: dictionary of the masterlist json (zone -> location -> masterlist item)
+
+        sensor_ids: optional dictionary of full sensor name to database sensor id (see load_sensor_ids)
+        '''
+        if sensor_ids is None:
+            sensor_ids = {}
+
+        self.bay = bay
+        self.by_name = {}
+        self.by_id = {}
+        self.zone_by_loc = {}
+        self.locs_by_zone = {}
+        self.zone_by_name = {}
+
+        for zone, items in masterlist_dict.items():
+            self.locs_by_zone[zone] = list(items)
+
+            for loc, item in items.items():
+                self.zone_by_loc[loc] = zone
+
+                for device in types.DEVICES.values():
+                    name = get_sensor_name(loc, bay, device.name)
+                    removed = len(item[device.removed_column]) != 0
+                    record = SensorRecord(name, loc, zone, bay, device.name, removed, sensor_ids.get(name), item[5])
+
+                    self.by_name[name] = record
+                    self.zone_by_name[name] = zone
+                    if record.sensor_id is not None:
+                        self.by_id[(device.name, record.sensor_id)] = record
+
+    def get(self, name):
+        return self.by_name.get(name)
+
+    def zone_of(self, name):
+        return self.zone_by_name.get(name, "")
+
+    def is_removed(self, name):
+        record = self.by_name.get(name)
+        return record is not None and record.removed
+
+    def sensor_id(self, name):
+        record = self.by_name.get(name)
+        return None if record is None else record.sensor_id
+
+    def name_of(self, sensor_type, sensor_id):
+        record = self.by_id.get((sensor_type, sensor_id))
+        return None if record is None else record.name
+
+    def zones(self):
+        return list(self.locs_by_zone)
+
+    def names_in_zone(self, zone, sensor_type):
+        return [get_sensor_name(loc, self.bay, sensor_type) for loc in self.locs_by_zone[zone]]
+
+
+#registries already built in this process, rebuilt when the masterlist json changes
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(bay):
+    '''
+    Returns the sensor registry of a bay, building it from the masterlist json the first time it is asked for (and
+    again whenever the json file has been rewritten since)
+
+    Inputs:
+    bay: string of either "E", "C" or "W"
+
+    Outputs:
+    the SensorRegistry of the bay
+    '''
+    f_name_json = MASTERLIST_JSON[bay]
+    mtime = os.path.getmtime(f_name_json)
+
+    with _registries_lock:
+        cached = _registries.get(bay)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        with open(f_name_json, "r") as jsonfile:
+            masterlist_dict = json.load(jsonfile)
+
+        registry = SensorRegistry(bay, masterlist_dict, load_sensor_ids(bay))
+        _registries[bay] = (mtime, registry)
+
+    return registry
@@ -0,0 +1,184 @@
+'''
+This program builds the delta version of the email report. The sensor states of every bay and sensor type are saved
+after each run, and the next run compares its states against them so the email only lists what changed: sensors that
+went down, sensors that recovered and sensors that moved to another unhealthy state, plus a table of counts. With
+frequent (e.g. hourly) runs this keeps the email short instead of repeating every known problem each time.
+'''
+
+import datetime
+import os
+
+import numpy as np
+import pandas as pd
+
+from masterlists import sensor_registry
+
+
+#previous run's states, one .npz per bay and sensor type. The daily runs own this folder, the continuous monitor keeps
+#its own under daemon_data_dir (see daemon.py)
+STATES_DIR = "data/last_states"
+
+#state codes of the sensor_state_detector
+STATE_NAMES = {
+    0: "removed",
+    1: "sensor down",
+    2: "in and out of data",
+    3: "outliers present",
+    4: "healthy",
+    5: "drifting, needs recalibration",
+    6: "flatlined, stuck on one value",
+    7: "spikes present",
+}
+
+#used as the previous state of sensors that were not in the last run
+NO_STATE = -1
+
+BAY_NAMES = {"E": "East Bay", "C": "Center Bay", "W": "West Bay"}
+
+
+def states_path(bay, sensor_type, states_dir=STATES_DIR):
+    return os.path.join(states_dir, f"{bay}_{sensor_type}.npz")
+
+
+def load_states(bay, sensor_type, states_dir=STATES_DIR):
+    '''
+    Loads the sensor states saved by the previous run
+
+    Inputs:
+    bay: bay string ("E", "C", "W")
+
+    sensor_type: sensor type name (see db/sensor_types.py)
+
+    states_dir: folder the states were saved in
+
+    Outputs:
+    (sensor names, states) numpy arrays, or None if no run was saved yet
+    '''
+    path = states_path(bay, sensor_type, states_dir)
+    if not os.path.exists(path):
+        return None
+
+    with np.load(path) as saved:
+        return saved["sensor_names"], saved["states"]
+
+
+def save_states(bay, sensor_type, sensor_names, states, states_dir=STATES_DIR):
+    path = states_path(bay, sensor_type, states_dir)
+    os.makedirs(states_dir, exist_ok=True)
+    tmp = path + ".tmp.npz"
+    np.savez(tmp, sensor_names=np.asarray(sensor_names, dtype=str), states=np.asarray(states, dtype=np.int8))
+    os.replace(tmp, path)
+
+
+def compare_states(prev_names, prev_states, sensor_names, states):
+    '''
+    Compares the current states against the previous run's. The previous states are aligned to the current sensor
+    order with a single index lookup, and every sensor is compared at once
+
+    Inputs:
+    prev_names, prev_states: arrays returned by load_states
+
+    sensor_names: array of the current sensor names
+
+    states: array of the current sensor states
+
+    Outputs:
+    a dataframe with the "sensor name", "previous state", "state" and "change" of every sensor whose state changed.
+    change is "newly down", "recovered" or "state changed"
+    '''
+    sensor_names = np.asarray(sensor_names, dtype=str)
+    states = np.asarray(states, dtype=np.int64)
+
+    #position of every current sensor in the previous run, -1 (the appended NO_STATE) if it was not there
+    position = pd.Index(prev_names).get_indexer(sensor_names)
+    previous = np.append(np.asarray(prev_states, dtype=np.int64), NO_STATE)[position]
+
+    changed = previous != states
+    #new sensors are only worth reporting when they are not healthy (or removed)
+    changed &= ~((previous == NO_STATE) & np.isin(states, [0, 4]))
+
+    newly_down = changed & (states == 1)
+    recovered = changed & (states == 4)
+
+    change = np.where(newly_down, "newly down", np.where(recovered, "recovered", "state changed"))
+
+    return pd.DataFrame({
+        "sensor name": sensor_names[changed],
+        "previous state": pd.Series(previous[changed]).map(STATE_NAMES).fillna("not reported").to_numpy(),
+        "state": pd.Series(states[changed]).map(STATE_NAMES).to_numpy(),
+        "change": change[changed],
+    })
+
+
+def build_delta_html(sensor_dfs, window_days, window=None, states_dir=STATES_DIR):
+    '''
+    Builds the delta report for every bay and sensor type
+
+    Inputs:
+    sensor_dfs: dictionary of (bay, sensor_type) to the sensor dataframe ("sensor name", "state") of this run
+
+    window_days: number of days covered by the run
+
+    window: optional (startTime, endTime) strings of the samples the states come from, instead of the previous
+    window_days days
+
+    states_dir: folder of the previous run's states (see save_all)
+
+    Outputs:
+    (html, number of changes). html is None when there is no previous run to compare against for some bay and
+    sensor type, in which case the full report should be sent instead
+    '''
+    today = datetime.date.today()
+    startTime = (today - datetime.timedelta(window_days)).strftime("%Y/%m/%d 00:00")
+    endTime = today.strftime("%Y/%m/%d 00:00")
+    if window is not None:
+        startTime, endTime = window
+
+    counts = []
+    sections = []
+    for (bay, sensor_type), sensor_df in sensor_dfs.items():
+        previous = load_states(bay, sensor_type, states_dir)
+        if previous is None:
+            return None, 0
+
+        changes = compare_states(previous[0], previous[1], sensor_df["sensor name"], sensor_df["state"])
+
+        counts.append({
+            "bay": BAY_NAMES[bay],
+            "sensor type": sensor_type,
+            "newly down": int((changes["change"] == "newly down").sum()),
+            "recovered": int((changes["change"] == "recovered").sum()),
+            "state changed": int((changes["change"] == "state changed").sum()),
+            "down now": int((sensor_df["state"] == 1).sum()),
+        })
+
+        if len(changes) > 0:
+            registry = sensor_registry.get_registry(bay)
+            changes["zone"] = changes["sensor name"].map(registry.zone_by_name).fillna("")
+            sections.append(f"""
+      <h3>{sensor_type} changes - {BAY_NAMES[bay]}</h3>
+      {changes.to_html(header=True, index=False, border=2)}""")
+
+    counts_df = pd.DataFrame(counts)
+    n_changes = int(counts_df[["newly down", "recovered", "state changed"]].to_numpy().sum())
+
+    html = f"""
+    <html>
+    <body style="font-family: Arial, sans-serif;">
+      <h2>Zone & Sensor Health Changes</h2>
+      <p>Changes since the previous run, using database outputs from {startTime} to {endTime}</p>
+      <hr style="height:5px; background:#000; color: #000; border-width:0">
+      <h3>Summary</h3>
+      {counts_df.to_html(header=True, index=False, border=2)}
+      {"".join(sections)}
+    </body>
+    </html>
+    """
+
+    return html, n_changes
+
+
+def save_all(sensor_dfs, states_dir=STATES_DIR):
+    #saves the states of this run in states_dir so the next delta report is computed against them
+    for (bay, sensor_type), sensor_df in sensor_dfs.items():
+        save_states(bay, sensor_type, sensor_df["sensor name"].to_numpy(), sensor_df["state"].to_numpy(), states_dir)
@@ -1,6 +1,7 @@
 """
 This program handles email communication that reports sensor health states. It uses the outputs of the sensor_state_detector
-and generates an html which is sent via email. It is currently configured only for the 5TM and MPS2 sensor types.
+and generates an html which is sent via email. Every bay of the run gets a part of the report with a section of the same
+form for each of its sensor types (see db/sensor_types.py), so runs of some of the bays or sensor types are reported too.
 """
 
 import pandas as pd
@@ -8,103 +9,155 @@ import smtplib
 from email.message import EmailMessage
 from email.utils import formatdate, make_msgid
 from pathlib import Path
+from string import Template
 import datetime
-import json
+import os
 
 import config
+import telemetry
+from db import daily_rollups
+from db import sensor_types as types
+from masterlists import sensor_registry
+from outputs import delta_report
 
 # =====================
 # Config elements — edit these as needed
 # =====================
-ZONE_CSV_C_5TM = "outputs/zone_health_C.csv"
-SENSOR_CSV_C_5TM = "outputs/sensor_health_C.csv"
-
-ZONE_CSV_E_5TM = "outputs/zone_health_E.csv"
-SENSOR_CSV_E_5TM = "outputs/sensor_health_E.csv"
-
-ZONE_CSV_W_5TM = "outputs/zone_health_W.csv"
-SENSOR_CSV_W_5TM = "outputs/sensor_health_W.csv"
-
-ZONE_CSV_C_MPS = "outputs/zone_health_C_mps.csv"
-SENSOR_CSV_C_MPS = "outputs/sensor_health_C_mps.csv"
-
-ZONE_CSV_E_MPS = "outputs/zone_health_E_mps.csv"
-SENSOR_CSV_E_MPS = "outputs/sensor_health_E_mps.csv"
-
-ZONE_CSV_W_MPS = "outputs/zone_health_W_mps.csv"
-SENSOR_CSV_W_MPS = "outputs/sensor_health_W_mps.csv"
-
-JSON_W = "masterlists/sensor_status_west.json"
-JSON_C = "masterlists/sensor_status_center.json"
-JSON_E = "masterlists/sensor_status_east.json"
-
 FROM_ADDR = config.email_from_adr
 TO_ADDRS = config.email_to_adrs
 SUBJECT = "Zone & Sensor Health Report"
 
 SMTP_HOST = config.email_smtp_host
-SMTP_PORT = 587
+SMTP_PORT = getattr(config, "email_smtp_port", 587)
 SMTP_USER = config.email_smtp_un
 SMTP_PASS = config.email_smtp_pw
-USE_SSL = False       # True for implicit SSL (465)
-USE_STARTTLS = True   # True for STARTTLS (587)
+USE_SSL = getattr(config, "email_use_ssl", False)            # True for implicit SSL (465)
+USE_STARTTLS = getattr(config, "email_use_starttls", True)   # True for STARTTLS (587)
 
 ATTACH_DIR = "outputs"  # where to save the .html file
 
-def find_down_sensors(sensor_df, masterlist_json):
-    #finds which sensors are down, and returns a pandas df of only those sensors
-    #function also handles connecting all sensors to their approriate zones
+WINDOW_DAYS = getattr(config, "window_days", 1)  # number of days covered by the report
+
+# "full" lists every unhealthy sensor, "delta" only lists the state changes since the previous run
+REPORT_MODE = getattr(config, "report_mode", "full")
+DELTA_SUBJECT = "Zone & Sensor Health Changes"
+
+# sensor states that get a table in the report: state -> (template field, label shown in the table)
+STATE_TABLES = {
+    1: ("down", "sensor down"),
+    2: ("sometimes", "in and out of data"),
+    3: ("outliers", "outliers present"),
+    5: ("drifting", "drifting, needs recalibration"),
+    6: ("flatlined", "flatlined, stuck on one value"),
+    7: ("spikes", "spikes present"),
+}
+
+ZONE_LABELS = {1: "alive", 0: "down"}
+
+# sensors with an availability below LONG_TERM_MIN_AVAILABILITY (%) over the last LONG_TERM_DAYS days of daily rollups
+# get a table at the end of the full report, 0 days leaves it out (see db/daily_rollups.py)
+LONG_TERM_DAYS = getattr(config, "long_term_days", 30)
+LONG_TERM_MIN_AVAILABILITY = getattr(config, "long_term_min_availability", 90)
+LONG_TERM_COLUMNS = ["sensor name", "days", "availability", "in range", "mean", "sd", "trend"]
+
+# the report is filled in with string.Template: ${bays} holds one BAY_TEMPLATE per bay, each with a
+# TYPE_SECTION_TEMPLATE per sensor type
+RULE = '<hr style="height:5px; background:#000; color: #000; border-width:0">'
+
+REPORT_TEMPLATE = Template("""
+    <html>
+    <body style="font-family: Arial, sans-serif;">
+      <h2>Zone & Sensor Health Report</h2>
+      <p>Generated using database outputs from ${start_time} to ${end_time}</p>
+      ${rule}
+${bays}${long_term}
+    </body>
+    </html>
+    """)
+
+BAY_TEMPLATE = Template("""
+      <h1>${bay_name}</h1>${sections}""")
+
+#section of one sensor type of a bay
+TYPE_SECTION_TEMPLATE = Template("""
+      <h2>${label} report - ${bay_name}</h2>
+      <h3>Zones status - ${label}</h3>
+      ${zones}
+      <h3>Sensors that are down.</h3>
+      ${down}
+      <h3>Sensors that are coming in and out of reporting values.</h3>
+      ${sometimes}
+      <h3>Sensors that are reporting outlier values.</h3>
+      ${outliers}
+      <h3>Sensors that are drifting and need recalibration.</h3>
+      ${drifting}
+      <h3>Sensors that are flatlined (stuck on one value).</h3>
+      ${flatlined}
+      <h3>Sensors that are reporting spikes.</h3>
+      ${spikes}
+      ${rule}""")
 
-    with open(masterlist_json, "r") as f:
-        zone_map = json.load(f)
+#long-term section at the end of the full report and its table of one bay and sensor type, see long_term_section
+LONG_TERM_HEADER = Template("""
+      <h2>Sensors with less than ${availability}% availability over the last ${days} days</h2>""")
 
-    for index,row in sensor_df.iterrows():
+LONG_TERM_TEMPLATE = Template("""
+      <h3>${label} - ${bay_name}</h3>
+      ${table}""")
 
-        sensor_zone = ""
-        for zone in zone_map:
-            sensor_loc = row["sensor name"].split("_")
-            sensor_loc_string = sensor_loc[1] + "_" + sensor_loc[2] + "_" + sensor_loc[3]
-            if sensor_loc_string in zone_map[zone]:
-                sensor_zone = zone
-        
-        sensor_df.at[index, "zone"] = sensor_zone
+BAY_NAMES = {"E": "East Bay", "C": "Center Bay", "W": "West Bay"}
 
+def state_tables(sensor_df, registry):
+    #splits the sensors of one bay and sensor type by state in a single groupby, and returns the html table of each
+    #reported state (see STATE_TABLES). Every sensor is connected to its zone using the bay's sensor registry
 
+    sensor_df = sensor_df.assign(zone=sensor_df["sensor name"].map(registry.zone_by_name).fillna(""))
 
-    filtered_df = sensor_df[sensor_df["state"] == 1].copy()
-    filtered_df["state"] = filtered_df["state"].apply(lambda x: "sensor down" if x == 1 else x)
-    filtered_df["zone"] = sensor_df["zone"]
-    return filtered_df
+    states = pd.Categorical(sensor_df["state"], categories=list(STATE_TABLES))
+    groups = dict(list(sensor_df.groupby(states, observed=False, sort=False)))
 
-def find_sometimes_sensors(sensor_df):
-    #finds sensors which come in and out of reporting values, returns them in a pandas df
+    tables = {}
+    for state, (table, label) in STATE_TABLES.items():
+        group = groups.get(state, sensor_df.iloc[:0])
+        tables[table] = group.assign(state=label).to_html(header=True, index=False, border=2)
 
-    filtered_df = sensor_df[sensor_df["state"] == 2].copy()
-    filtered_df["state"] = filtered_df["state"].apply(lambda x: "in and out of data" if x == 2 else x)
-    return filtered_df
+    return tables
 
-def find_outlier_sensors(sensor_df):
-    #finds sensors which are reporting outliers, and returns them in a pandas df
+def long_term_section(keys):
+    #lists the sensors of every (bay, sensor type) whose availability (% of the timestamps with a sample) over the last
+    #LONG_TERM_DAYS days of daily rollups is below LONG_TERM_MIN_AVAILABILITY, with their in range %, mean, SD and trend
+    #(slope of the daily means per day). Empty without rollups
 
-    filtered_df = sensor_df[sensor_df["state"] == 3].copy()
-    filtered_df["state"] = filtered_df["state"].apply(lambda x: "outliers present" if x == 3 else x)
-    return filtered_df
+    if LONG_TERM_DAYS <= 0:
+        return ""
+
+    tables = []
+    for bay, sensor_type in keys:
+        metrics = daily_rollups.health_metrics(types.sample_store_path(bay, sensor_type), (LONG_TERM_DAYS,))
+        if metrics.empty:
+            continue
+        low = metrics.loc[metrics["availability"] < LONG_TERM_MIN_AVAILABILITY, LONG_TERM_COLUMNS].sort_values("availability")
+        table = low.round(3).to_html(header=True, index=False, border=2, na_rep="")
+        tables.append(LONG_TERM_TEMPLATE.substitute(label=types.get(sensor_type).label, bay_name=BAY_NAMES[bay], table=table))
+
+    if not tables:
+        return ""
+
+    return LONG_TERM_HEADER.substitute(days=LONG_TERM_DAYS, availability=LONG_TERM_MIN_AVAILABILITY) + "".join(tables)
 
 def readable_zone_df(zone_df):
     #converts a dataframe so that instead of using the integer encoding of health state, it reports it as a string
 
-    readable_df = zone_df.copy()
-    readable_df["state"] = readable_df["state"].apply(lambda x: "alive" if x == 1 else x)
-    readable_df["state"] = readable_df["state"].apply(lambda x: "down" if x == 0 else x)
-
-    return readable_df
+    return zone_df.assign(state=zone_df["state"].map(ZONE_LABELS).fillna(zone_df["state"]))
 
-def build_html(zone_df_c_5tm, sensor_df_c_5tm, zone_df_e_5tm, sensor_df_e_5tm, zone_df_w_5tm, sensor_df_w_5tm, zone_df_c_mps, sensor_df_c_mps, zone_df_e_mps, sensor_df_e_mps, zone_df_w_mps, sensor_df_w_mps):
+def build_html(dfs, window=None):
     #builds HTML that is sent in the email
-    #each of the parameters are pandas dfs for 5tms, mps2s, 5tm zones, and mps2 zones for each hillslope
+    #dfs is a dictionary of (bay, sensor type) to the (zone df, sensor df) of that bay and sensor type, the bays are
+    #reported in the order of BAY_NAMES and the sensor types of a bay in the order of db/sensor_types.SENSOR_TYPES
+    #window is an optional (startTime, endTime) of the samples the states come from, the previous day(s) by default
     
     today = datetime.date.today()
-    start = today - datetime.timedelta(1)
+    start = today - datetime.timedelta(WINDOW_DAYS)
     end = today 
 
 
@@ -114,97 +167,44 @@ def build_html(zone_df_c_5tm, sensor_df_c_5tm, zone_df_e_5tm, sensor_df_e_5tm, z
     #endTime = '2025/07/29 00:00'
     endTime = end.strftime("%Y/%m/%d 00:00")
 
+    if window is not None:
+        startTime, endTime = window
 
-    html = f"""
-    <html>
-    <body style="font-family: Arial, sans-serif;">
-      <h2>Zone & Sensor Health Report</h2>
-      <p>Generated using database outputs from {startTime} to {endTime}</p>
-      <hr style="height:5px; background:#000; color: #000; border-width:0">
+    keys = [(bay, sensor_type) for bay in BAY_NAMES for sensor_type in types.SENSOR_TYPES if (bay, sensor_type) in dfs]
 
-      <h1>East Bay</h1>
-      <h2>5TM report - East Bay</h2>
-      <h3>Zones status - 5TM</h3>
-      {readable_zone_df(zone_df_e_5tm).to_html(header=True, index=False, border=2)}
-      <h3>Sensors that are down.</h3>
-      {find_down_sensors(sensor_df_e_5tm, JSON_E).to_html(header=True, index=False, border=2)}
-      <h3>Sensors that are coming in and out of reporting values.</h3>
-      {find_sometimes_sensors(sensor_df_e_5tm).to_html(header=True, index=False, border=2)}
-      <h3>Sensors that are reporting outlier values</h3>
-      {find_outlier_sensors(sensor_df_e_5tm).to_html(header=True, index=False, border=2)}
-      
-      <hr style="height:5px; background:#000; color: #000; border-width:0">
-      <h2>MPS2 report - East Bay</h2>
-      <h3>Zones status - MPS2</h3>
-      {readable_zone_df(zone_df_e_mps).to_html(header=True, index=False, border=2)}
-      <h3>Sensors that are down.</h3>
-      {find_down_sensors(sensor_df_e_mps, JSON_E).to_html(header=True, index=False, border=2)}
-      <h3>Sensors that are coming in and out of reporting values.</h3>
-      {find_sometimes_sensors(sensor_df_e_mps).to_html(header=True, index=False, border=2)}
-      <h3>Sensors that are reporting outlier values.</h3>
-      {find_outlier_sensors(sensor_df_e_mps).to_html(header=True, index=False, border=2)}
-      <hr style="height:5px; background:#000; color: #000; border-width:0">
-      
-      <h1>Center Bay</h1>
-      <h2>5TM report - Center Bay</h2>
-      <h3>Zones status - 5TM</h3>
-      {readable_zone_df(zone_df_c_5tm).to_html(header=True, index=False, border=2)}
-      <h3>Sensors that are down.</h3>
-      {find_down_sensors(sensor_df_c_5tm, JSON_C).to_html(header=True, index=False, border=2)}
-      <h3>Sensors that are coming in and out of reporting values.</h3>
-      {find_sometimes_sensors(sensor_df_c_5tm).to_html(header=True, index=False, border=2)}
-      <h3>Sensors that are reporting outlier values.</h3>
-      {find_outlier_sensors(sensor_df_c_5tm).to_html(header=True, index=False, border=2)}
-    
-      <hr style="height:5px; background:#000; color: #000; border-width:0">
-      <h2>MPS2 report - Center Bay</h2>      
-      <h3>Zones status - MPS2</h3>
-      {readable_zone_df(zone_df_c_mps).to_html(header=True, index=False, border=2)}
-      <h3>Sensors that are down.</h3>
-      {find_down_sensors(sensor_df_c_mps, JSON_C).to_html(header=True, index=False, border=2)}
-      <h3>Sensors that are coming in and out of reporting values.</h3>
-      {find_sometimes_sensors(sensor_df_c_mps).to_html(header=True, index=False, border=2)}
-      <h3>Sensors that are reporting outlier values.</h3>
-      {find_outlier_sensors(sensor_df_c_mps).to_html(header=True, index=False, border=2)}
-      <hr style="height:5px; background:#000; color: #000; border-width:0">
+    bays = []
+    for bay, bay_name in BAY_NAMES.items():
+        sections = []
+        for sensor_type in [sensor_type for key_bay, sensor_type in keys if key_bay == bay]:
+            zone_df, sensor_df = dfs[(bay, sensor_type)]
+            #sensor to zone lookups come from the registry the detector already built
+            section = state_tables(sensor_df, sensor_registry.get_registry(bay))
+            section["zones"] = readable_zone_df(zone_df).to_html(header=True, index=False, border=2)
+            sections.append(TYPE_SECTION_TEMPLATE.substitute(section, label=types.get(sensor_type).label, bay_name=bay_name, rule=RULE))
 
-      <h1>West Bay</h1>
-      <h2>5TM report - West Bay</h2> 
-      <h3>Zones status - 5TM</h3>
-      {readable_zone_df(zone_df_w_5tm).to_html(header=True, index=False, border=2)}
-      <h3>Sensors that are down.</h3>
-      {find_down_sensors(sensor_df_w_5tm, JSON_W).to_html(header=True, index=False, border=2)}
-      <h3>Sensors that are coming in and out of reporting values.</h3>
-      {find_sometimes_sensors(sensor_df_w_5tm).to_html(header=True, index=False, border=2)}
-      <h3>Sensors that are reporting outlier values</h3>
-      {find_outlier_sensors(sensor_df_w_5tm).to_html(header=True, index=False, border=2)}
-
-      <hr style="height:5px; background:#000; color: #000; border-width:0">
-      <h2>MPS2 report - West Bay</h2>
-      <h3>Zones status - MPS2</h3>
-      {readable_zone_df(zone_df_w_mps).to_html(header=True, index=False, border=2)}
-      <h3>Sensors that are down.</h3>
-      {find_down_sensors(sensor_df_w_mps, JSON_W).to_html(header=True, index=False, border=2)}
-      <h3>Sensors that are coming in and out of reporting values.</h3>
-      {find_sometimes_sensors(sensor_df_w_mps).to_html(header=True, index=False, border=2)}
-      <h3>Sensors that are reporting outlier values</h3>
-      {find_outlier_sensors(sensor_df_w_mps).to_html(header=True, index=False, border=2)}
-    </body>
-    </html>
-    """
-    return html
+        if sections:
+            bays.append(BAY_TEMPLATE.substitute(bay_name=bay_name, sections="".join(sections)))
+
+    fields = {
+        "start_time": startTime,
+        "end_time": endTime,
+        "rule": RULE,
+        "bays": "".join(bays),
+        "long_term": long_term_section(keys),
+    }
 
-def send_email(html):
+    return REPORT_TEMPLATE.substitute(fields)
+
+def send_email(html, subject=SUBJECT, filename="zone_sensor_health_report.html"):
     # --- prepare an .html file on disk to attach ---
     today_str = datetime.date.today().strftime("%Y-%m-%d")
-    filename = f"zone_sensor_health_report.html"
     outpath = Path(ATTACH_DIR) / filename
     outpath.parent.mkdir(parents=True, exist_ok=True)
     outpath.write_text(html, encoding="utf-8")  # file artifact you can keep
 
     # --- build the email with both HTML body & attachment ---
     msg = EmailMessage()
-    msg["Subject"] = SUBJECT
+    msg["Subject"] = subject
     msg["From"] = FROM_ADDR
     msg["To"] = ", ".join(TO_ADDRS)
     msg["Date"] = formatdate(localtime=True)
@@ -223,42 +223,72 @@ def send_email(html):
     )
 
     # --- send ---
-    if USE_SSL:
-        import ssl
-        context = ssl.create_default_context()
-        with smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, context=context) as server:
-            if SMTP_USER:
-                server.login(SMTP_USER, SMTP_PASS)
-            server.send_message(msg)
+    with telemetry.stage("smtp") as record:
+        record["bytes"] = len(msg.as_bytes())
+        if USE_SSL:
+            import ssl
+            context = ssl.create_default_context()
+            with smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, context=context) as server:
+                if SMTP_USER:
+                    server.login(SMTP_USER, SMTP_PASS)
+                server.send_message(msg)
+        else:
+            with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
+                if USE_STARTTLS:
+                    server.starttls()
+                if SMTP_USER:
+                    server.login(SMTP_USER, SMTP_PASS)
+                server.send_message(msg)
+
+
+def result_to_dfs(result):
+    #converts a BayResult from the sensor_state_detector into the zone and sensor dataframes the report is built from
+
+    zone_df = pd.DataFrame({"zone": result.zone_names, "state": result.zone_states.astype("int64")})
+    sensor_df = pd.DataFrame({"sensor name": result.sensor_names, "state": result.states.astype("int64")})
+    return zone_df, sensor_df
+
+def main(results=None, mode=REPORT_MODE, window=None, states_dir=delta_report.STATES_DIR):
+    #results is the dictionary of (bay, sensor type) to BayResult returned by the detector, for the bays and sensor
+    #types of the run. Without it the states of every enabled sensor type are read back from the csvs the detector
+    #wrote in the outputs folder (see db/sensor_types.output_paths)
+    #mode is "full" or "delta", see REPORT_MODE
+    #window is an optional (startTime, endTime) shown in the report, see build_html
+    #states_dir is the folder of the states the delta report compares against, see delta_report.save_all
+
+    dfs = {}
+    if results is not None:
+        for key, result in results.items():
+            dfs[key] = result_to_dfs(result)
     else:
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
-            if USE_STARTTLS:
-                server.starttls()
-            if SMTP_USER:
-                server.login(SMTP_USER, SMTP_PASS)
-            server.send_message(msg)
-
-
-def main():
-    zone_df_c_5tm = pd.read_csv(ZONE_CSV_C_5TM)
-    sensor_df_c_5tm = pd.read_csv(SENSOR_CSV_C_5TM)
-
-    zone_df_e_5tm = pd.read_csv(ZONE_CSV_E_5TM)
-    sensor_df_e_5tm = pd.read_csv(SENSOR_CSV_E_5TM)
-
-    zone_df_w_5tm = pd.read_csv(ZONE_CSV_W_5TM)
-    sensor_df_w_5tm = pd.read_csv(SENSOR_CSV_W_5TM)
-
-    zone_df_c_mps = pd.read_csv(ZONE_CSV_C_MPS)
-    sensor_df_c_mps = pd.read_csv(SENSOR_CSV_C_MPS)
-
-    zone_df_e_mps = pd.read_csv(ZONE_CSV_E_MPS)
-    sensor_df_e_mps = pd.read_csv(SENSOR_CSV_E_MPS)
-
-    zone_df_w_mps = pd.read_csv(ZONE_CSV_W_MPS)
-    sensor_df_w_mps = pd.read_csv(SENSOR_CSV_W_MPS)
-
-    html = build_html(zone_df_c_5tm, sensor_df_c_5tm, zone_df_e_5tm, sensor_df_e_5tm, zone_df_w_5tm, sensor_df_w_5tm, zone_df_c_mps, sensor_df_c_mps, zone_df_e_mps, sensor_df_e_mps, zone_df_w_mps, sensor_df_w_mps)
-
-    send_email(html)
-    print("Email sent.")
\ No newline at end of file
+        for bay in BAY_NAMES:
+            for sensor_type in types.ENABLED:
+                zone_csv, sensor_csv = types.output_paths(bay, sensor_type)
+                if os.path.exists(zone_csv) and os.path.exists(sensor_csv):
+                    dfs[(bay, sensor_type)] = (pd.read_csv(zone_csv), pd.read_csv(sensor_csv))
+
+    sensor_dfs = {key: sensor_df for key, (zone_df, sensor_df) in dfs.items()}
+
+    html = None
+    if mode == "delta":
+        #falls back to the full report when there is no previous run to compare against
+        with telemetry.stage("report") as record:
+            html, n_changes = delta_report.build_delta_html(sensor_dfs, WINDOW_DAYS, window, states_dir)
+            record["bytes"] = len(html or "")
+        if html is not None:
+            if n_changes > 0:
+                send_email(html, DELTA_SUBJECT, "zone_sensor_health_changes.html")
+                print(f"Email sent ({n_changes} state changes).")
+            else:
+                print("No state changes since the previous run, no email sent.")
+
+    if html is None:
+        with telemetry.stage("report") as record:
+            html = build_html(dfs, window)
+            record["bytes"] = len(html)
+
+        send_email(html)
+        print("Email sent.")
+
+    #the states of this run are the baseline of the next delta report
+    delta_report.save_all(sensor_dfs, states_dir)
\ No newline at end of file
@@ -0,0 +1,238 @@
+"""
+In-process pipeline for the automated sensor monitor. Each stage hands its results straight to the next one:
+the fetch stage returns SampleSets, the detector turns them into BayResults, and the email reporter renders those.
+Writing the sample stores and state csvs is an optional side output, so the monitor can also be embedded in a
+long-running process without any disk round trips between stages.
+
+A run is a DAG of these stages (see dag.py): per bay masterlist -> fetch -> detect, then the state history and the
+email report of every bay. The bays run in parallel, and a stage whose inputs did not change since its last successful
+run is skipped and its output read back from the files it wrote, so re-running after an email failure only sends the
+email again.
+"""
+
+import config
+import dag
+import telemetry
+from db import connection
+from db import data_fetch
+from db import fetch_engine
+from db import sensor_types as types
+from detection import sensor_state_detector
+from detection import state_history
+from outputs import email_reporter
+from masterlists import masterlist_json_creator
+from masterlists import sensor_catalog
+
+
+BAYS = ["E", "C", "W"]
+
+#write the sample stores and state csvs between stages
+WRITE_FILES = getattr(config, "write_stage_files", True)
+
+#append the state changes of every run to the state history database
+STATE_HISTORY = getattr(config, "state_history", True)
+
+#skip the stages whose inputs did not change since their last successful run (needs write_stage_files)
+SKIP_UNCHANGED = getattr(config, "skip_unchanged", True)
+
+
+def fetch(bays=BAYS, write_files=WRITE_FILES):
+    '''
+    Queries every bay and sensor type at the same time
+
+    Inputs:
+    bays: list of bay strings ("E", "C", "W")
+
+    write_files: also write the sample stores (or features csvs)
+
+    Outputs:
+    a dictionary of (bay, sensor_type) to SampleSet (or features dictionary)
+    '''
+    return fetch_engine.fetch_all(bays, write_files=write_files)
+
+
+def detect(samples, bays=BAYS, write_files=WRITE_FILES):
+    '''
+    Finds the sensor and zone states of every bay from the fetched samples
+
+    Inputs:
+    samples: the output of fetch
+
+    bays: list of bay strings ("E", "C", "W")
+
+    write_files: also write the state csvs in the outputs folder
+
+    Outputs:
+    a dictionary of (bay, sensor_type) to BayResult
+    '''
+    results = {}
+    for bay in bays:
+        results.update(sensor_state_detector.main(bay, samples=samples, write_files=write_files))
+    return results
+
+
+def data_hash(data):
+    #content hash of the output of a fetch, a dictionary of sensor type to SampleSet (or features dictionary)
+    parts = []
+    for sensor_type in sorted(data):
+        if data_fetch.FETCH_MODE == "features":
+            parts.append(data[sensor_type])
+        else:
+            samples = data[sensor_type]
+            parts += [samples.sensor_names, samples.timestamps.tobytes(), samples.values.tobytes()]
+    return dag.content_hash(*parts)
+
+
+def results_hash(results):
+    #content hash of the states of a dictionary of (bay, sensor_type) to BayResult
+    parts = []
+    for key in sorted(results):
+        result = results[key]
+        parts += [list(key), result.sensor_names, result.states.tobytes(), result.zone_names,
+                  result.zone_states.tobytes()]
+    return dag.content_hash(*parts)
+
+
+def merge(values):
+    #merges the outputs of the detect nodes into one dictionary of (bay, sensor_type) to BayResult
+    results = {}
+    for bay_results in values.values():
+        results.update(bay_results)
+    return results
+
+
+def build_nodes(bays=BAYS, write_files=WRITE_FILES, send_email=True, skip_unchanged=SKIP_UNCHANGED):
+    '''
+    Builds the DAG of a run. Every bay gets a masterlist, fetch and detect node, and the state history and email report
+    depend on the detect nodes of every bay
+
+    Inputs:
+    bays: list of bay strings ("E", "C", "W")
+
+    write_files: also write the intermediate files of each stage
+
+    send_email: add the email report node
+
+    skip_unchanged: let nodes be skipped when their inputs did not change. Skipped stages read the outputs of the
+    stages before them from disk, so this is off when write_files is off
+
+    Outputs:
+    a list of dag.Nodes
+    '''
+    skip = skip_unchanged and write_files
+    sensor_types = sensor_state_detector.SENSOR_TYPES
+    nodes = []
+
+    for bay in bays:
+        f_excel, f_json = masterlist_json_creator.paths(bay)
+
+        def run_masterlist(values, bay=bay):
+            with telemetry.stage("masterlist", bay):
+                masterlist_json_creator.main(bay)
+
+        nodes.append(dag.Node(
+            "masterlist " + bay, run_masterlist,
+            inputs=(lambda f_excel=f_excel: [masterlist_json_creator.file_hash(f_excel)]) if skip else None,
+            outputs=lambda f_json=f_json: [f_json],
+            digest=lambda value, f_json=f_json: masterlist_json_creator.file_hash(f_json),
+            stage="masterlist", bay=bay,
+        ))
+
+        #incremental fetches query up to the current minute, so they always run
+        def fetch_inputs(bay=bay):
+            if data_fetch.INCREMENTAL:
+                return None
+            return [data_fetch.query_window(), sensor_types, data_fetch.FETCH_MODE, sensor_catalog.source_hash(bay)]
+
+        def fetch_outputs(bay=bay):
+            if data_fetch.FETCH_MODE == "features":
+                return [types.features_path(bay, sensor_type) for sensor_type in sensor_types]
+            return [types.sample_store_path(bay, sensor_type) for sensor_type in sensor_types]
+
+        nodes.append(dag.Node(
+            "fetch " + bay,
+            lambda values, bay=bay: data_fetch.main_data(bay, sensor_types, timeout=fetch_engine.QUERY_TIMEOUT,
+                                                         write_files=write_files),
+            deps=["masterlist " + bay],
+            inputs=fetch_inputs if skip else None,
+            outputs=fetch_outputs,
+            digest=data_hash,
+            stage="fetch", bay=bay,
+        ))
+
+        #a skipped fetch hands over None, the detector then reads the sample stores
+        def run_detect(values, bay=bay):
+            data = values["fetch " + bay]
+            samples = None if data is None else {(bay, sensor_type): value for sensor_type, value in data.items()}
+            return sensor_state_detector.main(bay, samples=samples, write_files=write_files)
+
+        nodes.append(dag.Node(
+            "detect " + bay, run_detect,
+            deps=["masterlist " + bay, "fetch " + bay],
+            inputs=sensor_state_detector.settings if skip else None,
+            outputs=lambda bay=bay: [path for sensor_type in sensor_types
+                                     for path in types.output_paths(bay, sensor_type)],
+            load=lambda bay=bay: {(bay, sensor_type): sensor_state_detector.read_result(bay, sensor_type)
+                                  for sensor_type in sensor_types},
+            digest=results_hash,
+            stage="detect", bay=bay,
+        ))
+
+    detect_nodes = ["detect " + bay for bay in bays]
+
+    if STATE_HISTORY:
+        def run_state_history(values):
+            with telemetry.stage("state_history"):
+                state_history.record(merge(values))
+
+        #the query window is part of the inputs of the state history and the report, so a new day with the same
+        #states still records its run and sends its email, and only a re-run of the same window is skipped
+        nodes.append(dag.Node(
+            "state_history", run_state_history, deps=detect_nodes,
+            inputs=(lambda: [data_fetch.query_window(), state_history.HISTORY_DB]) if skip else None,
+            outputs=lambda: [state_history.HISTORY_DB],
+        ))
+
+    #reports sensor health states via email
+    if send_email:
+        nodes.append(dag.Node(
+            "report", lambda values: email_reporter.main(merge(values)), deps=detect_nodes,
+            inputs=(lambda: [data_fetch.query_window(), email_reporter.REPORT_MODE, email_reporter.TO_ADDRS])
+            if skip else None,
+        ))
+
+    return nodes
+
+
+def run(bays=BAYS, write_files=WRITE_FILES, send_email=True, force=False):
+    '''
+    Runs the whole monitor: masterlists, fetch, detection and the email report
+
+    Inputs:
+    bays: list of bay strings ("E", "C", "W")
+
+    write_files: also write the intermediate files of each stage
+
+    send_email: send the report once the states are known
+
+    force: run every stage, even the ones whose inputs did not change since the last run
+
+    Outputs:
+    a dictionary of (bay, sensor_type) to BayResult
+    '''
+    #every stage is timed, the run record is appended to the telemetry file once the run ends (see telemetry.py)
+    telemetry.start_run(bays=bays, sensor_types=sensor_state_detector.SENSOR_TYPES)
+
+    try:
+        try:
+            values = dag.run_dag(build_nodes(bays, write_files, send_email), force=force)
+        finally:
+            #all queries share one session pool, closed once the run is done
+            connection.close_pool()
+    except Exception as e:
+        telemetry.finish_run(e)
+        raise
+
+    telemetry.finish_run()
+
+    return merge({name: value for name, value in values.items() if name.startswith("detect ")})
@@ -0,0 +1,178 @@
+"""
+Run telemetry for the automated sensor monitor. Every stage of a run (masterlists, the database query of each bay, the
+sample stores and detection of each bay and sensor type, the report and the email) is timed with telemetry.stage,
+which records its wall time, the CPU time of the thread it ran on, the peak RSS of the process when it finished and
+any counts the stage adds (rows fetched, bytes transferred, ...). At the end of a run pipeline.py appends one JSON line
+with all of its stages to data/telemetry.jsonl, so slow runs and performance regressions can be traced to a stage.
+"""
+
+import contextlib
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+
+import pandas as pd
+
+import config
+
+try:
+    import resource
+except ImportError:
+    #not available on Windows, see peak_rss_mb
+    resource = None
+
+
+#record the stages of every run, and the file the run records are appended to
+TELEMETRY = getattr(config, "telemetry", True)
+TELEMETRY_FILE = getattr(config, "telemetry_file", "data/telemetry.jsonl")
+
+#also ask the database for the bytes each query sent and received (needs select access to v$mystat)
+DB_BYTES = TELEMETRY and getattr(config, "telemetry_db_bytes", True)
+
+#the run being recorded, stages outside of a run (e.g. a backfill) are not kept
+_run = None
+_run_lock = threading.Lock()
+
+
+def peak_rss_mb():
+    '''
+    Returns the peak resident set size of the process so far in MB, or None where it cannot be read
+    '''
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        #kilobytes on linux, bytes on macOS
+        return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+                (name, ctypes.c_size_t) for name in ["PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage",
+                "QuotaPagedPoolUsage", "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage", "PagefileUsage",
+                "PeakPagefileUsage"]]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return round(counters.PeakWorkingSetSize / 2**20, 1)
+
+    return None
+
+
+def start_run(**info):
+    '''
+    Starts recording a run, the stages timed from now on are part of it
+
+    Inputs:
+    info: values stored in the run record as they are, e.g. the bays of the run
+
+    Outputs:
+    None
+    '''
+    global _run
+
+    with _run_lock:
+        _run = dict(info, start=datetime.datetime.now().isoformat(timespec="seconds"), stages=[],
+                    wall=time.perf_counter(), cpu=time.process_time())
+
+
+@contextlib.contextmanager
+def stage(name, bay=None, sensor_type=None):
+    '''
+    Times one stage of a run. Used as a with statement, it gives a record dictionary the stage can add its counts to
+    (e.g. record["rows"] = n). The record is added to the current run when the stage ends, with "ok" False if the
+    stage raised
+
+    Inputs:
+    name: name of the stage, e.g. "fetch"
+
+    bay, sensor_type: the bay and sensor type the stage works on, None for stages of the whole run
+
+    Outputs:
+    the record dictionary of the stage
+    '''
+    record = {"stage": name, "bay": bay, "sensor_type": sensor_type, "ok": False}
+    wall = time.perf_counter()
+    #stages run on a single thread, so the CPU time of other threads (e.g. the fetches of other bays) is left out
+    cpu = time.thread_time()
+
+    try:
+        yield record
+        record["ok"] = True
+    finally:
+        record["wall_s"] = round(time.perf_counter() - wall, 3)
+        record["cpu_s"] = round(time.thread_time() - cpu, 3)
+        record["peak_rss_mb"] = peak_rss_mb()
+
+        with _run_lock:
+            if _run is not None:
+                _run["stages"].append(record)
+
+
+def finish_run(error=None, path=TELEMETRY_FILE):
+    '''
+    Ends the run and appends its record to the telemetry file (if telemetry is turned on)
+
+    Inputs:
+    error: the exception that stopped the run, None if it finished
+
+    path: filename/path of the JSON lines telemetry file
+
+    Outputs:
+    the run record dictionary, None if no run was started
+    '''
+    global _run
+
+    with _run_lock:
+        run, _run = _run, None
+
+    if run is None:
+        return None
+
+    run["end"] = datetime.datetime.now().isoformat(timespec="seconds")
+    run["ok"] = error is None
+    run["error"] = None if error is None else repr(error)
+    run["wall_s"] = round(time.perf_counter() - run.pop("wall"), 3)
+    run["cpu_s"] = round(time.process_time() - run.pop("cpu"), 3)
+    run["peak_rss_mb"] = peak_rss_mb()
+    #keeps the stages at the end of the record
+    run["stages"] = run.pop("stages")
+
+    if TELEMETRY:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "a") as f:
+            f.write(json.dumps(run) + "\n")
+
+        for record in run["stages"]:
+            label = " ".join(str(record[key]) for key in ["stage", "bay", "sensor_type"] if record[key] is not None)
+            print("{:<24}{:>9.2f} s wall{:>9.2f} s cpu{}".format(label, record["wall_s"], record["cpu_s"],
+                                                                 " (skipped)" if record.get("skipped") else ""))
+
+    return run
+
+
+def load_stages(path=TELEMETRY_FILE):
+    '''
+    Loads the stages of every recorded run, to compare the stage timings of runs over time
+
+    Inputs:
+    path: filename/path of the JSON lines telemetry file
+
+    Outputs:
+    a dataframe with one row per stage of a run, with the start of its run in the "run" column
+    '''
+    rows = []
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    run = json.loads(line)
+                    rows.extend(dict(record, run=run["start"]) for record in run["stages"])
+
+    return pd.DataFrame(rows)